@@ -0,0 +1,327 @@
+"""Batch planning for cache warm-up and catalog-wide precomputation.
+
+Runs ``parse_intent`` -> ``get_candidate_products`` -> ``plan_products_with_llm``
+for many messages with bounded parallelism and appends one JSON line per
+message to the output file as soon as it finishes. Messages already recorded
+as ``"ok"`` in the output are skipped, so an interrupted run resumes where it
+stopped::
+
+    python -m backend.batch --all-intents -o plans.jsonl -j 16
+    python -m backend.batch -i messages.txt -o plans.jsonl
+
+Plans are cached in the shared state, so set ``BACKEND_STATE_URL`` to the
+server's store when warming its cache. For large runs the planner calls can go
+through the OpenAI Batch API instead (cheaper, higher limits, asynchronous)::
+
+    python -m backend.batch --all-intents --emit-openai-batch requests.jsonl
+    # upload requests.jsonl as a batch job, download its output file, then:
+    python -m backend.batch --all-intents --import-openai-batch output.jsonl -o plans.jsonl
+
+Only live planning calls a model, so only that path unlocks the encrypted
+environment; the model clients read their API keys when they are first used.
+Settings read at import time, such as ``BACKEND_STATE_URL``, must be set in the
+process environment.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Set, TextIO
+
+from .cache import hash_key
+from .intent import (
+    BUDGET_HINTS,
+    RETRIEVAL_ENABLED,
+    ROOM_KEYWORDS,
+    STYLE_KEYWORDS,
+    get_candidate_products,
+    parse_intent,
+)
+from .llm_planner import (
+    close_client,
+    plan_products_with_llm,
+    planner_batch_body,
+    planner_cache_key,
+    store_batch_plan,
+)
+from .retrieval import get_retriever
+from .scheduler import Overloaded
+from .secure_env import ensure_encrypted_env
+from .shared_state import close_shared_state, shared_state
+
+logger = logging.getLogger(__name__)
+
+MAX_OVERLOAD_RETRIES = 5
+
+
+def intent_messages() -> List[Dict[str, str]]:
+    """One message per room x style x budget combination, using the first keyword of each."""
+    rooms = _first_keywords(ROOM_KEYWORDS)
+    styles = _first_keywords(STYLE_KEYWORDS.items())
+    budgets = _first_keywords(BUDGET_HINTS.items())
+    return [
+        {
+            "id": f"{room}.{style}.{budget}",
+            "message": f"{room_word} {style_word} 스타일로 {budget_word} 가격대 가구 추천해줘",
+        }
+        for (room, room_word), (style, style_word), (budget, budget_word) in itertools.product(
+            rooms.items(), styles.items(), budgets.items()
+        )
+    ]
+
+
+def read_messages(path: Path) -> List[Dict[str, str]]:
+    """Read plain-text lines or JSONL objects with ``message`` (and optional ``id``)."""
+    items = []
+    with path.open(encoding="utf-8") as handle:
+        for line in handle:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                record = json.loads(line)
+                message = str(record.get("message") or "")
+                item_id = str(record.get("id") or hash_key(message)[:16])
+            else:
+                message, item_id = line, hash_key(line)[:16]
+            items.append({"id": item_id, "message": message})
+    return items
+
+
+def completed_ids(path: Path) -> Set[str]:
+    """IDs already planned successfully in an earlier run's output."""
+    done: Set[str] = set()
+    if not path.exists():
+        return done
+    with path.open(encoding="utf-8") as handle:
+        for line in handle:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Truncated last line from an interrupted run.
+            if record.get("status") == "ok":
+                done.add(str(record.get("id")))
+    return done
+
+
+class _Prepared:
+    __slots__ = ("item", "intent", "candidates", "cache_key")
+
+    def __init__(self, item: Dict[str, str]) -> None:
+        self.item = item
+        self.intent = parse_intent(item["message"])
+        self.candidates = get_candidate_products(self.intent, query=item["message"])
+        self.cache_key = planner_cache_key(item["message"], self.intent, self.candidates)
+
+    def record(self, status: str, **fields: object) -> Dict[str, object]:
+        return {
+            "id": self.item["id"],
+            "message": self.item["message"],
+            "intent": self.intent,
+            "candidate_ids": [str(product["id"]) for product in self.candidates],
+            "cache_key": self.cache_key,
+            "status": status,
+            **fields,
+        }
+
+
+async def run_batch(
+    items: Iterable[Dict[str, str]],
+    output: TextIO,
+    concurrency: int,
+    refresh: bool = False,
+) -> Dict[str, int]:
+    """Plan every item with at most ``concurrency`` planner calls in flight."""
+    counts = {"ok": 0, "error": 0}
+    pending: "asyncio.Queue[Dict[str, str]]" = asyncio.Queue()
+    for item in items:
+        pending.put_nowait(item)
+
+    async def worker() -> None:
+        while True:
+            try:
+                item = pending.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            record = await _plan_one(item, refresh)
+            counts[str(record["status"])] += 1
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return counts
+
+
+async def _plan_one(item: Dict[str, str], refresh: bool) -> Dict[str, object]:
+    started = time.perf_counter()
+    prepared = await asyncio.to_thread(_Prepared, item)
+    retries = 0
+    while True:
+        try:
+            plan = await plan_products_with_llm(
+                item["message"],
+                prepared.intent,
+                prepared.candidates,
+                use_cache=not refresh,
+                raise_errors=True,
+            )
+            break
+        except Overloaded as error:
+            # The scheduler sheds us when the provider limits are reached; back off and retry.
+            if retries == MAX_OVERLOAD_RETRIES:
+                return prepared.record("error", error=f"Overloaded: {error}")
+            retries += 1
+            await asyncio.sleep(error.retry_after)
+        except Exception as error:
+            logger.warning("Planning %s failed: %s", item["id"], error)
+            return prepared.record("error", error=f"{type(error).__name__}: {error}")
+    return prepared.record(
+        "ok",
+        selected_product_ids=plan["selected_product_ids"],
+        assistant_message=plan["assistant_message"],
+        elapsed_ms=round((time.perf_counter() - started) * 1000, 1),
+    )
+
+
+def emit_openai_batch(items: Iterable[Dict[str, str]], output: TextIO) -> int:
+    """Write one Batch API request per distinct planner cache key; returns the request count."""
+    seen: Set[str] = set()
+    for item in items:
+        prepared = _Prepared(item)
+        if prepared.cache_key in seen:
+            continue
+        seen.add(prepared.cache_key)
+        request = {
+            "custom_id": prepared.cache_key,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": planner_batch_body(item["message"], prepared.intent, prepared.candidates),
+        }
+        output.write(json.dumps(request, ensure_ascii=False) + "\n")
+    return len(seen)
+
+
+async def import_openai_batch(
+    items: Iterable[Dict[str, str]], batch_output: Path, output: TextIO
+) -> Dict[str, int]:
+    """Cache the plans from a Batch API output file and record them for matching items."""
+    by_key: Dict[str, List[_Prepared]] = {}
+    for item in items:
+        prepared = _Prepared(item)
+        by_key.setdefault(prepared.cache_key, []).append(prepared)
+
+    counts = {"ok": 0, "error": 0, "unmatched": 0}
+    for line in _read_lines(batch_output):
+        result = json.loads(line)
+        cache_key = str(result.get("custom_id"))
+        matches = by_key.get(cache_key)
+        if not matches:
+            counts["unmatched"] += 1
+            continue
+        try:
+            response = result.get("response") or {}
+            if result.get("error") or response.get("status_code") != 200:
+                raise ValueError(json.dumps(result.get("error") or response.get("body"), ensure_ascii=False))
+            content = response["body"]["choices"][0]["message"]["content"] or ""
+            plan = await store_batch_plan(cache_key, content, matches[0].candidates)
+            fields: Dict[str, object] = {
+                "selected_product_ids": plan["selected_product_ids"],
+                "assistant_message": plan["assistant_message"],
+            }
+            status = "ok"
+        except Exception as error:
+            fields = {"error": f"{type(error).__name__}: {error}"}
+            status = "error"
+        for prepared in matches:
+            counts[status] += 1
+            output.write(json.dumps(prepared.record(status, **fields), ensure_ascii=False) + "\n")
+    return counts
+
+
+def _first_keywords(pairs: Iterable[tuple]) -> Dict[str, str]:
+    """Map each value to the first keyword that produces it."""
+    first: Dict[str, str] = {}
+    for keyword, value in pairs:
+        first.setdefault(value, keyword)
+    return first
+
+
+def _read_lines(path: Path) -> Iterator[str]:
+    with path.open(encoding="utf-8") as handle:
+        for line in handle:
+            if line.strip():
+                yield line
+
+
+async def _main(args: argparse.Namespace, items: List[Dict[str, str]]) -> Dict[str, int]:
+    try:
+        with open(args.output, "a", encoding="utf-8") as output:
+            if args.import_openai_batch:
+                return await import_openai_batch(items, Path(args.import_openai_batch), output)
+            return await run_batch(items, output, args.concurrency, args.refresh)
+    finally:
+        await close_client()
+        await close_shared_state()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Plan recommendations for many messages at once.")
+    parser.add_argument("-i", "--input", help="Messages: one per line, or JSONL with 'message' and 'id'")
+    parser.add_argument("--all-intents", action="store_true", help="Every room x style x budget combination")
+    parser.add_argument("-o", "--output", default="plans.jsonl", help="JSONL results, appended (default: plans.jsonl)")
+    parser.add_argument("-j", "--concurrency", type=int, default=8, help="Planner calls in flight (default: 8)")
+    parser.add_argument("--refresh", action="store_true", help="Ignore cached plans and ask the model again")
+    parser.add_argument("--no-resume", action="store_true", help="Re-plan items already in the output file")
+    parser.add_argument("--emit-openai-batch", metavar="PATH", help="Write Batch API requests instead of calling")
+    parser.add_argument("--import-openai-batch", metavar="PATH", help="Load a Batch API output file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    items = intent_messages() if args.all_intents else []
+    if args.input:
+        items.extend(read_messages(Path(args.input)))
+    if not items:
+        parser.error("Give --input and/or --all-intents.")
+    if RETRIEVAL_ENABLED:
+        # Rank candidates the way a warmed-up server does, or the cache keys would not match.
+        get_retriever(wait=True)
+
+    if args.emit_openai_batch:
+        with open(args.emit_openai_batch, "w", encoding="utf-8") as output:
+            written = emit_openai_batch(items, output)
+        print(f"Wrote {written} batch requests for {len(items)} messages -> {args.emit_openai_batch}")
+        return
+
+    if not args.import_openai_batch:
+        ensure_encrypted_env()
+        if not args.no_resume:
+            done = completed_ids(Path(args.output))
+            items = [item for item in items if item["id"] not in done]
+    if shared_state.in_process:
+        logger.warning("BACKEND_STATE_URL is memory://; plans are written to %s but no server cache is warmed.", args.output)
+
+    started = time.perf_counter()
+    counts = asyncio.run(_main(args, items))
+    print(
+        f"Planned {len(items)} messages in {time.perf_counter() - started:.1f}s "
+        f"({', '.join(f'{name}={count}' for name, count in counts.items())}) -> {args.output}"
+    )
+
+
+__all__ = [
+    "emit_openai_batch",
+    "import_openai_batch",
+    "intent_messages",
+    "read_messages",
+    "run_batch",
+]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""Content-addressed on-disk store for uploaded and generated images."""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import AsyncIterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+BLOB_DIR = Path(os.getenv("BLOB_STORE_DIR") or Path(__file__).with_name(".data") / "blobs")
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+# Uploads are anonymous, so the store is bounded like the disk cache: by total size
+# (least recently used first) and by age.
+BLOB_STORE_MAX_BYTES = int(os.getenv("BLOB_STORE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+BLOB_STORE_TTL_SECONDS = float(os.getenv("BLOB_STORE_TTL_SECONDS", str(7 * 24 * 3600)))
+BLOB_URL_PREFIX = "/images/"
+# Expired blobs are swept after this many writes even while under the size limit.
+_SWEEP_EVERY_WRITES = 256
+# Streamed uploads are buffered to this size before each write to disk.
+_STREAM_WRITE_BYTES = 1024 * 1024
+
+_BLOB_ID_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+class BlobTooLarge(ValueError):
+    """Raised when an upload exceeds the configured size limit."""
+
+
+class UnsupportedImage(ValueError):
+    """Raised when stored bytes are not a recognised image format."""
+
+
+def sniff_image_mime(head: bytes) -> Optional[str]:
+    """Identify common image formats from their leading magic bytes."""
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if head[4:12] in (b"ftypheic", b"ftypheix", b"ftypmif1"):
+        return "image/heic"
+    return None
+
+
+def blob_url(blob_id: str) -> str:
+    return f"{BLOB_URL_PREFIX}{blob_id}"
+
+
+def parse_blob_url(url: Optional[str]) -> Optional[str]:
+    """Return the blob ID for store-relative ``/images/<id>`` URLs."""
+    if not url or not url.startswith(BLOB_URL_PREFIX):
+        return None
+    candidate = url[len(BLOB_URL_PREFIX) :].split("?", 1)[0]
+    return candidate if is_blob_id(candidate) else None
+
+
+def is_blob_id(value: str) -> bool:
+    return bool(_BLOB_ID_PATTERN.match(value or ""))
+
+
+class BlobStore:
+    """Stores each image once under the sha256 of its bytes.
+
+    ``max_bytes`` limits a single image. The store as a whole is kept under
+    ``max_total_bytes`` and drops blobs older than ``ttl_seconds``; reads
+    refresh the modification time so eviction drops the least recently used
+    blobs first.
+    """
+
+    def __init__(
+        self,
+        directory: Path = BLOB_DIR,
+        max_bytes: int = UPLOAD_MAX_BYTES,
+        max_total_bytes: int = BLOB_STORE_MAX_BYTES,
+        ttl_seconds: float = BLOB_STORE_TTL_SECONDS,
+    ) -> None:
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.max_total_bytes = max_total_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._total_bytes = sum(path.stat().st_size for path in self._blob_paths())
+
+    def path_for(self, blob_id: str) -> Path:
+        if not is_blob_id(blob_id):
+            raise KeyError(blob_id)
+        return self.directory / blob_id[:2] / blob_id
+
+    def exists(self, blob_id: str) -> bool:
+        try:
+            return self.path_for(blob_id).exists()
+        except KeyError:
+            return False
+
+    def read(self, blob_id: str) -> Tuple[bytes, str]:
+        path = self.path_for(blob_id)
+        try:
+            data = path.read_bytes()
+            _touch(path)
+        except FileNotFoundError as error:
+            raise KeyError(blob_id) from error
+        return data, sniff_image_mime(data[:16]) or "application/octet-stream"
+
+    def mime_of(self, blob_id: str) -> str:
+        """Sniff the stored format; called when serving, so it also counts as a read."""
+        path = self.path_for(blob_id)
+        with path.open("rb") as handle:
+            head = handle.read(16)
+        _touch(path)
+        return sniff_image_mime(head) or "application/octet-stream"
+
+    def put(self, data: bytes) -> str:
+        """Store ``data`` and return its blob ID."""
+        if len(data) > self.max_bytes:
+            raise BlobTooLarge(f"Image exceeds {self.max_bytes} bytes")
+        if not sniff_image_mime(data[:16]):
+            raise UnsupportedImage("Unsupported image format")
+        blob_id = hashlib.sha256(data).hexdigest()
+        path = self.path_for(blob_id)
+        if path.exists():
+            _touch(path)
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as handle:
+                    handle.write(data)
+                os.replace(tmp_name, path)
+            except BaseException:
+                Path(tmp_name).unlink(missing_ok=True)
+                raise
+            self._added(len(data))
+        return blob_id
+
+    async def put_stream(self, chunks: AsyncIterable[bytes]) -> Tuple[str, int]:
+        """Stream ``chunks`` to disk while hashing them; return the blob ID and its size.
+
+        The upload is aborted as soon as it exceeds ``max_bytes`` or when its
+        first bytes are not a recognised image format. Disk writes happen in
+        worker threads, in batches of about a megabyte.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        head = b""
+        pending: List[bytes] = []
+        pending_bytes = 0
+        fd, tmp_name = await asyncio.to_thread(_make_temp, self.directory)
+        try:
+            with os.fdopen(fd, "wb") as handle:
+                async for chunk in chunks:
+                    if not chunk:
+                        continue
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise BlobTooLarge(f"Image exceeds {self.max_bytes} bytes")
+                    if len(head) < 16:
+                        head += chunk[: 16 - len(head)]
+                        if len(head) >= 16 and not sniff_image_mime(head):
+                            raise UnsupportedImage("Unsupported image format")
+                    digest.update(chunk)
+                    pending.append(chunk)
+                    pending_bytes += len(chunk)
+                    if pending_bytes >= _STREAM_WRITE_BYTES:
+                        await asyncio.to_thread(handle.writelines, pending)
+                        pending, pending_bytes = [], 0
+                if pending:
+                    await asyncio.to_thread(handle.writelines, pending)
+            if not sniff_image_mime(head):
+                raise UnsupportedImage("Unsupported image format")
+            blob_id = digest.hexdigest()
+            await asyncio.to_thread(self._commit_temp, tmp_name, blob_id, size)
+            return blob_id, size
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+
+    def evict(self) -> None:
+        """Drop expired blobs, then the least recently used until under ``max_total_bytes``."""
+        with self._lock:
+            now = time.time()
+            entries = []
+            total = 0
+            for path in self._blob_paths():
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                if now - stat.st_mtime > self.ttl_seconds:
+                    path.unlink(missing_ok=True)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_total_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+            self._total_bytes = total
+            self._writes = 0
+        logger.info("Blob store holds %d bytes after eviction", total)
+
+    def _commit_temp(self, tmp_name: str, blob_id: str, size: int) -> None:
+        path = self.path_for(blob_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.exists():
+            Path(tmp_name).unlink(missing_ok=True)
+            _touch(path)
+            return
+        os.replace(tmp_name, path)
+        self._added(size)
+
+    def _added(self, size: int) -> None:
+        with self._lock:
+            self._total_bytes += size
+            self._writes += 1
+            due = self._total_bytes > self.max_total_bytes or self._writes >= _SWEEP_EVERY_WRITES
+        if due:
+            self.evict()
+
+    def _blob_paths(self) -> Iterator[Path]:
+        return (path for path in self.directory.glob("??/*") if path.suffix != ".tmp" and path.is_file())
+
+
+def _make_temp(directory: Path) -> Tuple[int, str]:
+    directory.mkdir(parents=True, exist_ok=True)
+    return tempfile.mkstemp(dir=directory, suffix=".tmp")
+
+
+def _touch(path: Path) -> None:
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+
+blob_store = BlobStore()
+
+
+__all__ = [
+    "BLOB_URL_PREFIX",
+    "BlobStore",
+    "BlobTooLarge",
+    "UnsupportedImage",
+    "blob_store",
+    "blob_url",
+    "is_blob_id",
+    "parse_blob_url",
+    "sniff_image_mime",
+]
@@ -0,0 +1,182 @@
+"""Small in-memory and on-disk caches shared by the expensive pipeline stages."""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Generic, Hashable, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+DEFAULT_CACHE_DIR = Path(os.getenv("BACKEND_CACHE_DIR") or Path(__file__).with_name(".cache"))
+
+
+def hash_key(*parts: object) -> str:
+    """Return a stable sha256 hex digest for the given key parts."""
+    digest = hashlib.sha256()
+    for part in parts:
+        data = part if isinstance(part, bytes) else str(part).encode("utf-8")
+        digest.update(len(data).to_bytes(8, "big"))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+class TTLCache(Generic[K, V]):
+    """Thread-safe LRU cache whose entries also expire after ``ttl_seconds``."""
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 3600.0) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[K, tuple[float, V]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: K) -> Optional[V]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: K, value: V) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskCache:
+    """Directory of content-addressed files with TTL and total-size eviction.
+
+    Files are named after their key; reads refresh the modification time so the
+    size-based eviction drops the least recently used entries first.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int, ttl_seconds: float) -> None:
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._total_bytes = sum(path.stat().st_size for path in self._entry_paths())
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path_for(key)
+        try:
+            stat = path.stat()
+            if time.time() - stat.st_mtime > self.ttl_seconds:
+                self._remove(path)
+                self._count(hit=False)
+                return None
+            data = path.read_bytes()
+            os.utime(path, None)
+        except FileNotFoundError:
+            self._count(hit=False)
+            return None
+        self._count(hit=True)
+        return data
+
+    def set(self, key: str, data: bytes) -> None:
+        path = self._path_for(key)
+        try:
+            previous_size = path.stat().st_size
+        except FileNotFoundError:
+            previous_size = 0
+        fd, tmp_name = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as handle:
+                handle.write(data)
+            os.replace(tmp_name, path)
+        except OSError as error:
+            logger.warning("Failed to write cache entry %s: %s", key, error)
+            Path(tmp_name).unlink(missing_ok=True)
+            return
+        with self._lock:
+            self._total_bytes += len(data) - previous_size
+            over_budget = self._total_bytes > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def evict(self) -> None:
+        """Drop expired entries, then the least recently used until under ``max_bytes``."""
+        with self._lock:
+            now = time.time()
+            entries = []
+            total = 0
+            for path in self._entry_paths():
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                if now - stat.st_mtime > self.ttl_seconds:
+                    path.unlink(missing_ok=True)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+            self._total_bytes = total
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "bytes": self._total_bytes}
+
+    def _count(self, hit: bool) -> None:
+        # get() runs in worker threads; ``+=`` on an attribute is not atomic.
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _path_for(self, key: str) -> Path:
+        return self.directory / key
+
+    def _entry_paths(self):
+        return (path for path in self.directory.iterdir() if path.is_file() and path.suffix != ".tmp")
+
+    def _remove(self, path: Path) -> None:
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self._total_bytes -= size
+
+
+__all__ = ["DEFAULT_CACHE_DIR", "DiskCache", "TTLCache", "hash_key"]
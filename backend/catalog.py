@@ -0,0 +1,363 @@
+"""Product catalog snapshots backed by the built-in list or an on-disk catalog file.
+
+Set ``BACKEND_CATALOG_PATH`` to a ``.jsonl`` file (one product object per line)
+or to a binary ``.icat`` file produced by ``python -m backend.catalog``. Loaded
+catalogs are stored column-wise: every field is a single UTF-8 buffer plus an
+offsets array, and products are slot-only views decoded on access. Binary files
+are memory-mapped, so heavy fields such as ``description`` are only read from
+disk when a product is actually rendered.
+
+The file is re-checked every ``BACKEND_CATALOG_RELOAD_SECONDS``; a changed file
+is loaded in a background thread and swapped in atomically once complete.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import mmap
+import os
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .catalog_index import CatalogIndex
+from .products_db import PRODUCTS, Product
+
+logger = logging.getLogger(__name__)
+
+CATALOG_PATH = os.getenv("BACKEND_CATALOG_PATH", "").strip()
+RELOAD_INTERVAL_SECONDS = float(os.getenv("BACKEND_CATALOG_RELOAD_SECONDS", "2"))
+
+BINARY_MAGIC = b"ICAT\x01\x00\x00\x00"
+_LIST_SEPARATOR = "\x1f"
+
+
+class _Column:
+    """One catalog field: concatenated UTF-8 values addressed by ``offsets[rank]``."""
+
+    __slots__ = ("name", "is_list", "offsets", "data")
+
+    def __init__(self, name: str, is_list: bool, offsets: Sequence[int], data: object) -> None:
+        self.name = name
+        self.is_list = is_list
+        self.offsets = offsets
+        self.data = data  # bytes, or an mmap for binary catalogs
+
+    def has(self, rank: int) -> bool:
+        return self.offsets[rank + 1] > self.offsets[rank]
+
+    def value(self, rank: int) -> Optional[object]:
+        start = self.offsets[rank]
+        end = self.offsets[rank + 1]
+        if start == end:
+            return None
+        text = str(self.data[start:end], "utf-8")
+        return text.split(_LIST_SEPARATOR) if self.is_list else text
+
+
+class _ColumnBuilder:
+    __slots__ = ("name", "is_list", "offsets", "data")
+
+    def __init__(self, name: str, rows_before: int) -> None:
+        self.name = name
+        self.is_list = False
+        self.offsets = array("Q", [0] * (rows_before + 1))
+        self.data = bytearray()
+
+    def append(self, value: object) -> None:
+        if isinstance(value, (list, tuple)):
+            self.is_list = True
+            value = _LIST_SEPARATOR.join(str(item) for item in value)
+        if value is not None:
+            self.data += str(value).encode("utf-8")
+        self.offsets.append(len(self.data))
+
+    def pad_to(self, rows: int) -> None:
+        while len(self.offsets) <= rows:
+            self.offsets.append(len(self.data))
+
+    def build(self) -> _Column:
+        return _Column(self.name, self.is_list, self.offsets, bytes(self.data))
+
+
+class CatalogColumns:
+    """Column store shared by all :class:`CatalogRecord` views of one catalog file."""
+
+    def __init__(self, count: int, columns: Dict[str, _Column], keep_alive: object = None) -> None:
+        self.count = count
+        self.columns = columns
+        self._keep_alive = keep_alive  # mmap backing the columns, if any
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Product]) -> "CatalogColumns":
+        builders: Dict[str, _ColumnBuilder] = {}
+        count = 0
+        for row in rows:
+            row = dict(row)
+            if not row.get("id"):
+                row["id"] = f"{row.get('category', 'misc')}-{count}"
+            for name, value in row.items():
+                builder = builders.get(name)
+                if builder is None:
+                    builder = builders[name] = _ColumnBuilder(name, count)
+                builder.pad_to(count)
+                builder.append(value)
+            count += 1
+        for builder in builders.values():
+            builder.pad_to(count)
+        return cls(count, {name: builder.build() for name, builder in builders.items()})
+
+    def records(self) -> List["CatalogRecord"]:
+        return [CatalogRecord(self, rank) for rank in range(self.count)]
+
+
+class CatalogRecord(Mapping):
+    """Read-only, dict-compatible view of one product row in :class:`CatalogColumns`."""
+
+    __slots__ = ("_columns", "_rank")
+
+    def __init__(self, columns: CatalogColumns, rank: int) -> None:
+        self._columns = columns
+        self._rank = rank
+
+    def __getitem__(self, key: str) -> object:
+        column = self._columns.columns.get(key)
+        if column is None or not column.has(self._rank):
+            raise KeyError(key)
+        return column.value(self._rank)
+
+    def __iter__(self) -> Iterator[str]:
+        return (name for name, column in self._columns.columns.items() if column.has(self._rank))
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"CatalogRecord({self.get('id')!r})"
+
+
+class CatalogSnapshot:
+    """An immutable catalog version together with its lookup structures."""
+
+    def __init__(self, products: Sequence[Product], source: str) -> None:
+        self.products: List[Product] = list(products)
+        self.by_id: Dict[str, Product] = {str(product["id"]): product for product in self.products}
+        self.index = CatalogIndex(self.products)
+        self.source = source
+        self.loaded_at = time.time()
+
+
+def load_catalog_file(path: Path) -> List[Product]:
+    """Load products from a JSONL or binary catalog file."""
+    path = Path(path)
+    with path.open("rb") as handle:
+        is_binary = handle.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+    columns = _read_binary(path) if is_binary else _read_jsonl(path)
+    return columns.records()
+
+
+def write_jsonl(products: Iterable[Product], path: Path) -> None:
+    lines = (json.dumps(dict(product), ensure_ascii=False) + "\n" for product in products)
+    _atomic_write(Path(path), "".join(lines).encode("utf-8"))
+
+
+def write_binary(products: Iterable[Product], path: Path) -> None:
+    """Write products in the memory-mappable column layout read by :func:`load_catalog_file`.
+
+    Layout: magic, u32 header length, space-padded JSON header, then for each
+    field an 8-byte aligned ``count + 1`` uint64 offsets array followed by the
+    concatenated UTF-8 values.
+    """
+    columns = CatalogColumns.from_rows(products)
+    header_fields = []
+    body = bytearray()
+    for column in columns.columns.values():
+        offsets = array("Q", column.offsets)
+        body += b"\0" * (-len(body) % offsets.itemsize)  # keep offsets 8-byte aligned
+        header_fields.append(
+            {
+                "name": column.name,
+                "list": column.is_list,
+                "offsets": len(body),
+                "data": len(body) + offsets.itemsize * len(offsets),
+            }
+        )
+        body += offsets.tobytes()
+        body += column.data
+    header = json.dumps(
+        {"count": columns.count, "byteorder": sys.byteorder, "fields": header_fields}
+    ).encode("utf-8")
+    header += b" " * (-(len(BINARY_MAGIC) + 4 + len(header)) % 8)
+    payload = BINARY_MAGIC + len(header).to_bytes(4, "little") + header + bytes(body)
+    _atomic_write(Path(path), payload)
+
+
+def _read_jsonl(path: Path) -> CatalogColumns:
+    def rows() -> Iterator[Product]:
+        with path.open(encoding="utf-8") as handle:
+            for line_number, line in enumerate(handle, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as error:
+                    raise ValueError(f"{path}:{line_number}: invalid catalog line: {error}") from error
+
+    return CatalogColumns.from_rows(rows())
+
+
+def _read_binary(path: Path) -> CatalogColumns:
+    with path.open("rb") as handle:
+        mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    header_start = len(BINARY_MAGIC) + 4
+    header_length = int.from_bytes(mapped[len(BINARY_MAGIC) : header_start], "little")
+    header = json.loads(mapped[header_start : header_start + header_length])
+    if header.get("byteorder") != sys.byteorder:
+        raise ValueError(f"{path} was written on a {header.get('byteorder')}-endian host")
+    count = int(header["count"])
+    body_start = header_start + header_length
+    view = memoryview(mapped)
+    columns: Dict[str, _Column] = {}
+    for field in header["fields"]:
+        offsets_start = body_start + field["offsets"]
+        offsets = view[offsets_start : body_start + field["data"]].cast("Q")
+        if len(offsets) != count + 1:
+            raise ValueError(f"{path}: corrupt offsets for field {field['name']!r}")
+        data_start = body_start + field["data"]
+        data_end = data_start + offsets[count]
+        columns[field["name"]] = _Column(field["name"], bool(field["list"]), offsets, view[data_start:data_end])
+    return CatalogColumns(count, columns, keep_alive=mapped)
+
+
+def _atomic_write(path: Path, payload: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            handle.write(payload)
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+class CatalogStore:
+    """Holds the current :class:`CatalogSnapshot` and swaps in new file versions."""
+
+    def __init__(self, path: Optional[Path], fallback: Sequence[Product]) -> None:
+        self.path = Path(path) if path else None
+        self._lock = threading.Lock()
+        self._reloading = False
+        self._next_check = 0.0
+        self._signature: Optional[Tuple[int, int, int]] = None
+        if self.path is None:
+            self._snapshot = CatalogSnapshot(fallback, source="builtin")
+        else:
+            self._signature = self._stat_signature()
+            self._snapshot = self._load()
+
+    def current(self) -> CatalogSnapshot:
+        if self.path is not None and time.monotonic() >= self._next_check:
+            self._next_check = time.monotonic() + RELOAD_INTERVAL_SECONDS
+            self._reload_if_changed()
+        return self._snapshot
+
+    def reload(self) -> CatalogSnapshot:
+        """Load the catalog file now and make it the current snapshot."""
+        signature = self._stat_signature()
+        snapshot = self._load()
+        with self._lock:
+            self._snapshot = snapshot
+            self._signature = signature
+        return snapshot
+
+    def _reload_if_changed(self) -> None:
+        try:
+            signature = self._stat_signature()
+        except OSError as error:
+            logger.warning("Catalog file unavailable, keeping current version: %s", error)
+            return
+        with self._lock:
+            if signature == self._signature or self._reloading:
+                return
+            self._reloading = True
+        threading.Thread(target=self._background_reload, name="catalog-reload", daemon=True).start()
+
+    def _background_reload(self) -> None:
+        try:
+            self.reload()
+        except Exception as error:
+            logger.exception("Catalog reload failed, keeping current version: %s", error)
+        finally:
+            with self._lock:
+                self._reloading = False
+
+    def _load(self) -> CatalogSnapshot:
+        assert self.path is not None
+        started = time.perf_counter()
+        snapshot = CatalogSnapshot(load_catalog_file(self.path), source=str(self.path))
+        logger.info(
+            "Loaded %d products from %s in %.1f ms",
+            len(snapshot.products),
+            self.path,
+            (time.perf_counter() - started) * 1000.0,
+        )
+        return snapshot
+
+    def _stat_signature(self) -> Tuple[int, int, int]:
+        assert self.path is not None
+        stat = self.path.stat()
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+_store = CatalogStore(Path(CATALOG_PATH) if CATALOG_PATH else None, PRODUCTS)
+
+
+def get_catalog() -> CatalogSnapshot:
+    """Return the current catalog snapshot, picking up file changes in the background."""
+    return _store.current()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export or convert interio product catalogs.")
+    parser.add_argument(
+        "output",
+        help="Destination file; '.jsonl' writes JSON lines, anything else the binary format.",
+    )
+    parser.add_argument(
+        "-i",
+        "--input",
+        help="Source catalog file (JSONL or binary). Defaults to the built-in catalog.",
+    )
+    args = parser.parse_args()
+
+    products = load_catalog_file(Path(args.input)) if args.input else PRODUCTS
+    output = Path(args.output)
+    if output.suffix == ".jsonl":
+        write_jsonl(products, output)
+    else:
+        write_binary(products, output)
+    print(f"Wrote {len(products)} products to {output}.")
+
+
+__all__ = [
+    "CatalogRecord",
+    "CatalogSnapshot",
+    "CatalogStore",
+    "get_catalog",
+    "load_catalog_file",
+    "write_binary",
+    "write_jsonl",
+]
+
+
+if __name__ == "__main__":
+    main()
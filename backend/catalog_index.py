@@ -0,0 +1,149 @@
+"""Inverted indexes over the product catalog for fast candidate selection."""
+
+from __future__ import annotations
+
+import heapq
+from itertools import repeat
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .products_db import Product
+
+ROOM_WEIGHT = 2
+STYLE_WEIGHT = 1
+BUDGET_WEIGHT = 1
+
+
+class CatalogIndex:
+    """Postings lists keyed by category, room, style and price band.
+
+    Every product gets a stable integer rank (its position in the catalog), and
+    each postings list holds ranks in ascending order. Postings are also split per
+    category so the top-k selection can merge them lazily and stop as soon as a
+    category has ``k`` products with the best achievable score.
+    """
+
+    def __init__(self, products: Sequence[Product]) -> None:
+        self.products: List[Product] = list(products)
+        self.by_category: Dict[str, List[int]] = {}
+        self.by_room: Dict[str, List[int]] = {}
+        self.by_style: Dict[str, List[int]] = {}
+        self.by_price_band: Dict[str, List[int]] = {}
+        self.category_of: List[str] = []
+        self.rank_of: Dict[str, int] = {}
+        # (field, value, category) -> ranks, used by top_per_category.
+        self._category_postings: Dict[Tuple[str, str, str], List[int]] = {}
+
+        for rank, product in enumerate(self.products):
+            category = str(product.get("category", "misc"))
+            self.category_of.append(category)
+            self.by_category.setdefault(category, []).append(rank)
+            if "id" in product:
+                self.rank_of[str(product["id"])] = rank
+            for room in _as_list(product.get("room")):
+                self._add_posting(self.by_room, "room", room, category, rank)
+            for style in dict.fromkeys(_as_list(product.get("style"))):
+                self._add_posting(self.by_style, "style", style, category, rank)
+            price_band = product.get("price_band")
+            if price_band:
+                self._add_posting(self.by_price_band, "price_band", str(price_band), category, rank)
+
+    def _add_posting(
+        self, postings: Dict[str, List[int]], field: str, value: str, category: str, rank: int
+    ) -> None:
+        postings.setdefault(value, []).append(rank)
+        self._category_postings.setdefault((field, value, category), []).append(rank)
+
+    def __len__(self) -> int:
+        return len(self.products)
+
+    def top_per_category(
+        self,
+        room_type: Optional[str],
+        style_tags: Iterable[str],
+        budget_band: Optional[str],
+        limit_per_category: int,
+    ) -> List[Product]:
+        """Pick up to ``limit_per_category`` products per category, best score first.
+
+        Ties are broken by catalog rank. When nothing matches the intent, the
+        first products of each category are returned instead.
+        """
+        criteria: List[Tuple[str, str, int]] = []
+        if room_type:
+            criteria.append(("room", room_type, ROOM_WEIGHT))
+        criteria.extend(("style", style, STYLE_WEIGHT) for style in dict.fromkeys(style_tags))
+        if budget_band:
+            criteria.append(("price_band", budget_band, BUDGET_WEIGHT))
+
+        scored: List[Tuple[int, int]] = []  # (score, rank)
+        for category in self.by_category:
+            weighted = [
+                (postings, weight)
+                for field, value, weight in criteria
+                for postings in (self._category_postings.get((field, value, category)),)
+                if postings
+            ]
+            if weighted:
+                scored.extend(_top_k_merged(weighted, limit_per_category))
+
+        if not scored:
+            ranks = [
+                rank
+                for postings in self.by_category.values()
+                for rank in postings[:limit_per_category]
+            ]
+            ranks.sort()
+            return [self.products[rank] for rank in ranks]
+
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [self.products[rank] for _, rank in scored]
+
+
+def _top_k_merged(weighted: List[Tuple[List[int], int]], k: int) -> List[Tuple[int, int]]:
+    """Return the ``k`` best ``(score, rank)`` pairs from weighted rank-sorted postings.
+
+    Postings are merged in rank order, so once ``k`` products reach the best
+    achievable score no later (higher-ranked) product can displace them.
+    """
+    if k <= 0:
+        return []
+    best_possible = sum(weight for _, weight in weighted)
+    merged: Iterator[Tuple[int, int]] = heapq.merge(
+        *(zip(postings, repeat(weight)) for postings, weight in weighted)
+    )
+    heap: List[Tuple[int, int]] = []  # min-heap of (score, -rank)
+    current_rank = -1
+    current_score = 0
+    for rank, weight in merged:
+        if rank != current_rank:
+            if current_score and _push_top_k(heap, current_score, current_rank, k, best_possible):
+                break
+            current_rank, current_score = rank, 0
+        current_score += weight
+    else:
+        if current_score:
+            _push_top_k(heap, current_score, current_rank, k, best_possible)
+    return [(score, -negative_rank) for score, negative_rank in heap]
+
+
+def _push_top_k(heap: List[Tuple[int, int]], score: int, rank: int, k: int, best_possible: int) -> bool:
+    """Offer a product to the top-k heap; return True once the heap cannot improve."""
+    entry = (score, -rank)
+    if len(heap) < k:
+        heapq.heappush(heap, entry)
+    elif entry > heap[0]:
+        heapq.heapreplace(heap, entry)
+    return len(heap) == k and heap[0][0] >= best_possible
+
+
+def _as_list(value: object) -> List[str]:
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [str(item) for item in value]
+    return [str(value)]
+
+
+__all__ = ["CatalogIndex"]
@@ -2,50 +2,80 @@
 
 from __future__ import annotations
 
+import asyncio
 import base64
 import logging
 import os
 import re
-from io import BytesIO
-from typing import Any, Dict, List, Optional, Tuple
-
-import requests
-from openai import OpenAI
-try:
-    from PIL import Image
-except ImportError:  # pragma: no cover - dependency might be missing locally
-    Image = None
-
-if Image:
-    try:
-        _RESAMPLE = Image.Resampling.LANCZOS
-    except AttributeError:  # pragma: no cover - Pillow < 9.1
-        _RESAMPLE = Image.LANCZOS
-else:  # pragma: no cover - Pillow missing
-    _RESAMPLE = None
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Tuple
 
+from .blob_store import blob_store, blob_url, parse_blob_url
+from .cache import DEFAULT_CACHE_DIR, DiskCache, TTLCache, hash_key
+from .image_pipeline import preprocess
+from .log_config import log_payload
+from .metrics import FALLBACKS, PAYLOAD_BYTES, STAGE_SECONDS, cache_collector, record_usage, registry
 from .products_db import Product
+from .remote_fetch import fetcher
+from .scheduler import PRIORITY_IMAGE_EDIT, Overloaded, scheduler
+from .shared_state import shared_cache
+from .thumbnails import product_preview
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
 
 logger = logging.getLogger(__name__)
-client = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key=os.environ["OPENROUTER_API_KEY"],
-    default_headers={
-        "HTTP-Referer": "https://swai-app.local",
-        "X-Title": "SWAI Interior Planner",
-    },
-)
+_client: Optional["AsyncOpenAI"] = None
+
+
+def get_client() -> "AsyncOpenAI":
+    """Create the OpenRouter client on first use; importing ``openai`` is a large share of startup."""
+    global _client
+    if _client is None:
+        from openai import AsyncOpenAI
+
+        _client = AsyncOpenAI(
+            base_url=os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"),
+            api_key=os.environ["OPENROUTER_API_KEY"],
+            default_headers={
+                "HTTP-Referer": "https://swai-app.local",
+                "X-Title": "SWAI Interior Planner",
+            },
+        )
+    return _client
+
 
 DATA_URL_PATTERN = re.compile(r"^data:(?P<mime>[^;]+);base64,(?P<data>.+)$", re.DOTALL)
 MODEL_NAME = "google/gemini-2.5-flash-image"
-
-
-def _product_image_preview_url(image_url: Optional[str]) -> Optional[str]:
-    if not image_url:
-        return None
-    postfix = "w=200&h=200&c=c"
-    separator = "&" if "?" in image_url else "?"
-    return f"{image_url}{separator}{postfix}"
+scheduler.configure(
+    MODEL_NAME,
+    concurrency=int(os.getenv("IMAGE_EDIT_MAX_CONCURRENCY", "8")),
+    rate_per_second=float(os.getenv("IMAGE_EDIT_RATE_PER_SECOND", "0")),
+    burst=float(os.getenv("IMAGE_EDIT_RATE_BURST", "0")),
+)
+IMAGE_EDIT_MAX_WAIT_SECONDS = float(os.getenv("IMAGE_EDIT_MAX_WAIT_SECONDS", "20"))
+
+# Edited images keyed on (normalized photo, ordered product IDs, normalized prompt text).
+IMAGE_CACHE_TTL_SECONDS = float(os.getenv("IMAGE_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Cached values are ``/images/`` URLs. A hit whose blob is not in this node's
+# BLOB_STORE_DIR (another node made it, or it was evicted) counts as a miss, so
+# sharing the blob directory only raises the hit rate. The disk cache below
+# survives restarts of a single node.
+_edit_cache = shared_cache(
+    "edited_images",
+    max_entries=int(os.getenv("IMAGE_CACHE_ENTRIES", "32")),
+    ttl_seconds=IMAGE_CACHE_TTL_SECONDS,
+)
+# Resized/encoded uploads keyed by blob ID (uploads are immutable).
+_prepared_cache: "TTLCache[str, str]" = TTLCache(
+    max_entries=int(os.getenv("PREPARED_IMAGE_CACHE_ENTRIES", "256")),
+    ttl_seconds=IMAGE_CACHE_TTL_SECONDS,
+)
+_disk_cache: Optional[DiskCache] = (
+    DiskCache(DEFAULT_CACHE_DIR / "edited_images", IMAGE_CACHE_MAX_BYTES, IMAGE_CACHE_TTL_SECONDS)
+    if IMAGE_CACHE_MAX_BYTES > 0
+    else None
+)
 
 
 def build_image_edit_prompt(
@@ -53,7 +83,10 @@ def build_image_edit_prompt(
     intent: Dict[str, object],
     selected_products: List[Product],
 ) -> List[Dict[str, Any]]:
-    """Create ordered multimodal instructions for the image-edit API."""
+    """Create ordered multimodal instructions for the image-edit API.
+
+    Product thumbnails may be read from disk, so async callers run this in a thread.
+    """
     _ = intent  # Intent kept for compatibility but not used in the simplified prompt.
     user_text = user_message or "(no text provided)"
     content: List[Dict[str, Any]] = [
@@ -69,7 +102,7 @@ def build_image_edit_prompt(
 
     for idx, product in enumerate(selected_products, start=1):
         title = product.get("title") or product.get("name") or f"Product {idx}"
-        preview_image = _product_image_preview_url(product.get("img") or "")
+        preview_image = product_preview(product)
         content.append({"type": "text", "text": f"{idx}. Product: {title}"})
         if preview_image:
             content.append({"type": "image_url", "image_url": {"url": preview_image}})
@@ -77,54 +110,189 @@ def build_image_edit_prompt(
     return content
 
 
-def edit_room_image(image_url: str, prompt_content: List[Dict[str, Any]]) -> Optional[str]:
-    """Call OpenRouter chat completion API and return a data URL with the edited room."""
+async def prepare_room_image(image_url: str) -> Optional[str]:
+    """Load, resize and encode the user's room photo so it can be sent to the edit model.
+
+    Photos uploaded to the blob store are content-addressed, so their prepared
+    form is cached and reused on every later turn of the conversation.
+    """
     if not image_url:
         return None
-    print("Image edit input URL: %s", image_url)
+    log_payload(logger, "Image edit input URL", image_url)
+    blob_id = parse_blob_url(image_url)
+    if blob_id:
+        cached = _prepared_cache.get(blob_id)
+        if cached:
+            return cached
     try:
-        image_bytes, mime = _load_image_bytes(image_url)
-        image_bytes, mime = _ensure_max_dimensions(image_bytes, mime)
+        with STAGE_SECONDS.time(stage="image_load"):
+            image_bytes, mime = await _load_image_bytes(image_url)
+        PAYLOAD_BYTES.observe(len(image_bytes), kind="room_photo")
+        with STAGE_SECONDS.time(stage="image_resize"):
+            image_bytes, mime = await preprocess(image_bytes, mime)
+        with STAGE_SECONDS.time(stage="image_encode"):
+            prepared = _encode_image_as_data_url(image_bytes, mime)
+        PAYLOAD_BYTES.observe(len(prepared), kind="prepared_photo")
     except Exception as error:
         logger.error("Unable to load user image: %s", error)
         return None
+    if blob_id:
+        _prepared_cache.set(blob_id, prepared)
+    return prepared
+
+
+async def edit_room_image(
+    image_url: str,
+    prompt_content: List[Dict[str, Any]],
+    prepared_image: Optional[str] = None,
+    product_ids: Optional[Sequence[str]] = None,
+    use_cache: bool = True,
+    priority: int = PRIORITY_IMAGE_EDIT,
+) -> Optional[str]:
+    """Call OpenRouter chat completion API and return a URL for the edited room.
+
+    Generated images are written to the blob store and returned as short
+    ``/images/<id>`` URLs instead of multi-megabyte inline data URLs.
+
+    ``prepared_image`` lets callers pass the output of :func:`prepare_room_image`
+    when the photo was already processed concurrently with the planner. Results are
+    cached on the normalized photo, ``product_ids`` and the prompt text. The call
+    is admitted by the scheduler at ``priority`` and raises
+    :class:`~backend.scheduler.Overloaded` when it is shed.
+    """
+    if not image_url:
+        return None
+    data_url = prepared_image or await prepare_room_image(image_url)
+    if not data_url:
+        return None
+
+    cache_key = image_cache_key(data_url, product_ids or [], prompt_content)
+    if use_cache:
+        cached = await _get_cached_edit(cache_key)
+        if cached:
+            logger.info("Image edit cache hit %s", cache_key[:12])
+            return cached
 
     try:
-        data_url = _encode_image_as_data_url(image_bytes, mime)
         content = list(prompt_content)
         content.append({"type": "text", "text": "User's room photo:"})
         content.append({"type": "image_url", "image_url": {"url": data_url}})
-        response = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[
-                {
-                    "role": "user",
-                    "content": content,
-                }
-            ],
-            modalities=["image", "text"],
-        )
+        async with scheduler.slot(MODEL_NAME, priority, IMAGE_EDIT_MAX_WAIT_SECONDS):
+            response = await get_client().chat.completions.create(
+                model=MODEL_NAME,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": content,
+                    }
+                ],
+                modalities=["image", "text"],
+            )
+        record_usage(MODEL_NAME, getattr(response, "usage", None))
         edited_image_url = _extract_image_data_url(response)
         if not edited_image_url:
             logger.error("Image edit request returned no images.")
+            FALLBACKS.inc(component="image_edit", reason="no_image")
             return None
-        print("Image edit output (data URL): %s", edited_image_url)
+        PAYLOAD_BYTES.observe(len(edited_image_url), kind="edited_image")
+        edited_image_url = await _persist_edited_image(edited_image_url)
+        log_payload(logger, "Image edit output", edited_image_url)
+        await _store_cached_edit(cache_key, edited_image_url)
         return edited_image_url
+    except Overloaded:
+        raise
     except Exception as error:
         logger.exception("Image edit request failed: %s", error)
+        FALLBACKS.inc(component="image_edit", reason=type(error).__name__)
+        return None
+
+
+def image_cache_key(
+    prepared_image: str,
+    product_ids: Sequence[str],
+    prompt_content: List[Dict[str, Any]],
+) -> str:
+    """Hash the normalized photo, the ordered product IDs and the normalized prompt text."""
+    prompt_text = " ".join(
+        str(item.get("text", "")) for item in prompt_content if item.get("type") == "text"
+    )
+    normalized_text = " ".join(prompt_text.lower().split())
+    return hash_key(MODEL_NAME, prepared_image, ",".join(product_ids), normalized_text)
+
+
+def image_cache_stats() -> Dict[str, Dict[str, int]]:
+    stats = {"shared": _edit_cache.stats(), "prepared": _prepared_cache.stats()}
+    if _disk_cache:
+        stats["disk"] = _disk_cache.stats()
+    return stats
+
+
+registry.register_collector(
+    cache_collector(lambda: {f"image_edit_{name}": stats for name, stats in image_cache_stats().items()})
+)
+
+
+async def _get_cached_edit(cache_key: str) -> Optional[str]:
+    cached = await _edit_cache.get(cache_key)
+    if cached and _is_servable(cached):
+        return cached
+    if not _disk_cache:
+        return None
+    data = await asyncio.to_thread(_disk_cache.get, cache_key)
+    if data is None:
         return None
+    cached = data.decode("utf-8")
+    if not _is_servable(cached):
+        return None
+    await _edit_cache.set(cache_key, cached)
+    return cached
+
+
+def _is_servable(image_url: str) -> bool:
+    """Whether this node can serve ``image_url``; blob URLs must be in the local store."""
+    blob_id = parse_blob_url(image_url)
+    return blob_id is None or blob_store.exists(blob_id)
 
 
-def _load_image_bytes(image_url: str) -> Tuple[bytes, str]:
+async def _persist_edited_image(image_url: str) -> str:
+    """Move an inline data URL into the blob store and return its short ``/images/`` URL."""
+    match = DATA_URL_PATTERN.match(image_url)
+    if not match:
+        return image_url
+    try:
+        image_bytes = base64.b64decode(match.group("data"))
+        blob_id = await asyncio.to_thread(blob_store.put, image_bytes)
+    except Exception as error:
+        logger.warning("Could not persist edited image, returning it inline: %s", error)
+        return image_url
+    return blob_url(blob_id)
+
+
+async def _store_cached_edit(cache_key: str, edited_image_url: str) -> None:
+    await _edit_cache.set(cache_key, edited_image_url)
+    if _disk_cache:
+        await asyncio.to_thread(_disk_cache.set, cache_key, edited_image_url.encode("utf-8"))
+
+
+async def close_clients() -> None:
+    """Release the pooled HTTP connections held by this module."""
+    global _client
+    await fetcher.close()
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
+async def _load_image_bytes(image_url: str) -> Tuple[bytes, str]:
+    blob_id = parse_blob_url(image_url)
+    if blob_id:
+        return await asyncio.to_thread(blob_store.read, blob_id)
     if image_url.startswith("data:"):
         match = DATA_URL_PATTERN.match(image_url)
         if not match:
             raise ValueError("Invalid data URL")
         return base64.b64decode(match.group("data")), match.group("mime")
-    response = requests.get(image_url, timeout=15)
-    response.raise_for_status()
-    mime = response.headers.get("content-type", "image/png")
-    return response.content, mime
+    return await fetcher.fetch(image_url)
 
 
 def _encode_image_as_data_url(image_bytes: bytes, mime: Optional[str]) -> str:
@@ -133,42 +301,6 @@ def _encode_image_as_data_url(image_bytes: bytes, mime: Optional[str]) -> str:
     return f"data:{safe_mime};base64,{b64}"
 
 
-def _ensure_max_dimensions(
-    image_bytes: bytes,
-    mime: Optional[str],
-    max_side: int = 700,
-) -> Tuple[bytes, str]:
-    """Resize the user-provided image proportionally to fit within max_side."""
-    if not Image:
-        return image_bytes, mime or "image/png"
-
-    try:
-        with Image.open(BytesIO(image_bytes)) as img:
-            width, height = img.size
-            if width <= max_side and height <= max_side:
-                inferred_mime = mime or Image.MIME.get(img.format, "image/png")
-                return image_bytes, inferred_mime
-
-            scale = min(max_side / float(width), max_side / float(height))
-            new_size = (max(1, int(width * scale)), max(1, int(height * scale)))
-            resample = _RESAMPLE or getattr(Image, "LANCZOS", Image.BICUBIC)
-            resized = img.resize(new_size, resample)
-
-            if resized.mode not in ("RGB", "RGBA"):
-                resized = resized.convert("RGB")
-
-            buffer = BytesIO()
-            save_format = "PNG" if resized.mode == "RGBA" else "JPEG"
-            output_mime = "image/png" if save_format == "PNG" else "image/jpeg"
-            save_kwargs = {"quality": 90} if save_format == "JPEG" else {}
-            resized.save(buffer, format=save_format, **save_kwargs)
-            buffer.seek(0)
-            return buffer.read(), output_mime
-    except Exception as error:  # pragma: no cover - defensive
-        logger.warning("Failed to resize user image: %s", error)
-        return image_bytes, mime or "image/png"
-
-
 def _extract_image_data_url(response: Any) -> Optional[str]:
     """Try to extract the first image data URL from the OpenRouter response."""
     try:
@@ -202,4 +334,11 @@ def _extract_image_data_url(response: Any) -> Optional[str]:
     return None
 
 
-__all__ = ["build_image_edit_prompt", "edit_room_image"]
+__all__ = [
+    "build_image_edit_prompt",
+    "close_clients",
+    "edit_room_image",
+    "image_cache_key",
+    "image_cache_stats",
+    "prepare_room_image",
+]
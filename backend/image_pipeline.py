@@ -0,0 +1,159 @@
+"""CPU-bound preprocessing of room photos before they are sent to the edit model.
+
+Large JPEGs are decoded in draft mode (the decoder scales by 1/2, 1/4 or 1/8
+while reading DCT blocks), other formats are shrunk with ``Image.reduce`` (via ``thumbnail``) before
+the final LANCZOS pass, and EXIF orientation is applied so phone photos are not
+sent sideways. Photos are re-encoded as JPEG; images with real transparency
+become WebP so the alpha channel survives without PNG's size.
+
+The work runs in a process pool of ``BACKEND_IMAGE_WORKERS`` processes so it
+scales across cores and never holds the event loop's GIL. Set the variable to
+``0`` to run it in a thread instead.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Optional, Tuple
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # pragma: no cover - dependency might be missing locally
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "700"))
+JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "88"))
+WEBP_QUALITY = int(os.getenv("IMAGE_WEBP_QUALITY", "85"))
+IMAGE_WORKERS = int(os.getenv("BACKEND_IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+if Image:
+    try:
+        _RESAMPLE = Image.Resampling.LANCZOS
+    except AttributeError:  # pragma: no cover - Pillow < 9.1
+        _RESAMPLE = Image.LANCZOS
+    _WEBP_AVAILABLE = features.check("webp")
+else:  # pragma: no cover - Pillow missing
+    _RESAMPLE = None
+    _WEBP_AVAILABLE = False
+
+_EXIF_ORIENTATION = 0x0112
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def preprocess_image(
+    image_bytes: bytes,
+    mime: Optional[str],
+    max_side: int = MAX_SIDE,
+) -> Tuple[bytes, str]:
+    """Orient, downscale to fit within ``max_side`` and re-encode an image.
+
+    Images that are already small enough and upright are returned unchanged.
+    Runs in worker processes, so it must stay a picklable top-level function.
+    """
+    if not Image:
+        return image_bytes, mime or "image/png"
+
+    try:
+        with Image.open(BytesIO(image_bytes)) as img:
+            source_mime = Image.MIME.get(img.format or "", mime or "image/png")
+            orientation = img.getexif().get(_EXIF_ORIENTATION, 1)
+            if max(img.size) <= max_side and orientation in (0, 1):
+                return image_bytes, mime or source_mime
+
+            if img.format == "JPEG":
+                # Let libjpeg decode at the smallest power-of-two scale that still
+                # covers max_side; orientation may swap the axes, hence the square box.
+                img.draft("RGB", (max_side, max_side))
+            image = ImageOps.exif_transpose(img)
+            image.thumbnail((max_side, max_side), _RESAMPLE, reducing_gap=2.0)
+            return _encode(image)
+    except Exception as error:
+        logger.warning("Failed to preprocess user image: %s", error)
+        return image_bytes, mime or "image/png"
+
+
+def _encode(image: "Image.Image") -> Tuple[bytes, str]:
+    """Pick the output format from the pixels: WebP for real transparency, JPEG otherwise."""
+    if image.mode in ("P", "LA", "PA") or (image.mode == "L" and "transparency" in image.info):
+        image = image.convert("RGBA")
+    has_alpha = image.mode == "RGBA" and image.getchannel("A").getextrema()[0] < 255
+
+    buffer = BytesIO()
+    if has_alpha:
+        if _WEBP_AVAILABLE:
+            image.save(buffer, format="WEBP", quality=WEBP_QUALITY, method=4)
+            return buffer.getvalue(), "image/webp"
+        image.save(buffer, format="PNG", optimize=False)
+        return buffer.getvalue(), "image/png"
+
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    image.save(buffer, format="JPEG", quality=JPEG_QUALITY, optimize=False)
+    return buffer.getvalue(), "image/jpeg"
+
+
+def _get_executor() -> Optional[ProcessPoolExecutor]:
+    global _executor
+    if IMAGE_WORKERS <= 0:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            # "spawn" keeps workers from inheriting the server's threads and event loop.
+            _executor = ProcessPoolExecutor(
+                max_workers=IMAGE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _executor
+
+
+async def preprocess(image_bytes: bytes, mime: Optional[str], max_side: int = MAX_SIDE) -> Tuple[bytes, str]:
+    """Run :func:`preprocess_image` off the event loop, in the worker pool when enabled."""
+    executor = _get_executor()
+    if executor is None:
+        return await asyncio.to_thread(preprocess_image, image_bytes, mime, max_side)
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(executor, preprocess_image, image_bytes, mime, max_side)
+    except BrokenProcessPool:
+        logger.warning("Image worker pool died; restarting it and retrying in a thread.")
+        _reset_executor(executor)
+        return await asyncio.to_thread(preprocess_image, image_bytes, mime, max_side)
+
+
+def _reset_executor(broken: ProcessPoolExecutor) -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is broken:
+            _executor = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def start_workers() -> None:
+    """Spawn the worker processes ahead of the first upload instead of on its request path."""
+    executor = _get_executor()
+    if executor is not None:
+        for _ in range(IMAGE_WORKERS):
+            executor.submit(os.getpid)
+
+
+def shutdown_workers() -> None:
+    """Stop the worker processes; a later call to :func:`preprocess` starts new ones."""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+__all__ = ["MAX_SIDE", "preprocess", "preprocess_image", "shutdown_workers", "start_workers"]
@@ -2,129 +2,241 @@
 
 from __future__ import annotations
 
+import json
+import os
 import re
-from typing import Dict, List, Sequence, Tuple
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
-from .products_db import PRODUCTS, Product
+from .catalog import get_catalog
+from .products_db import Product
+from .retrieval import get_retriever
 
 DEFAULT_ROOM = "living_room"
 DEFAULT_BUDGET = "mid"
-
-ROOM_KEYWORDS: Sequence[Tuple[str, str]] = (
-    ("거실", "living_room"),
-    ("침실", "bedroom"),
-    ("아이방", "kids_room"),
-    ("서재", "office"),
-    ("주방", "kitchen"),
-)
-
-STYLE_KEYWORDS = {
-    "북유럽": "scandinavian",
-    "스칸디": "scandinavian",
-    "내추럴": "natural",
-    "모던": "modern",
-    "미니멀": "minimal",
-    "보헤미안": "boho",
-    "라탄": "natural",
-    "럭셔리": "luxury",
-    "고급": "luxury",
-    "컬러": "color_pop",
-}
-
-BUDGET_HINTS = {
-    "저렴": "low",
-    "가성비": "low",
-    "합리": "mid",
-    "보통": "mid",
-    "프리미엄": "high",
-    "고급": "high",
-}
+RETRIEVAL_ENABLED = os.getenv("RETRIEVAL_ENABLED", "1") != "0"
+# Keyword dictionary: ordered (keyword, value) pairs per category plus price bands.
+LEXICON_PATH = Path(os.getenv("INTENT_LEXICON_PATH") or Path(__file__).with_name("intent_lexicon.json"))
+
+# (category, priority within the category, value)
+_Tag = Tuple[str, int, str]
+_Ranked = Tuple[int, str]
+# Per keyword: best room, all styles, best budget, best English budget fallback.
+_Meaning = Tuple[Optional[_Ranked], List[_Ranked], Optional[_Ranked], Optional[_Ranked]]
+
+
+class IntentLexicon:
+    """Room/style/budget keywords compiled into a single regular expression.
+
+    Every keyword goes into one trie-shaped alternation next to the price
+    pattern, so a message is scanned once however large the vocabulary grows.
+    Within a category the keyword listed first wins (rooms, budgets) or sets
+    the order (styles), independent of where it appears in the text. One
+    keyword may carry several meanings, e.g. "고급" is both a style and a
+    budget hint.
+    """
+
+    def __init__(
+        self,
+        rooms: Sequence[Tuple[str, str]],
+        styles: Sequence[Tuple[str, str]],
+        budgets: Sequence[Tuple[str, str]],
+        budget_fallbacks: Sequence[Tuple[str, str]] = (),
+        price_unit: str = "만",
+        price_bands: Sequence[Tuple[Optional[int], str]] = (),
+    ) -> None:
+        self.rooms = [tuple(pair) for pair in rooms]
+        self.styles = [tuple(pair) for pair in styles]
+        self.budgets = [tuple(pair) for pair in budgets]
+        self.price_bands = [tuple(pair) for pair in price_bands]
+
+        entries: Dict[str, List[_Tag]] = {}
+        for category, pairs in (
+            ("room", self.rooms),
+            ("style", self.styles),
+            ("budget", self.budgets),
+            ("fallback", budget_fallbacks),
+        ):
+            for priority, (keyword, value) in enumerate(pairs):
+                entries.setdefault(keyword.lower(), []).append((category, priority, value))
+        # The scan reports the longest keyword at each position; keywords inside
+        # it matched as well, so it carries their meanings too.
+        self._meanings: Dict[str, _Meaning] = {}
+        for surface in entries:
+            tags = [
+                tag
+                for start in range(len(surface))
+                for end in range(start + 1, len(surface) + 1)
+                for tag in entries.get(surface[start:end], ())
+            ]
+            self._meanings[surface] = (
+                min((tag[1:] for tag in tags if tag[0] == "room"), default=None),
+                sorted(tag[1:] for tag in tags if tag[0] == "style"),
+                min((tag[1:] for tag in tags if tag[0] == "budget"), default=None),
+                min((tag[1:] for tag in tags if tag[0] == "fallback"), default=None),
+            )
+        self._pattern = re.compile(
+            rf"(?P<keyword>{_trie_pattern(entries)})|(?P<amount>\d+)\s*{re.escape(price_unit)}",
+            re.IGNORECASE,
+        )
+        self._overlapping = _has_partial_overlaps(entries, price_unit)
+
+    @classmethod
+    def load(cls, path: Path) -> "IntentLexicon":
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        return cls(
+            data["rooms"],
+            data["styles"],
+            data["budgets"],
+            data.get("budget_fallbacks", ()),
+            data.get("price_unit", "만"),
+            data.get("price_bands", ()),
+        )
+
+    def parse(self, message: str | None) -> Dict[str, object]:
+        text = message or ""
+        room: Optional[_Ranked] = None
+        budget: Optional[_Ranked] = None
+        fallback: Optional[_Ranked] = None
+        styles: List[_Ranked] = []
+        amount: Optional[int] = None
+
+        matches = self._overlapping_matches(text) if self._overlapping else self._pattern.finditer(text)
+        for match in matches:
+            keyword = match.group("keyword")
+            if keyword is None:
+                if amount is None:
+                    amount = int(match.group("amount"))
+                continue
+            meaning = self._meanings.get(keyword.lower())
+            if meaning is None:
+                continue
+            keyword_room, keyword_styles, keyword_budget, keyword_fallback = meaning
+            if keyword_room and (room is None or keyword_room < room):
+                room = keyword_room
+            if keyword_styles:
+                styles.extend(keyword_styles)
+            if keyword_budget and (budget is None or keyword_budget < budget):
+                budget = keyword_budget
+            if keyword_fallback and (fallback is None or keyword_fallback < fallback):
+                fallback = keyword_fallback
+
+        style_tags = list(dict.fromkeys(value for _, value in sorted(styles)))
+        if budget:
+            budget_band = budget[1]
+        elif amount is not None:
+            budget_band = self._price_band(amount)
+        elif fallback:
+            budget_band = fallback[1]
+        else:
+            budget_band = DEFAULT_BUDGET
+        return {
+            "room_type": room[1] if room else DEFAULT_ROOM,
+            "style_tags": style_tags or ["neutral"],
+            "budget_band": budget_band,
+        }
+
+    def _overlapping_matches(self, text: str) -> Iterator["re.Match[str]"]:
+        # Restart right after each match start so keywords overlapping it are found too.
+        position = 0
+        while True:
+            match = self._pattern.search(text, position)
+            if match is None:
+                return
+            yield match
+            position = match.start() + 1
+
+    def _price_band(self, amount: int) -> str:
+        for limit, band in self.price_bands:
+            if limit is None or amount <= limit:
+                return band
+        return DEFAULT_BUDGET
+
+
+def _has_partial_overlaps(words: Iterable[str], price_unit: str) -> bool:
+    """True if a keyword can start inside another match and extend past its end.
+
+    Without such pairs a plain non-overlapping scan finds everything: keywords
+    nested inside a longer match are covered by its tags.
+    """
+    words = list(words)
+    prefixes = {word[:end] for word in words for end in range(1, len(word))}
+    for word in words:
+        if any(char.isdigit() or char.isspace() for char in word) or price_unit in word:
+            return True
+        if any(word[start:] in prefixes for start in range(1, len(word))):
+            return True
+    return False
+
+
+def _trie_pattern(words: Iterable[str]) -> str:
+    """Regex alternation shaped like a prefix trie; longer keywords win at each position."""
+    trie: Dict[str, dict] = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: Dict[str, dict]) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            return f"(?:{body})?" if len(branches) > 1 or len(body) > 1 else f"{body}?"
+        return body
+
+    return build(trie) or "(?!)"
+
+
+lexicon = IntentLexicon.load(LEXICON_PATH)
+
+ROOM_KEYWORDS: Sequence[Tuple[str, str]] = tuple(lexicon.rooms)
+STYLE_KEYWORDS: Dict[str, str] = dict(lexicon.styles)
+BUDGET_HINTS: Dict[str, str] = dict(lexicon.budgets)
 
 
 def parse_intent(message: str | None) -> Dict[str, object]:
     """Extract rough room, style, and budget signals from the user text."""
-    text = message or ""
-    lower_text = text.lower()
-    room_type = DEFAULT_ROOM
-    for keyword, room in ROOM_KEYWORDS:
-        if keyword in text:
-            room_type = room
-            break
-
-    style_tags = []
-    for keyword, style in STYLE_KEYWORDS.items():
-        if keyword in text:
-            style_tags.append(style)
-    # Deduplicate while preserving order
-    style_tags = list(dict.fromkeys(style_tags))
-
-    budget_band = _extract_budget_band(text, lower_text)
-
-    return {
-        "room_type": room_type,
-        "style_tags": style_tags or ["neutral"],
-        "budget_band": budget_band,
-    }
-
-
-def _extract_budget_band(text: str, lower_text: str) -> str:
-    for keyword, band in BUDGET_HINTS.items():
-        if keyword in text:
-            return band
-
-    price_match = re.search(r"(\d+)\s*만", text)
-    if price_match:
-        amount = int(price_match.group(1))
-        if amount <= 150:
-            return "low"
-        if amount <= 300:
-            return "mid"
-        return "high"
-
-    if any(token in lower_text for token in ("budget", "affordable")):
-        return "low"
-    if any(token in lower_text for token in ("premium", "luxury")):
-        return "high"
-    return DEFAULT_BUDGET
-
-
-def get_candidate_products(intent: Dict[str, object], limit_per_category: int = 2) -> List[Product]:
-    """Filter the catalog down to a small list per category for prompting."""
-    room_type = intent.get("room_type", DEFAULT_ROOM)
-    style_tags = set(intent.get("style_tags") or [])
-    budget_band = intent.get("budget_band")
+    return lexicon.parse(message)
+
 
-    def product_score(product: Product) -> int:
-        score = 0
-        if room_type in product.get("room", []):
-            score += 2
-        overlap = style_tags.intersection(product.get("style", []))
-        score += len(overlap)
-        if budget_band and product.get("price_band") == budget_band:
-            score += 1
-        return score
-
-    sorted_products = sorted(
-        PRODUCTS,
-        key=lambda product: (product_score(product), -PRODUCTS.index(product)),
-        reverse=True,
-    )
-
-    picked: List[Product] = []
-    per_category_count: Dict[str, int] = {}
-    for product in sorted_products:
-        category = str(product.get("category", "misc"))
-        if product_score(product) == 0 and picked:
-            continue
-        if per_category_count.get(category, 0) >= limit_per_category:
-            continue
-        per_category_count[category] = per_category_count.get(category, 0) + 1
-        picked.append(product)
+def parse_intents(messages: Iterable[str | None]) -> List[Dict[str, object]]:
+    """Parse many messages (e.g. request logs) with the same compiled lexicon."""
+    parse = lexicon.parse
+    return [parse(message) for message in messages]
 
+
+def get_candidate_products(
+    intent: Dict[str, object],
+    limit_per_category: int = 2,
+    query: str | None = None,
+) -> List[Product]:
+    """Filter the catalog down to a small list per category for prompting.
+
+    With a ``query`` (the raw user message) products are ranked by embedding
+    similarity on top of the keyword-index weights; otherwise, or while the
+    embeddings are unavailable, only the keyword index is used.
+    """
+    room_type = intent.get("room_type", DEFAULT_ROOM)
+    style_tags = [str(tag) for tag in intent.get("style_tags") or []]
+    budget_band = intent.get("budget_band")
+    room = str(room_type) if room_type else None
+    band = str(budget_band) if budget_band else None
+
+    catalog = get_catalog()
+    retriever = get_retriever(catalog) if RETRIEVAL_ENABLED and query and query.strip() else None
+    if retriever is not None:
+        # Intent tags are English like the product descriptions, which helps the match.
+        query_text = " ".join([query, room.replace("_", " ") if room else "", *style_tags])
+        picked = retriever.top_per_category(query_text, limit_per_category, room, style_tags, band)
+    else:
+        picked = catalog.index.top_per_category(room, style_tags, band, limit_per_category)
     if not picked:
-        picked = PRODUCTS[: max(1, limit_per_category * 2)]
+        picked = catalog.products[: max(1, limit_per_category * 2)]
     return picked
 
 
-__all__ = ["parse_intent", "get_candidate_products"]
+__all__ = ["IntentLexicon", "get_candidate_products", "lexicon", "parse_intent", "parse_intents"]
 
@@ -4,14 +4,85 @@ from __future__ import annotations
 
 import json
 import logging
-from typing import Dict, List, Tuple, TypedDict
+import os
+import re
+import unicodedata
+from typing import TYPE_CHECKING, Awaitable, Callable, Dict, List, Optional, Tuple, TypedDict
 
-from openai import OpenAI
+from .cache import hash_key
+from .log_config import log_payload
+from .metrics import FALLBACKS, cache_collector, record_usage, registry
+from .products_db import Product
+from .scheduler import PRIORITY_PLANNER, Overloaded, scheduler
+from .shared_state import shared_cache
 
-from .products_db import Product, PRODUCTS
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
 
 logger = logging.getLogger(__name__)
-client = OpenAI()
+_client: Optional["AsyncOpenAI"] = None
+PLANNER_MODEL = "gpt-5"
+scheduler.configure(
+    PLANNER_MODEL,
+    concurrency=int(os.getenv("PLANNER_MAX_CONCURRENCY", "16")),
+    rate_per_second=float(os.getenv("PLANNER_RATE_PER_SECOND", "0")),
+    burst=float(os.getenv("PLANNER_RATE_BURST", "0")),
+)
+# Planner calls queue briefly: a fast 429 beats a reply that arrives after the user gave up.
+PLANNER_MAX_WAIT_SECONDS = float(os.getenv("PLANNER_MAX_WAIT_SECONDS", "5"))
+
+# Optional cheaper tier tried first; invalid output, errors or a full lane escalate to PLANNER_MODEL.
+PLANNER_FAST_MODEL = os.getenv("PLANNER_FAST_MODEL", "").strip()
+# The fast lane gives up quickly since escalating is the alternative to waiting.
+PLANNER_FAST_MAX_WAIT_SECONDS = float(os.getenv("PLANNER_FAST_MAX_WAIT_SECONDS", "1"))
+if PLANNER_FAST_MODEL:
+    scheduler.configure(
+        PLANNER_FAST_MODEL,
+        concurrency=int(os.getenv("PLANNER_FAST_MAX_CONCURRENCY", os.getenv("PLANNER_MAX_CONCURRENCY", "16"))),
+        rate_per_second=float(os.getenv("PLANNER_FAST_RATE_PER_SECOND", "0")),
+        burst=float(os.getenv("PLANNER_FAST_RATE_BURST", "0")),
+    )
+
+# "structured" constrains the reply to PLANNER_RESPONSE_FORMAT; "text" asks for JSON in the
+# prompt only, for providers without schema support.
+OUTPUT_MODES = ("structured", "text")
+OUTPUT_MODE = os.getenv("PLANNER_OUTPUT", "structured").strip().lower()
+if OUTPUT_MODE not in OUTPUT_MODES:
+    OUTPUT_MODE = "structured"
+
+
+def get_client() -> "AsyncOpenAI":
+    """Create the planner client on first use so workers boot without importing ``openai``."""
+    global _client
+    if _client is None:
+        from openai import AsyncOpenAI
+
+        _client = AsyncOpenAI()
+    return _client
+
+
+# Upper bound for the serialized candidate block, in estimated tokens.
+PROMPT_MAX_TOKENS = int(os.getenv("PLANNER_PROMPT_MAX_TOKENS", "1500"))
+# Descriptions are cut to their first sentence and at most this many characters.
+DESCRIPTION_MAX_CHARS = int(os.getenv("PLANNER_DESCRIPTION_CHARS", "120"))
+
+# How planner results are shared between requests: "exact" message text,
+# "normalized" message text, or "intent" (parsed intent plus candidate IDs).
+CACHE_KEY_POLICIES = ("exact", "normalized", "intent")
+CACHE_KEY_POLICY = os.getenv("PLANNER_CACHE_KEY", "normalized").strip().lower()
+if CACHE_KEY_POLICY not in CACHE_KEY_POLICIES:
+    CACHE_KEY_POLICY = "normalized"
+_plan_cache = shared_cache(
+    "planner",
+    max_entries=int(os.getenv("PLANNER_CACHE_ENTRIES", "1024")),
+    ttl_seconds=float(os.getenv("PLANNER_CACHE_TTL_SECONDS", "3600")),
+)
+
+
+MessageDeltaCallback = Callable[[str], Awaitable[None]]
+
+_ASSISTANT_MESSAGE_KEY = re.compile(r'"assistant_message"\s*:\s*"')
+_JSON_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
 
 
 class PlanningResult(TypedDict):
@@ -19,45 +90,314 @@ class PlanningResult(TypedDict):
     assistant_message: str
 
 
-def plan_products_with_llm(
+# Deliberately independent of the candidates: one fixed schema lets the provider reuse its
+# compiled grammar for every request, and the IDs are checked against the candidates instead.
+# ``assistant_message`` comes first so it streams before the product list.
+PLANNER_RESPONSE_FORMAT: Dict[str, object] = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "planning_result",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "assistant_message": {"type": "string"},
+                "selected_products": {"type": "array", "items": {"type": "string"}},
+            },
+            "required": ["assistant_message", "selected_products"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+async def plan_products_with_llm(
     user_message: str,
     intent: Dict[str, object],
     candidate_products: List[Product],
+    on_message_delta: Optional[MessageDeltaCallback] = None,
+    use_cache: bool = True,
+    history: Optional[List[Dict[str, str]]] = None,
+    raise_errors: bool = False,
 ) -> PlanningResult:
-    """Use ChatGPT to pick products and craft a user-facing response."""
+    """Use ChatGPT to pick products and craft a user-facing response.
+
+    When ``on_message_delta`` is given the completion is streamed and every new
+    piece of ``assistant_message`` is passed to the callback as soon as it arrives.
+    Successful plans are cached according to ``PLANNER_CACHE_KEY``; pass
+    ``use_cache=False`` to always ask the model. ``history`` is an already
+    budgeted list of ``{"role", "text"}`` turns shown to the model as context.
+    With ``raise_errors`` model and parsing errors propagate instead of
+    returning the fallback plan (used by batch jobs, which record failures).
+
+    With ``PLANNER_FAST_MODEL`` set that model answers first; a failed call or a
+    plan without valid candidate IDs is retried once on ``PLANNER_MODEL``. If the
+    fast model already streamed text, the retry is not streamed again and the
+    final message replaces the partial one.
+    """
     if not candidate_products:
+        FALLBACKS.inc(component="planner", reason="no_candidates")
         return _fallback_plan(candidate_products, "추천할 후보 제품을 찾지 못했어요.")
 
-    messages = _build_messages(user_message, intent, candidate_products)
-    try:
-        print(
-            "LLM planner input messages:\n%s",
-            json.dumps(messages, ensure_ascii=False, indent=2),
-        )
-    except Exception:
-        print("LLM planner input messages: %s", messages)
+    cache_key = planner_cache_key(user_message, intent, candidate_products, history=history)
+    if use_cache:
+        cached = await _plan_cache.get(cache_key)
+        if cached is not None:
+            logger.info("Planner cache hit (%s) %s", CACHE_KEY_POLICY, cache_key[:12])
+            if on_message_delta is not None:
+                await on_message_delta(cached["assistant_message"])
+            return PlanningResult(
+                selected_product_ids=list(cached["selected_product_ids"]),
+                assistant_message=cached["assistant_message"],
+            )
+
+    messages = _build_messages(user_message, intent, candidate_products, history)
+    log_payload(logger, "Planner input messages", messages)
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-5",
-            messages=messages,
-        )
-        content = response.choices[0].message.content or ""
-        print("LLM planner raw output:\n%s", content)
-        plan = _parse_plan_json(content)
-        if not plan["selected_product_ids"]:
-            raise ValueError("No products chosen by planner")
+        plan: Optional[PlanningResult] = None
+        if PLANNER_FAST_MODEL:
+            streamed: List[str] = []
+
+            async def forward(text: str) -> None:
+                streamed.append(text)
+                await on_message_delta(text)
+
+            try:
+                plan = await _request_plan(
+                    PLANNER_FAST_MODEL,
+                    messages,
+                    candidate_products,
+                    forward if on_message_delta is not None else None,
+                    PLANNER_FAST_MAX_WAIT_SECONDS,
+                )
+            except Exception as error:
+                logger.warning("Fast planner %s failed, escalating to %s: %s", PLANNER_FAST_MODEL, PLANNER_MODEL, error)
+                FALLBACKS.inc(component="planner_fast", reason=type(error).__name__)
+                if streamed:
+                    on_message_delta = None
+        if plan is None:
+            plan = await _request_plan(
+                PLANNER_MODEL, messages, candidate_products, on_message_delta, PLANNER_MAX_WAIT_SECONDS
+            )
+        await _plan_cache.set(cache_key, plan)
         return plan
+    except Overloaded:
+        # Shed load is reported to the client as 429 rather than masked by the fallback.
+        raise
     except Exception as error:
+        if raise_errors:
+            raise
         logger.exception("Planner failed, falling back: %s", error)
+        FALLBACKS.inc(component="planner", reason=type(error).__name__)
         return _fallback_plan(candidate_products, "AI 플래너 오류가 발생하여 기본 추천을 보여드려요.")
 
 
+def planner_batch_body(
+    user_message: str,
+    intent: Dict[str, object],
+    candidate_products: List[Product],
+) -> Dict[str, object]:
+    """Chat-completions request body for one plan, as submitted through a provider batch API."""
+    return {
+        "model": PLANNER_MODEL,
+        "messages": _build_messages(user_message, intent, candidate_products),
+        **_response_format_args(),
+    }
+
+
+async def store_batch_plan(
+    cache_key: str,
+    raw_content: str,
+    candidate_products: Optional[List[Product]] = None,
+) -> PlanningResult:
+    """Parse a plan returned by a provider batch job and cache it under ``cache_key``.
+
+    When ``candidate_products`` is given, IDs outside it are dropped like in live planning.
+    """
+    plan = _parse_plan_json(raw_content, candidate_products)
+    await _plan_cache.set(cache_key, plan)
+    return plan
+
+
+def planner_cache_key(
+    user_message: str,
+    intent: Dict[str, object],
+    candidate_products: List[Product],
+    policy: str = CACHE_KEY_POLICY,
+    history: Optional[List[Dict[str, str]]] = None,
+) -> str:
+    """Build the planner cache key; candidate IDs and the prompt history are always part of it.
+
+    The history shapes the plan, so a follow-up such as "더 저렴한 걸로" only
+    shares a plan with the same conversation. Without history the keys match
+    those of a first message (and of batch warm-up).
+    """
+    candidate_ids = ",".join(str(product["id"]) for product in candidate_products)
+    history_text = json.dumps(history or [], ensure_ascii=False, sort_keys=True)
+    if policy == "exact":
+        return hash_key("exact", user_message, candidate_ids, history_text)
+    history_parts = (history_text,) if history else ()
+    if policy == "intent":
+        style_tags = ",".join(sorted(str(tag) for tag in intent.get("style_tags") or []))
+        return hash_key(
+            "intent", intent.get("room_type"), style_tags, intent.get("budget_band"), candidate_ids, *history_parts
+        )
+    return hash_key("normalized", normalize_message(user_message), candidate_ids, *history_parts)
+
+
+def normalize_message(message: str) -> str:
+    """Lower-case, NFKC-normalize and drop punctuation/whitespace differences."""
+    text = unicodedata.normalize("NFKC", message or "").lower()
+    text = "".join(char if char.isalnum() else " " for char in text)
+    return " ".join(text.split())
+
+
+def planner_cache_stats() -> Dict[str, int]:
+    return _plan_cache.stats()
+
+
+registry.register_collector(cache_collector(lambda: {"planner": planner_cache_stats()}))
+
+
+async def _request_plan(
+    model: str,
+    messages: List[Dict[str, str]],
+    candidate_products: List[Product],
+    on_message_delta: Optional[MessageDeltaCallback],
+    max_wait: float,
+) -> PlanningResult:
+    async with scheduler.slot(model, PRIORITY_PLANNER, max_wait):
+        if on_message_delta is None:
+            response = await get_client().chat.completions.create(
+                model=model,
+                messages=messages,
+                **_response_format_args(),
+            )
+            message = response.choices[0].message
+            content = message.content or ""
+            record_usage(model, getattr(response, "usage", None))
+            refusal = getattr(message, "refusal", None)
+            if refusal and not content:
+                raise ValueError(f"Planner refused: {refusal}")
+        else:
+            content = await _stream_completion(model, messages, on_message_delta)
+    log_payload(logger, f"Planner raw output ({model})", content)
+    return _parse_plan_json(content, candidate_products)
+
+
+def _response_format_args() -> Dict[str, object]:
+    if OUTPUT_MODE == "structured":
+        return {"response_format": PLANNER_RESPONSE_FORMAT}
+    return {}
+
+
+async def _stream_completion(
+    model: str,
+    messages: List[Dict[str, str]],
+    on_message_delta: MessageDeltaCallback,
+) -> str:
+    stream = await get_client().chat.completions.create(
+        model=model,
+        messages=messages,
+        stream=True,
+        stream_options={"include_usage": True},
+        **_response_format_args(),
+    )
+    extractor = _AssistantMessageExtractor()
+    chunks: List[str] = []
+    async for chunk in stream:
+        # With include_usage the final chunk carries the token counts and no choices.
+        record_usage(model, getattr(chunk, "usage", None))
+        if not chunk.choices:
+            continue
+        piece = chunk.choices[0].delta.content or ""
+        if not piece:
+            continue
+        chunks.append(piece)
+        text = extractor.feed(piece)
+        if text:
+            await on_message_delta(text)
+    return "".join(chunks)
+
+
+class _AssistantMessageExtractor:
+    """Incrementally decode the ``assistant_message`` string out of streamed JSON."""
+
+    def __init__(self) -> None:
+        self._buffer = ""
+        self._position = -1  # index just past the opening quote once the key is found
+        self._finished = False
+
+    def feed(self, piece: str) -> str:
+        if self._finished:
+            return ""
+        self._buffer += piece
+        if self._position < 0:
+            match = _ASSISTANT_MESSAGE_KEY.search(self._buffer)
+            if not match:
+                return ""
+            self._position = match.end()
+
+        decoded: List[str] = []
+        buffer = self._buffer
+        index = self._position
+        while index < len(buffer):
+            char = buffer[index]
+            if char == '"':
+                self._finished = True
+                index += 1
+                break
+            if char != "\\":
+                decoded.append(char)
+                index += 1
+                continue
+            if index + 1 >= len(buffer):
+                break  # wait for the rest of the escape sequence
+            escape = buffer[index + 1]
+            if escape == "u":
+                if index + 6 > len(buffer):
+                    break
+                try:
+                    code = int(buffer[index + 2 : index + 6], 16)
+                except ValueError:
+                    code = 0xFFFD
+                if 0xD800 <= code < 0xDC00:
+                    # Surrogate pair: wait for the low half and combine both.
+                    if index + 12 > len(buffer):
+                        break
+                    try:
+                        low = int(buffer[index + 8 : index + 12], 16)
+                    except ValueError:
+                        low = 0
+                    if buffer[index + 6 : index + 8] == "\\u" and 0xDC00 <= low < 0xE000:
+                        code = 0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)
+                        index += 6
+                    else:
+                        code = 0xFFFD
+                decoded.append(chr(code))
+                index += 6
+                continue
+            decoded.append(_JSON_ESCAPES.get(escape, escape))
+            index += 2
+        self._position = index
+        return "".join(decoded)
+
+
 def _build_messages(
     user_message: str,
     intent: Dict[str, object],
     candidates: List[Product],
+    history: Optional[List[Dict[str, str]]] = None,
 ) -> List[Dict[str, str]]:
+    candidate_block, included = _serialize_candidates(candidates)
+    history_block = ""
+    if history:
+        history_block = (
+            "Recent conversation (oldest first):\n"
+            + "\n".join(f"{turn['role']}: {turn['text']}" for turn in history)
+            + "\n\n"
+        )
     system_prompt = (
         "You are an interior stylist and recommendation planner. "
         "Choose the most relevant products from the candidate list and craft a short Korean message "
@@ -65,42 +405,136 @@ def _build_messages(
     )
 
     user_prompt = (
-        f"Raw user message:\n{user_message or '(no text, image only)'}\n\n"
-        "Candidate products:\n"
-        + json.dumps(PRODUCTS, ensure_ascii=False, indent=2)
-        + "\n\nReturn JSON in this exact shape:\n"
-        '{\n'
-        '  "selected_products": ["product_id_1", "product_id_2"],\n'
-        '  "assistant_message": "한국어로 된 설명"\n'
-        "}\n"
-        "Respond with JSON only. Do not include any additional text."
+        history_block
+        + f"Raw user message:\n{user_message or '(no text, image only)'}\n\n"
+        "Candidate products (one JSON object per line):\n"
+        + candidate_block
     )
+    if OUTPUT_MODE == "structured":
+        # The response schema carries the shape; only the field semantics need spelling out.
+        user_prompt += (
+            "\n\nPut the Korean message in assistant_message and the chosen candidate ids "
+            "in selected_products."
+        )
+    else:
+        user_prompt += (
+            "\n\nReturn JSON in this exact shape:\n"
+            '{\n'
+            '  "assistant_message": "한국어로 된 설명",\n'
+            '  "selected_products": ["product_id_1", "product_id_2"]\n'
+            "}\n"
+            "Respond with JSON only. Do not include any additional text."
+        )
 
+    logger.info(
+        "Planner prompt: %d/%d candidates, %d chars, ~%d tokens",
+        included,
+        len(candidates),
+        len(system_prompt) + len(user_prompt),
+        estimate_tokens(system_prompt) + estimate_tokens(user_prompt),
+    )
     return [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_prompt},
     ]
 
 
-def _parse_plan_json(raw_content: str) -> PlanningResult:
+def _serialize_candidates(
+    candidates: List[Product],
+    max_tokens: int = PROMPT_MAX_TOKENS,
+    description_chars: int = DESCRIPTION_MAX_CHARS,
+) -> Tuple[str, int]:
+    """Render candidates as compact JSON lines, dropping the lowest ranked ones past the budget."""
+    lines: List[str] = []
+    used_tokens = 0
+    for product in candidates:
+        entry = {
+            "id": product["id"],
+            "category": product.get("category"),
+            "title": product.get("title") or product.get("name"),
+            "price": product.get("price"),
+        }
+        description = _shorten_description(str(product.get("description") or ""), description_chars)
+        if description:
+            entry["desc"] = description
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+        line_tokens = estimate_tokens(line)
+        if lines and used_tokens + line_tokens > max_tokens:
+            break
+        lines.append(line)
+        used_tokens += line_tokens
+    return "\n".join(lines), len(lines)
+
+
+def _shorten_description(description: str, max_chars: int) -> str:
+    if max_chars <= 0:
+        return ""
+    text = " ".join(description.split())
+    sentence_end = text.find(". ")
+    if sentence_end != -1:
+        text = text[: sentence_end + 1]
+    if len(text) > max_chars:
+        text = text[: max_chars - 1].rstrip() + "…"
+    return text
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate: ~4 ASCII characters per token, one token per other character."""
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    return ascii_chars // 4 + (len(text) - ascii_chars)
+
+
+def _parse_plan_json(
+    raw_content: str,
+    candidate_products: Optional[List[Product]] = None,
+) -> PlanningResult:
+    """Decode a planner reply; raises ``ValueError`` unless it names at least one valid product.
+
+    Structured output is parsed as-is. Free-form text gets one retry on the
+    outermost ``{...}`` slice, for replies wrapped in prose or code fences.
+    """
     try:
         payload = json.loads(raw_content)
     except json.JSONDecodeError:
+        if OUTPUT_MODE == "structured":
+            raise
         sanitized = raw_content.strip()
         start = sanitized.find("{")
         end = sanitized.rfind("}")
         if start == -1 or end == -1:
             raise
         payload = json.loads(sanitized[start : end + 1])
+    if not isinstance(payload, dict):
+        raise ValueError("Planner output is not a JSON object")
 
-    selected_ids = payload.get("selected_products") or []
-    assistant_message = payload.get("assistant_message") or ""
+    selected_ids = _valid_product_ids(payload.get("selected_products"), candidate_products)
+    if not selected_ids:
+        raise ValueError("No valid products chosen by planner")
+    assistant_message = payload.get("assistant_message")
+    if not isinstance(assistant_message, str):
+        assistant_message = ""
     return PlanningResult(
-        selected_product_ids=[str(pid) for pid in selected_ids],
+        selected_product_ids=selected_ids,
         assistant_message=assistant_message.strip() or "추천 제품을 확인해보세요.",
     )
 
 
+def _valid_product_ids(raw_ids: object, candidate_products: Optional[List[Product]]) -> List[str]:
+    """Keep the first occurrence of each ID that is one of the candidates (or any ID without them)."""
+    if not isinstance(raw_ids, list):
+        return []
+    allowed = {str(product["id"]) for product in candidate_products} if candidate_products is not None else None
+    selected: List[str] = []
+    seen = set()
+    for raw_id in raw_ids:
+        product_id = str(raw_id)
+        if product_id in seen or (allowed is not None and product_id not in allowed):
+            continue
+        seen.add(product_id)
+        selected.append(product_id)
+    return selected
+
+
 def _fallback_plan(candidate_products: List[Product], reason: str) -> PlanningResult:
     picks = candidate_products[:3]
     selected_ids = [product["id"] for product in picks]
@@ -117,4 +551,20 @@ def _fallback_plan(candidate_products: List[Product], reason: str) -> PlanningRe
     )
 
 
-__all__ = ["plan_products_with_llm"]
+async def close_client() -> None:
+    """Release the pooled connections held by the planner client."""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
+__all__ = [
+    "close_client",
+    "normalize_message",
+    "plan_products_with_llm",
+    "planner_batch_body",
+    "planner_cache_key",
+    "planner_cache_stats",
+    "store_batch_plan",
+]
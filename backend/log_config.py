@@ -0,0 +1,121 @@
+"""Non-blocking log output and bounded, sampled logging of model payloads.
+
+:func:`install_queue_logging` routes the ``backend`` loggers through a bounded
+queue drained by a background :class:`~logging.handlers.QueueListener`, so a
+slow stdout or log shipper never stalls the event loop; records are dropped
+(and counted) when the queue is full.
+
+Prompts and model outputs are logged through :func:`log_payload`. Each request
+draws once: most requests log nothing, ``PAYLOAD_LOG_SAMPLE_RATE`` of them log
+payloads truncated to ``PAYLOAD_LOG_MAX_CHARS`` with inline base64 images
+elided, and ``PAYLOAD_LOG_FULL_FRACTION`` of them log complete payloads for
+debugging.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from .metrics import registry
+
+PAYLOAD_LOG_SAMPLE_RATE = float(os.getenv("PAYLOAD_LOG_SAMPLE_RATE", "0.05"))
+PAYLOAD_LOG_FULL_FRACTION = float(os.getenv("PAYLOAD_LOG_FULL_FRACTION", "0"))
+PAYLOAD_LOG_MAX_CHARS = int(os.getenv("PAYLOAD_LOG_MAX_CHARS", "600"))
+LOG_LEVEL = os.getenv("BACKEND_LOG_LEVEL", "INFO").strip().upper()
+LOG_QUEUE_SIZE = int(os.getenv("BACKEND_LOG_QUEUE_SIZE", "10000"))
+
+_DATA_URL = re.compile(r"data:(?P<mime>[\w.+/-]+);base64,(?P<data>[A-Za-z0-9+/=]{64,})")
+_payload_mode: "contextvars.ContextVar[Optional[str]]" = contextvars.ContextVar("payload_mode", default=None)
+
+_DROPPED_RECORDS = registry.counter("backend_log_records_dropped", "Log records dropped because the log queue was full.")
+_listener: Optional[QueueListener] = None
+
+
+class _DroppingQueueHandler(QueueHandler):
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _DROPPED_RECORDS.inc()
+
+
+def install_queue_logging(logger_name: str = "backend") -> None:
+    """Send ``logger_name`` records through a bounded queue to the root handlers (or stderr)."""
+    global _listener
+    if _listener is not None:
+        return
+    target = logging.getLogger(logger_name)
+    handlers = list(logging.getLogger().handlers)
+    if not handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        handlers = [handler]
+    records: "queue.Queue[logging.LogRecord]" = queue.Queue(LOG_QUEUE_SIZE)
+    _listener = QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    target.addHandler(_DroppingQueueHandler(records))
+    target.setLevel(LOG_LEVEL)
+    target.propagate = False
+
+
+def stop_queue_logging() -> None:
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
+
+
+def sample_request() -> str:
+    """Decide how this request's payloads are logged: ``"skip"``, ``"truncated"`` or ``"full"``.
+
+    The decision is stored in a context variable, so tasks spawned for the
+    request (planner, image edit) inherit it.
+    """
+    draw = random.random()
+    if draw < PAYLOAD_LOG_FULL_FRACTION:
+        mode = "full"
+    elif draw < PAYLOAD_LOG_FULL_FRACTION + PAYLOAD_LOG_SAMPLE_RATE:
+        mode = "truncated"
+    else:
+        mode = "skip"
+    _payload_mode.set(mode)
+    return mode
+
+
+def log_payload(logger: logging.Logger, label: str, payload: object) -> None:
+    """Log a prompt or model output according to the request's sampling decision."""
+    mode = _payload_mode.get() or sample_request()
+    if mode == "skip" or not logger.isEnabledFor(logging.INFO):
+        return
+    text = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False, default=str)
+    if mode == "truncated":
+        text = truncate_payload(text)
+    logger.info("%s [%s]: %s", label, mode, text)
+
+
+def truncate_payload(text: str, max_chars: int = PAYLOAD_LOG_MAX_CHARS) -> str:
+    """Elide inline base64 images and cut ``text`` to ``max_chars`` characters."""
+    text = _DATA_URL.sub(lambda match: f"data:{match['mime']};base64,<{len(match['data'])} chars>", text)
+    if len(text) > max_chars:
+        return f"{text[:max_chars]}...<+{len(text) - max_chars} chars>"
+    return text
+
+
+__all__ = [
+    "install_queue_logging",
+    "log_payload",
+    "sample_request",
+    "stop_queue_logging",
+    "truncate_payload",
+]
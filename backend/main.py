@@ -2,26 +2,102 @@
 
 from __future__ import annotations
 
+import asyncio
+import json
 import logging
 import os
-from typing import List, Literal, Optional
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Literal, Optional, Tuple, TypeVar
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel, Field
 
 from .secure_env import ensure_encrypted_env
 
 ensure_encrypted_env()
 
-from .image_editor import build_image_edit_prompt, edit_room_image
-from .intent import get_candidate_products, parse_intent
+from .blob_store import BlobTooLarge, UnsupportedImage, blob_store, blob_url, is_blob_id
+from .cache import hash_key
+from .catalog import get_catalog
+from .image_editor import build_image_edit_prompt, close_clients, edit_room_image, prepare_room_image
+from .image_pipeline import shutdown_workers as shutdown_image_workers
+from .image_pipeline import start_workers as start_image_workers
+from .intent import RETRIEVAL_ENABLED, get_candidate_products, parse_intent
+from .llm_planner import close_client as close_planner_client
 from .llm_planner import plan_products_with_llm
-from .products_db import PRODUCT_INDEX, PRODUCTS, Product
+from .log_config import install_queue_logging, sample_request, stop_queue_logging
+from .metrics import FALLBACKS, PAYLOAD_BYTES, Collected, observe_timer, registry
+from .products_db import Product
+from .retrieval import get_retriever
+from .sessions import StoredEntry, compact_entry, history_for_prompt, session_store
+from .scheduler import PRIORITY_IMAGE_EDIT, PRIORITY_SPECULATIVE, Overloaded
+from .shared_state import close_shared_state
+from .singleflight import SingleFlight
+from .timing import StageTimer
 
 logger = logging.getLogger(__name__)
+T = TypeVar("T")
 
-app = FastAPI(title="Interio AI Backend", version="0.1.0")
+# "sequential" runs every stage one after another, "pipelined" prepares the room
+# photo while the planner runs, and "speculative" additionally starts the image
+# edit from the heuristic candidates and keeps it only if the planner agrees.
+PIPELINE_MODES = ("sequential", "pipelined", "speculative")
+PIPELINE_MODE = os.getenv("CHAT_PIPELINE_MODE", "pipelined").strip().lower()
+if PIPELINE_MODE not in PIPELINE_MODES:
+    PIPELINE_MODE = "pipelined"
+SPECULATIVE_PRODUCT_COUNT = 3
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+SERVER_ERROR_DETAIL = "서버 오류가 발생했습니다. 잠시 후 다시 시도해주세요."
+OVERLOADED_DETAIL = "지금 요청이 많아요. 잠시 후 다시 시도해주세요."
+
+EventEmitter = Callable[[str, Dict[str, object]], Awaitable[None]]
+ChatOutcome = Tuple[str, List["ProductCard"], Optional[str]]
+
+# A flight's result also names the session whose history its leader recorded the turn in.
+_chat_flights: "SingleFlight[Tuple[ChatOutcome, str]]" = SingleFlight()
+
+
+def _collect_coalescing() -> Iterator[Collected]:
+    stats = _chat_flights.stats()
+    yield "backend_chat_requests", "counter", "Chat pipeline invocations.", [({}, stats["calls"])]
+    yield (
+        "backend_chat_coalesced",
+        "counter",
+        "Chat requests served by an identical in-flight one.",
+        [({}, stats["coalesced"])],
+    )
+
+
+registry.register_collector(_collect_coalescing)
+
+SPECULATIVE_EDITS = registry.counter(
+    "backend_speculative_edits",
+    "Speculative image edits: kept (hit), discarded (miss) or shed and redone (shed).",
+    ("outcome",),
+)
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    """Keep the async model/HTTP clients open for the lifetime of the worker."""
+    install_queue_logging()
+    start_image_workers()
+    if RETRIEVAL_ENABLED:
+        # Start embedding the catalog now rather than on the first request.
+        await asyncio.to_thread(get_retriever)
+    yield
+    await close_planner_client()
+    await close_clients()
+    await close_shared_state()
+    await asyncio.to_thread(shutdown_image_workers)
+    stop_queue_logging()
+
+
+app = FastAPI(title="Interio AI Backend", version="0.1.0", lifespan=lifespan)
 
 _default_origins = ["http://localhost:8000", "http://127.0.0.1:8000"]
 allowed_origins_env = os.getenv("BACKEND_ALLOWED_ORIGINS")
@@ -49,7 +125,14 @@ class HistoryEntry(BaseModel):
 class ChatRequest(BaseModel):
     message: Optional[str] = ""
     imageUrl: Optional[str] = None
+    # ID returned by POST /images; preferred over sending the photo as a data URL.
+    imageId: Optional[str] = None
+    # With a sessionId the server keeps the conversation, and ``history`` only needs
+    # to carry turns it has not seen yet (usually none).
+    sessionId: Optional[str] = None
     history: List[HistoryEntry] = Field(default_factory=list)
+    # Bypass the planner and image-edit result caches for this request.
+    skipCache: bool = False
 
 
 class ProductCard(BaseModel):
@@ -59,46 +142,390 @@ class ProductCard(BaseModel):
     link: str
 
 
+class UploadResponse(BaseModel):
+    imageId: str
+    url: str
+
+
 class ChatResponse(BaseModel):
     text: str
     imageUrl: Optional[str] = None
     products: List[ProductCard] = Field(default_factory=list)
+    sessionId: Optional[str] = None
+
+
+@app.post("/images", response_model=UploadResponse)
+async def upload_image(request: Request) -> UploadResponse:
+    """Store a raw image body (``Content-Type: image/*``) and return its content ID."""
+    content_type = request.headers.get("content-type", "")
+    if not content_type.startswith("image/"):
+        raise HTTPException(status_code=415, detail="이미지 파일만 업로드할 수 있어요.")
+    declared_length = request.headers.get("content-length")
+    if declared_length and declared_length.isdigit() and int(declared_length) > blob_store.max_bytes:
+        raise HTTPException(status_code=413, detail="이미지 용량이 너무 커요.")
+    try:
+        image_id, size = await blob_store.put_stream(request.stream())
+    except BlobTooLarge:
+        raise HTTPException(status_code=413, detail="이미지 용량이 너무 커요.")
+    except UnsupportedImage:
+        raise HTTPException(status_code=415, detail="지원하지 않는 이미지 형식이에요.")
+    # Use the written size: the blob may already have been evicted by a concurrent upload.
+    PAYLOAD_BYTES.observe(size, kind="upload")
+    return UploadResponse(imageId=image_id, url=blob_url(image_id))
+
+
+@app.get("/images/{image_id}")
+async def get_image(image_id: str, request: Request) -> Response:
+    """Serve a stored image; content IDs never change, so responses are cacheable forever."""
+    if not is_blob_id(image_id) or not blob_store.exists(image_id):
+        raise HTTPException(status_code=404, detail="이미지를 찾을 수 없어요.")
+    headers = {"ETag": f'"{image_id}"', "Cache-Control": IMAGE_CACHE_CONTROL}
+    if f'"{image_id}"' in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    media_type = await asyncio.to_thread(blob_store.mime_of, image_id)
+    return FileResponse(blob_store.path_for(image_id), media_type=media_type, headers=headers)
+
+
+@app.get("/metrics")
+async def metrics_endpoint() -> Response:
+    """Prometheus text exposition of latency histograms, token counts and cache stats."""
+    return Response(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 @app.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(request: ChatRequest) -> ChatResponse:
+async def chat_endpoint(request: ChatRequest) -> Response:
     """Handle chat requests coming from the frontend."""
+    timer = StageTimer()
+    status = 500
+    try:
+        result = await _run_chat_pipeline(request, timer)
+        with timer.stage("serialize"):
+            body = result.model_dump_json()
+        status = 200
+    except HTTPException as error:
+        status = error.status_code
+        raise
+    except Overloaded as error:
+        status = 429
+        raise _overloaded_error(error)
+    except Exception as error:
+        logger.exception("Unexpected error handling /chat: %s", error)
+        raise HTTPException(status_code=500, detail=SERVER_ERROR_DETAIL)
+    finally:
+        observe_timer(timer, "/chat", status, mode=PIPELINE_MODE)
+    PAYLOAD_BYTES.observe(len(body), kind="chat_response")
+    return Response(
+        body,
+        media_type="application/json",
+        headers={"Server-Timing": timer.server_timing_header()},
+    )
+
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest) -> StreamingResponse:
+    """Stream the reply as Server-Sent Events: text deltas, then products, then the image."""
+    return StreamingResponse(
+        _stream_chat_events(request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _stream_chat_events(request: ChatRequest) -> AsyncIterator[str]:
+    timer = StageTimer()
+    queue: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+
+    async def emit(event: str, payload: Dict[str, object]) -> None:
+        await queue.put(_format_sse(event, payload))
+
+    async def run() -> None:
+        status = 500
+        try:
+            result = await _run_chat_pipeline(request, timer, emit=emit)
+            await emit("image", {"imageUrl": result.imageUrl})
+            await emit("done", {"sessionId": result.sessionId, "timings": timer.summary()})
+            status = 200
+        except HTTPException as error:
+            status = error.status_code
+            await emit("error", {"status": error.status_code, "detail": error.detail})
+        except Overloaded as error:
+            status = 429
+            await emit("error", {"status": 429, "detail": OVERLOADED_DETAIL, "retryAfter": error.retry_after})
+        except Exception as error:
+            logger.exception("Unexpected error handling /chat/stream: %s", error)
+            await emit("error", {"status": 500, "detail": SERVER_ERROR_DETAIL})
+        finally:
+            observe_timer(timer, "/chat/stream", status, mode=PIPELINE_MODE)
+            await queue.put(None)
+
+    task = asyncio.create_task(run())
     try:
-        user_message = request.message or ""
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            yield item
+    finally:
+        # The client went away before the pipeline finished; stop paying for model calls.
+        if not task.done():
+            task.cancel()
+
+
+def _chat_turn(user_message: str, room_image_url: Optional[str], outcome: ChatOutcome) -> List[StoredEntry]:
+    text, _, edited_image_url = outcome
+    return [
+        compact_entry("user", user_message, room_image_url),
+        compact_entry("assistant", text, edited_image_url),
+    ]
+
+
+def _overloaded_error(error: Overloaded) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail=OVERLOADED_DETAIL,
+        headers={"Retry-After": str(max(1, round(error.retry_after)))},
+    )
+
+
+def _format_sse(event: str, payload: Dict[str, object]) -> str:
+    data = json.dumps(jsonable_encoder(payload), ensure_ascii=False)
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+async def _run_chat_pipeline(
+    request: ChatRequest,
+    timer: StageTimer,
+    emit: Optional[EventEmitter] = None,
+) -> ChatResponse:
+    user_message = request.message or ""
+    sample_request()
+    room_image_url = _resolve_room_image(request)
+    with timer.stage("history"):
+        session_id, history = await _load_session(request)
+
+    # Double-clicks and duplicate tabs send identical requests; run the models once for them.
+    flight_key = hash_key(
+        PIPELINE_MODE,
+        user_message,
+        room_image_url or "",
+        json.dumps(history, ensure_ascii=False, sort_keys=True),
+        request.skipCache,
+    )
+
+    async def plan_and_record() -> Tuple[ChatOutcome, str]:
+        # The leader records the turn inside the flight, so coalesced requests from
+        # the same session see it done and a repeated message is still recorded.
+        outcome = await _plan_and_edit(user_message, room_image_url, history, request.skipCache, timer, emit)
+        await session_store.append(session_id, _chat_turn(user_message, room_image_url, outcome))
+        return outcome, session_id
+
+    started = time.perf_counter()
+    (outcome, recorded_session_id), shared = await _chat_flights.do(flight_key, plan_and_record)
+    text, product_cards, edited_image_url = outcome
+    if shared:
+        timer.record("coalesced", (time.perf_counter() - started) * 1000.0)
+        logger.info("Coalesced duplicate chat request %s", flight_key[:12])
+        if emit is not None:
+            await emit("message", {"text": text})
+            await emit("products", {"products": product_cards})
+        if recorded_session_id != session_id:
+            # Joined a flight led by another conversation with the same history.
+            await session_store.append(session_id, _chat_turn(user_message, room_image_url, outcome))
+    return ChatResponse(
+        text=text,
+        imageUrl=edited_image_url,
+        products=product_cards,
+        sessionId=session_id,
+    )
+
+
+async def _plan_and_edit(
+    user_message: str,
+    room_image_url: Optional[str],
+    history: List[Dict[str, str]],
+    skip_cache: bool,
+    timer: StageTimer,
+    emit: Optional[EventEmitter] = None,
+) -> ChatOutcome:
+    """Run intent parsing, the planner and the image edit; return text, cards and image URL."""
+    with timer.stage("intent"):
         intent = parse_intent(user_message)
-        candidate_products = get_candidate_products(intent)
-        plan = plan_products_with_llm(user_message, intent, candidate_products)
+    with timer.stage("candidates"):
+        # Embedding the query is CPU work; keep it off the event loop.
+        candidate_products = await asyncio.to_thread(get_candidate_products, intent, query=user_message)
+
+    pending: List[asyncio.Task] = []
+    try:
+        image_task: Optional[asyncio.Task] = None
+        speculative_task: Optional[asyncio.Task] = None
+        speculative_ids: List[str] = []
+        if room_image_url and PIPELINE_MODE != "sequential":
+            image_task = _background(timer.track("image_prepare", prepare_room_image(room_image_url)))
+            pending.append(image_task)
+            if PIPELINE_MODE == "speculative":
+                speculative_products = candidate_products[:SPECULATIVE_PRODUCT_COUNT]
+                speculative_ids = [str(product["id"]) for product in speculative_products]
+                speculative_task = _background(
+                    _edit_after_prepare(
+                        room_image_url,
+                        user_message,
+                        intent,
+                        speculative_products,
+                        image_task,
+                        timer,
+                        stage="image_edit_speculative",
+                        use_cache=not skip_cache,
+                        priority=PRIORITY_SPECULATIVE,
+                    )
+                )
+                pending.append(speculative_task)
+
+        on_message_delta = _forward_deltas(emit) if emit is not None else None
+        with timer.stage("planner"):
+            plan = await plan_products_with_llm(
+                user_message,
+                intent,
+                candidate_products,
+                on_message_delta=on_message_delta,
+                use_cache=not skip_cache,
+                history=history,
+            )
 
         selected_products = _lookup_products(plan["selected_product_ids"])
         if not selected_products:
-            selected_products = candidate_products[:3] or PRODUCTS[:3]
+            selected_products = candidate_products[:3] or get_catalog().products[:3]
+        product_cards = [_product_to_card(product) for product in selected_products]
+        if emit is not None:
+            # The final text is authoritative: it replaces a partial stream when the planner fell back.
+            await emit("message", {"text": plan["assistant_message"]})
+            await emit("products", {"products": product_cards})
 
         edited_image_url = None
-        if request.imageUrl:
-            prompt_content = build_image_edit_prompt(user_message, intent, selected_products)
-            edited_image_url = edit_room_image(request.imageUrl, prompt_content)
-
-        return ChatResponse(
-            text=plan["assistant_message"],
-            imageUrl=edited_image_url,
-            products=[_product_to_card(product) for product in selected_products],
-        )
-    except HTTPException:
-        raise
-    except Exception as error:
-        logger.exception("Unexpected error handling /chat: %s", error)
-        raise HTTPException(status_code=500, detail="서버 오류가 발생했습니다. 잠시 후 다시 시도해주세요.")
+        if room_image_url:
+            selected_ids = [str(product["id"]) for product in selected_products]
+            speculative_hit = speculative_task is not None and sorted(selected_ids) == sorted(speculative_ids)
+            if speculative_hit:
+                try:
+                    edited_image_url = await speculative_task
+                    SPECULATIVE_EDITS.inc(outcome="hit")
+                except Overloaded:
+                    # Speculative edits queue at the lowest priority; retry at the normal one.
+                    SPECULATIVE_EDITS.inc(outcome="shed")
+                    speculative_hit = False
+            elif speculative_task:
+                SPECULATIVE_EDITS.inc(outcome="miss")
+                speculative_task.cancel()
+            if not speculative_hit:
+                if image_task is None:
+                    image_task = _background(timer.track("image_prepare", prepare_room_image(room_image_url)))
+                    pending.append(image_task)
+                try:
+                    edited_image_url = await _edit_after_prepare(
+                        room_image_url,
+                        user_message,
+                        intent,
+                        selected_products,
+                        image_task,
+                        timer,
+                        use_cache=not skip_cache,
+                    )
+                except Overloaded as error:
+                    # The plan is already paid for (and maybe streamed); reply without the picture
+                    # rather than turning the whole answer into a 429.
+                    logger.warning("Image edit shed, replying without an image: %s", error)
+                    FALLBACKS.inc(component="image_edit", reason="Overloaded")
+    finally:
+        for task in pending:
+            if not task.done():
+                task.cancel()
+
+    return plan["assistant_message"], product_cards, edited_image_url
+
+
+def _resolve_room_image(request: ChatRequest) -> Optional[str]:
+    if request.imageId:
+        if not blob_store.exists(request.imageId):
+            raise HTTPException(status_code=400, detail="업로드한 이미지를 찾을 수 없어요. 다시 첨부해주세요.")
+        return blob_url(request.imageId)
+    return request.imageUrl
+
+
+async def _load_session(request: ChatRequest) -> Tuple[str, List[Dict[str, str]]]:
+    """Store any new history turns and return the budgeted history for the planner."""
+    session_id = session_store.resolve(request.sessionId)
+    entries = list(request.history)
+    if (
+        entries
+        and entries[-1].role == "user"
+        and entries[-1].text == (request.message or "")
+    ):
+        # Older clients include the current message at the end of the history.
+        entries.pop()
+    stored = await session_store.append(
+        session_id,
+        [compact_entry(entry.role, entry.text, entry.imageUrl) for entry in entries],
+    )
+    return session_id, history_for_prompt(stored)
+
+
+def _background(coroutine: Awaitable[T]) -> "asyncio.Task[T]":
+    """Start a pipeline task whose failure is handled by whoever awaits it, if anyone does.
+
+    A speculative edit can fail (e.g. ``Overloaded``) and then be dropped unawaited;
+    retrieving the exception keeps asyncio from logging it as never retrieved.
+    """
+    task = asyncio.ensure_future(coroutine)
+    task.add_done_callback(_retrieve_exception)
+    return task
+
+
+def _retrieve_exception(task: asyncio.Task) -> None:
+    if not task.cancelled():
+        task.exception()
+
+
+def _forward_deltas(emit: EventEmitter) -> Callable[[str], Awaitable[None]]:
+    async def on_message_delta(text: str) -> None:
+        await emit("delta", {"text": text})
+
+    return on_message_delta
+
+
+async def _edit_after_prepare(
+    image_url: str,
+    user_message: str,
+    intent: Dict[str, object],
+    products: List[Product],
+    image_task: "asyncio.Task[Optional[str]]",
+    timer: StageTimer,
+    stage: str = "image_edit",
+    use_cache: bool = True,
+    priority: int = PRIORITY_IMAGE_EDIT,
+) -> Optional[str]:
+    prepared_image = await asyncio.shield(image_task)
+    if not prepared_image:
+        return None
+    # Thumbnails not yet memoized are read from disk; keep that off the event loop.
+    prompt_content = await asyncio.to_thread(build_image_edit_prompt, user_message, intent, products)
+    product_ids = [str(product["id"]) for product in products]
+    return await timer.track(
+        stage,
+        edit_room_image(
+            image_url,
+            prompt_content,
+            prepared_image=prepared_image,
+            product_ids=product_ids,
+            use_cache=use_cache,
+            priority=priority,
+        ),
+    )
 
 
 def _lookup_products(product_ids: List[str]) -> List[Product]:
+    by_id = get_catalog().by_id
     items = []
     for product_id in product_ids:
-        product = PRODUCT_INDEX.get(product_id)
+        product = by_id.get(product_id)
         if product:
             items.append(product)
     return items
@@ -0,0 +1,297 @@
+"""In-process metrics rendered in the Prometheus text exposition format.
+
+Counters and histograms are updated on the hot path with a single lock-protected
+dictionary update. Components that already keep their own counters (caches,
+the scheduler, request coalescing) are exported through collector callbacks
+evaluated only when ``/metrics`` is scraped.
+
+``BACKEND_LOG_FORMAT=json`` switches the per-request summary log line to one
+JSON object per request.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - not available on Windows
+    resource = None
+
+from .timing import StageTimer
+
+logger = logging.getLogger(__name__)
+
+JSON_LOGS = os.getenv("BACKEND_LOG_FORMAT", "text").strip().lower() == "json"
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60)
+BYTES_BUCKETS = (1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7, 2e7)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+LabelValues = Tuple[str, ...]
+Sample = Tuple[Dict[str, str], float]
+# Collectors yield (metric name, type, help text, [(labels, value), ...]).
+Collected = Tuple[str, str, str, List[Sample]]
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, object]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _labels(self, key: LabelValues, extra: Iterable[Tuple[str, str]] = ()) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: object) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: object) -> float:
+        key = self._key(labels)
+        with self._lock:
+            return self._values.get(key, 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}_total{self._labels(key)} {_format(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket..., +Inf count], sum.
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: object) -> None:
+        key = self._key(labels)
+        index = _bucket_index(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels: object) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._values.items())
+        lines: List[str] = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else _format(bound)
+                lines.append(f"{self.name}_bucket{self._labels(key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {_format(total)}")
+            lines.append(f"{self.name}_count{self._labels(key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[Collected]]] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], Iterable[Collected]]) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        # Several collectors may contribute samples to one family (e.g. per-module caches).
+        families: Dict[str, Tuple[str, str, List[Sample]]] = {}
+        for collector in self._collectors:
+            try:
+                collected = list(collector())
+            except Exception as error:  # pragma: no cover - defensive
+                logger.warning("Metrics collector failed: %s", error)
+                continue
+            for name, kind, documentation, samples in collected:
+                families.setdefault(name, (kind, documentation, []))[2].extend(samples)
+        for name, (kind, documentation, samples) in families.items():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            suffix = "_total" if kind == "counter" else ""
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+                label_text = f"{{{label_text}}}" if label_text else ""
+                lines.append(f"{name}{suffix}{label_text} {_format(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    "backend_request_seconds", "End-to-end request latency.", ("endpoint", "status")
+)
+STAGE_SECONDS = registry.histogram(
+    "backend_stage_seconds", "Latency of individual pipeline stages.", ("stage",)
+)
+PAYLOAD_BYTES = registry.histogram(
+    "backend_payload_bytes", "Size of images and responses moving through the pipeline.", ("kind",), BYTES_BUCKETS
+)
+LLM_TOKENS = registry.histogram(
+    "backend_llm_tokens", "Tokens per model call as reported by the provider.", ("model", "kind"), TOKEN_BUCKETS
+)
+FALLBACKS = registry.counter(
+    "backend_fallbacks", "Degraded results (planner fallback, missing image edit).", ("component", "reason")
+)
+
+
+def observe_timer(timer: StageTimer, endpoint: str, status: int = 200, **fields: object) -> None:
+    """Feed the stage durations of one request into the histograms and log them."""
+    for name, duration_ms in timer.durations.items():
+        STAGE_SECONDS.observe(duration_ms / 1000.0, stage=name)
+    REQUEST_SECONDS.observe(timer.total_ms() / 1000.0, endpoint=endpoint, status=status)
+    log_request(endpoint, status, timer.summary(), **fields)
+
+
+def log_request(endpoint: str, status: int, timings: Dict[str, float], **fields: object) -> None:
+    if JSON_LOGS:
+        record = {"event": "request", "endpoint": endpoint, "status": status, "timings_ms": timings, **fields}
+        logger.info(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+    else:
+        details = " ".join(f"{key}={value}" for key, value in fields.items())
+        logger.info("%s %s %s stage timings: %s", endpoint, status, details, timings)
+
+
+def record_usage(model: str, usage: object) -> None:
+    """Record ``prompt``/``completion`` token counts from an OpenAI-style ``usage`` object."""
+    if usage is None:
+        return
+    for kind in ("prompt", "completion"):
+        value = getattr(usage, f"{kind}_tokens", None)
+        if isinstance(value, (int, float)):
+            LLM_TOKENS.observe(value, model=model, kind=kind)
+
+
+def cache_collector(caches: Callable[[], Dict[str, Dict[str, int]]]) -> Callable[[], Iterable[Collected]]:
+    """Export ``{cache: {"hits": n, "misses": n, ...}}`` style stats as counters."""
+
+    def collect() -> Iterable[Collected]:
+        stats = caches()
+        for field in ("hits", "misses"):
+            samples = [({"cache": name}, float(values.get(field, 0))) for name, values in stats.items()]
+            yield f"backend_cache_{field}", "counter", f"Cache {field} per cache.", samples
+        for field, documentation in (("entries", "Entries held by in-memory caches."), ("bytes", "Bytes held by disk caches.")):
+            samples = [({"cache": name}, float(values[field])) for name, values in stats.items() if field in values]
+            if samples:
+                yield f"backend_cache_{field}", "gauge", documentation, samples
+
+    return collect
+
+
+def _collect_process() -> Iterable[Collected]:
+    """Resident memory of this worker, labelled by PID so multi-worker scrapes can be told apart."""
+    labels = {"pid": str(os.getpid())}
+    try:
+        with open("/proc/self/statm", "rb") as handle:
+            resident_pages = int(handle.read().split()[1])
+        yield "backend_process_resident_memory_bytes", "gauge", "Resident memory of this worker.", [
+            (labels, float(resident_pages * os.sysconf("SC_PAGE_SIZE")))
+        ]
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    if resource is not None:
+        peak_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        yield "backend_process_peak_memory_bytes", "gauge", "Peak resident memory of this worker.", [
+            (labels, float(peak_kib * 1024))
+        ]
+
+
+registry.register_collector(_collect_process)
+
+
+def _bucket_index(buckets: Sequence[float], value: float) -> int:
+    for index, bound in enumerate(buckets):
+        if value <= bound:
+            return index
+    return len(buckets)
+
+
+def _format(value: float) -> str:
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: object) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+__all__ = [
+    "Counter",
+    "FALLBACKS",
+    "Histogram",
+    "LLM_TOKENS",
+    "PAYLOAD_BYTES",
+    "REQUEST_SECONDS",
+    "Registry",
+    "STAGE_SECONDS",
+    "cache_collector",
+    "log_request",
+    "observe_timer",
+    "record_usage",
+    "registry",
+]
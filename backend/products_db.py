@@ -2,9 +2,10 @@
 
 from __future__ import annotations
 
-from typing import Dict, List
+from typing import Dict, List, Mapping
 
-Product = Dict[str, object]
+# Built-in entries are plain dicts; catalogs loaded from disk use read-only mapping views.
+Product = Mapping[str, object]
 
 PRODUCTS: List[Product] = [
     {
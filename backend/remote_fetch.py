@@ -0,0 +1,207 @@
+"""Pooled, size-limited fetcher for remote room photos with a revalidating disk cache.
+
+Bodies are streamed and the download is aborted as soon as it exceeds
+``REMOTE_IMAGE_MAX_BYTES`` or the server reports a non-image content type.
+Successful responses are stored on disk together with their ``ETag`` and
+``Last-Modified`` validators: within ``max-age`` (or ``REMOTE_IMAGE_FRESH_SECONDS``)
+the cached copy is used as-is, afterwards a conditional request revalidates it
+and a ``304`` reuses the cached bytes without downloading them again.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+import httpx
+
+from .blob_store import UPLOAD_MAX_BYTES, sniff_image_mime
+from .cache import DEFAULT_CACHE_DIR, DiskCache, hash_key
+from .metrics import cache_collector, registry
+
+logger = logging.getLogger(__name__)
+
+REMOTE_IMAGE_MAX_BYTES = int(os.getenv("REMOTE_IMAGE_MAX_BYTES", str(UPLOAD_MAX_BYTES)))
+REMOTE_IMAGE_FRESH_SECONDS = float(os.getenv("REMOTE_IMAGE_FRESH_SECONDS", "300"))
+REMOTE_IMAGE_CACHE_MAX_BYTES = int(os.getenv("REMOTE_IMAGE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+REMOTE_IMAGE_CACHE_TTL_SECONDS = float(os.getenv("REMOTE_IMAGE_CACHE_TTL_SECONDS", str(24 * 3600)))
+
+_MAX_AGE_PATTERN = re.compile(r"max-age=(\d+)")
+# Some CDNs label images generically; those bodies are accepted when their magic bytes match.
+_GENERIC_CONTENT_TYPES = {"", "application/octet-stream", "binary/octet-stream"}
+
+
+class RemoteImageError(ValueError):
+    """Raised when a remote image is unreachable, too large or not an image."""
+
+
+class RemoteFetcher:
+    """Keep-alive HTTP client for remote images plus its validator-aware cache.
+
+    Both are created on first use, so importing the module stays cheap, and
+    :meth:`close` drops the client so a later fetch (e.g. after the app's
+    lifespan restarts in the same process) opens a new one. ``cache_factory``
+    defers the disk cache's directory scan the same way.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = REMOTE_IMAGE_MAX_BYTES,
+        cache: Optional[DiskCache] = None,
+        fresh_seconds: float = REMOTE_IMAGE_FRESH_SECONDS,
+        cache_factory: Optional[Callable[[], DiskCache]] = None,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.fresh_seconds = fresh_seconds
+        self._cache = cache
+        self._cache_factory = cache_factory
+        self._cache_lock = threading.Lock()
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def cache(self) -> Optional[DiskCache]:
+        if self._cache is None and self._cache_factory is not None:
+            with self._cache_lock:
+                if self._cache is None:
+                    self._cache = self._cache_factory()
+        return self._cache
+
+    def get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(15.0),
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+                follow_redirects=True,
+            )
+        return self._client
+
+    def cache_stats(self) -> Dict[str, int]:
+        return self._cache.stats() if self._cache is not None else {}
+
+    async def fetch(self, url: str) -> Tuple[bytes, str]:
+        """Return ``(body, mime)`` for ``url``, from the cache when it is still valid."""
+        if not url.startswith(("http://", "https://")):
+            raise RemoteImageError(f"Unsupported image URL scheme: {url[:32]}")
+        cache_key = hash_key("remote-image", url)
+        cached = await self._load(cache_key)
+        if cached:
+            meta, body = cached
+            if time.time() - float(meta.get("fetched_at", 0)) < float(meta.get("max_age", 0)):
+                return body, str(meta["mime"])
+
+        headers: Dict[str, str] = {}
+        if cached:
+            if cached[0].get("etag"):
+                headers["If-None-Match"] = str(cached[0]["etag"])
+            if cached[0].get("last_modified"):
+                headers["If-Modified-Since"] = str(cached[0]["last_modified"])
+
+        try:
+            async with self.get_client().stream("GET", url, headers=headers) as response:
+                if response.status_code == 304 and cached:
+                    meta, body = cached
+                    meta.update(self._validators(response, meta))
+                    await self._store(cache_key, meta, body)
+                    return body, str(meta["mime"])
+                response.raise_for_status()
+                mime = response.headers.get("content-type", "").split(";", 1)[0].strip().lower()
+                if not mime.startswith("image/") and mime not in _GENERIC_CONTENT_TYPES:
+                    raise RemoteImageError(f"Remote URL is not an image ({mime})")
+                declared = response.headers.get("content-length")
+                if declared and declared.isdigit() and int(declared) > self.max_bytes:
+                    raise RemoteImageError(f"Remote image exceeds {self.max_bytes} bytes")
+                body = await self._read_limited(response)
+        except httpx.TransportError as error:
+            if cached:
+                logger.warning("Revalidating %s failed, serving the cached copy: %s", url, error)
+                return cached[1], str(cached[0]["mime"])
+            raise RemoteImageError(f"Failed to fetch remote image: {error}") from error
+        except httpx.HTTPError as error:
+            raise RemoteImageError(f"Failed to fetch remote image: {error}") from error
+
+        sniffed = sniff_image_mime(body[:16])
+        if not mime.startswith("image/"):
+            if not sniffed:
+                raise RemoteImageError("Remote URL is not an image")
+            mime = sniffed
+        await self._store(cache_key, {"mime": mime, **self._validators(response, {})}, body)
+        return body, mime
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _read_limited(self, response: httpx.Response) -> bytes:
+        chunks = []
+        size = 0
+        async for chunk in response.aiter_bytes():
+            size += len(chunk)
+            if size > self.max_bytes:
+                raise RemoteImageError(f"Remote image exceeds {self.max_bytes} bytes")
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def _validators(self, response: httpx.Response, previous: Dict[str, object]) -> Dict[str, object]:
+        """Collect validators and freshness from ``response``, keeping ones a 304 omits."""
+        cache_control = response.headers.get("cache-control", "").lower()
+        match = _MAX_AGE_PATTERN.search(cache_control)
+        if "no-cache" in cache_control or "no-store" in cache_control:
+            max_age = 0.0
+        elif match:
+            max_age = float(match.group(1))
+        else:
+            max_age = self.fresh_seconds
+        return {
+            "etag": response.headers.get("etag") or previous.get("etag"),
+            "last_modified": response.headers.get("last-modified") or previous.get("last_modified"),
+            "max_age": max_age,
+            "fetched_at": time.time(),
+        }
+
+    async def _load(self, cache_key: str) -> Optional[Tuple[Dict[str, object], bytes]]:
+        if self._cache is None and self._cache_factory is None:
+            return None
+        data = await asyncio.to_thread(self._cache_get, cache_key)
+        if not data:
+            return None
+        header, _, body = data.partition(b"\n")
+        try:
+            return json.loads(header), body
+        except ValueError:
+            return None
+
+    async def _store(self, cache_key: str, meta: Dict[str, object], body: bytes) -> None:
+        if self._cache is None and self._cache_factory is None:
+            return
+        header = json.dumps(meta, separators=(",", ":")).encode("utf-8")
+        await asyncio.to_thread(self._cache_set, cache_key, header + b"\n" + body)
+
+    # Run in worker threads: the first access creates the cache, which scans its directory.
+    def _cache_get(self, cache_key: str) -> Optional[bytes]:
+        cache = self.cache
+        return cache.get(cache_key) if cache else None
+
+    def _cache_set(self, cache_key: str, data: bytes) -> None:
+        cache = self.cache
+        if cache:
+            cache.set(cache_key, data)
+
+
+def _remote_image_cache() -> DiskCache:
+    return DiskCache(DEFAULT_CACHE_DIR / "remote_images", REMOTE_IMAGE_CACHE_MAX_BYTES, REMOTE_IMAGE_CACHE_TTL_SECONDS)
+
+
+fetcher = RemoteFetcher(cache_factory=_remote_image_cache if REMOTE_IMAGE_CACHE_MAX_BYTES > 0 else None)
+
+if REMOTE_IMAGE_CACHE_MAX_BYTES > 0:
+    registry.register_collector(cache_collector(lambda: {"remote_images": fetcher.cache_stats()}))
+
+
+__all__ = ["RemoteFetcher", "RemoteImageError", "fetcher"]
@@ -0,0 +1,326 @@
+"""Embedding-based product retrieval used to rank candidates for the planner.
+
+Product embeddings live in a dense float32 matrix (one L2-normalized row per
+product), so scoring a query is a single matrix-vector product. The matrix can
+be precomputed offline with ``python -m backend.retrieval`` and is loaded from
+``RETRIEVAL_EMBEDDINGS_PATH`` when its product IDs match the current catalog;
+otherwise it is built in-process. Either way the build runs in a background
+thread (started when the server boots), and candidate selection uses the
+keyword index until it is ready.
+
+``RETRIEVAL_MODEL`` may point at a local sentence-transformers model directory.
+Without it (or without the package) a deterministic feature-hashing embedder is
+used, which needs no model files and no network access.
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import re
+import threading
+import time
+import weakref
+import zlib
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - dependency might be missing locally
+    np = None
+
+from .cache import DEFAULT_CACHE_DIR
+from .catalog import CatalogSnapshot, get_catalog
+from .catalog_index import BUDGET_WEIGHT, ROOM_WEIGHT, STYLE_WEIGHT
+from .products_db import Product
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIM = int(os.getenv("RETRIEVAL_DIM", "512"))
+MODEL_PATH = os.getenv("RETRIEVAL_MODEL", "").strip()
+EMBEDDINGS_PATH = Path(
+    os.getenv("RETRIEVAL_EMBEDDINGS_PATH") or DEFAULT_CACHE_DIR / "product_embeddings.npz"
+)
+# After a failed build the next attempt for the same catalog waits this long.
+BUILD_RETRY_SECONDS = float(os.getenv("RETRIEVAL_BUILD_RETRY_SECONDS", "30"))
+
+_TOKEN_PATTERN = re.compile(r"[0-9a-z]+|[가-힣]+")
+
+
+class HashingEmbedder:
+    """Deterministic bag of words + character n-grams hashed into a fixed dimension."""
+
+    def __init__(self, dim: int = EMBEDDING_DIM) -> None:
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def embed(self, texts: Sequence[str]) -> "np.ndarray":
+        rows: List[int] = []
+        cols: List[int] = []
+        values: List[float] = []
+        for row, text in enumerate(texts):
+            for feature in _features(text):
+                digest = zlib.crc32(feature.encode("utf-8"))
+                rows.append(row)
+                cols.append(digest % self.dim)
+                values.append(1.0 if digest & 0x80000000 else -1.0)
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        if rows:
+            np.add.at(matrix, (np.asarray(rows), np.asarray(cols)), np.asarray(values, dtype=np.float32))
+        # Sublinear term frequency keeps long descriptions from dominating.
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        return _normalize_rows(matrix)
+
+
+class LocalModelEmbedder:
+    """Wraps a sentence-transformers model loaded from a local directory."""
+
+    def __init__(self, model_path: str) -> None:
+        from sentence_transformers import SentenceTransformer
+
+        self._model = SentenceTransformer(model_path, device="cpu")
+        self.name = f"st:{Path(model_path).name}"
+
+    def embed(self, texts: Sequence[str]) -> "np.ndarray":
+        vectors = self._model.encode(list(texts), batch_size=64, convert_to_numpy=True)
+        return _normalize_rows(vectors.astype(np.float32))
+
+
+_embedder = None
+_embedder_lock = threading.Lock()
+
+
+def get_embedder():
+    """Return the configured embedder, falling back to :class:`HashingEmbedder`."""
+    global _embedder
+    with _embedder_lock:
+        if _embedder is None:
+            if MODEL_PATH:
+                try:
+                    _embedder = LocalModelEmbedder(MODEL_PATH)
+                except Exception as error:
+                    logger.warning("Falling back to hashing embedder (%s): %s", MODEL_PATH, error)
+            if _embedder is None:
+                _embedder = HashingEmbedder()
+        return _embedder
+
+
+class ProductRetriever:
+    """Embedding matrix for one catalog snapshot plus per-category rank arrays."""
+
+    def __init__(self, snapshot: CatalogSnapshot, matrix: "np.ndarray", embedder) -> None:
+        self.snapshot = snapshot
+        self.matrix = matrix
+        self.embedder = embedder
+        self._category_ranks = {
+            category: np.asarray(ranks, dtype=np.int64)
+            for category, ranks in snapshot.index.by_category.items()
+        }
+
+    def scores(
+        self,
+        query: str,
+        room_type: Optional[str] = None,
+        style_tags: Iterable[str] = (),
+        budget_band: Optional[str] = None,
+    ) -> "np.ndarray":
+        """Cosine similarity to ``query`` plus the keyword-index weights for the intent."""
+        query_vector = self.embedder.embed([query])[0]
+        scores = self.matrix @ query_vector
+        index = self.snapshot.index
+        if room_type and room_type in index.by_room:
+            scores[index.by_room[room_type]] += ROOM_WEIGHT
+        for style in set(style_tags):
+            if style in index.by_style:
+                scores[index.by_style[style]] += STYLE_WEIGHT
+        if budget_band and budget_band in index.by_price_band:
+            scores[index.by_price_band[budget_band]] += BUDGET_WEIGHT
+        return scores
+
+    def top_per_category(
+        self,
+        query: str,
+        limit_per_category: int,
+        room_type: Optional[str] = None,
+        style_tags: Iterable[str] = (),
+        budget_band: Optional[str] = None,
+    ) -> List[Product]:
+        scores = self.scores(query, room_type, style_tags, budget_band)
+        picked: List[int] = []
+        for ranks in self._category_ranks.values():
+            if len(ranks) <= limit_per_category:
+                picked.extend(ranks.tolist())
+                continue
+            category_scores = scores[ranks]
+            top = np.argpartition(-category_scores, limit_per_category)[:limit_per_category]
+            picked.extend(ranks[top].tolist())
+        picked.sort(key=lambda rank: (-scores[rank], rank))
+        return [self.snapshot.products[rank] for rank in picked]
+
+
+_retrievers: "weakref.WeakKeyDictionary[CatalogSnapshot, ProductRetriever]" = weakref.WeakKeyDictionary()
+_building: "weakref.WeakKeyDictionary[CatalogSnapshot, threading.Event]" = weakref.WeakKeyDictionary()
+_failed_at: "weakref.WeakKeyDictionary[CatalogSnapshot, float]" = weakref.WeakKeyDictionary()
+_retrievers_lock = threading.Lock()
+
+
+def get_retriever(snapshot: Optional[CatalogSnapshot] = None, wait: bool = False) -> Optional[ProductRetriever]:
+    """Return the retriever for ``snapshot``, or ``None`` while it is unavailable.
+
+    The first call for a snapshot starts building it in a background thread and
+    never blocks the caller unless ``wait`` is set (used by offline tools).
+    """
+    if np is None:
+        return None
+    snapshot = snapshot or get_catalog()
+    with _retrievers_lock:
+        retriever = _retrievers.get(snapshot)
+        if retriever is not None:
+            return retriever
+        ready = _building.get(snapshot)
+        if ready is None:
+            failed_at = _failed_at.get(snapshot)
+            if failed_at is not None and time.monotonic() - failed_at < BUILD_RETRY_SECONDS and not wait:
+                return None
+            ready = _building[snapshot] = threading.Event()
+            threading.Thread(
+                target=_build_retriever, args=(snapshot, ready), name="retrieval-build", daemon=True
+            ).start()
+    if not wait:
+        return None
+    ready.wait()
+    with _retrievers_lock:
+        return _retrievers.get(snapshot)
+
+
+def product_text(product: Product) -> str:
+    parts = [product.get("category"), product.get("title") or product.get("name"), product.get("description")]
+    for field in ("room", "style"):
+        value = product.get(field)
+        if isinstance(value, (list, tuple)):
+            parts.extend(value)
+    return " ".join(str(part) for part in parts if part)
+
+
+def embed_catalog(products: Sequence[Product], embedder=None, batch_size: int = 1024) -> "np.ndarray":
+    embedder = embedder or get_embedder()
+    batches = [
+        embedder.embed([product_text(product) for product in products[start : start + batch_size]])
+        for start in range(0, len(products), batch_size)
+    ]
+    if not batches:
+        return np.zeros((0, getattr(embedder, "dim", EMBEDDING_DIM)), dtype=np.float32)
+    return np.vstack(batches)
+
+
+def save_embeddings(path: Path, products: Sequence[Product], matrix: "np.ndarray", embedder_name: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    ids = np.asarray([str(product["id"]) for product in products])
+    with path.open("wb") as handle:
+        np.savez(handle, ids=ids, matrix=matrix, embedder=np.asarray(embedder_name))
+
+
+def _load_embeddings(path: Path, snapshot: CatalogSnapshot, embedder_name: str) -> Optional["np.ndarray"]:
+    if not path.exists():
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            if str(data["embedder"]) != embedder_name:
+                return None
+            ids = data["ids"]
+            if len(ids) != len(snapshot.products) or any(
+                stored != str(product["id"]) for stored, product in zip(ids.tolist(), snapshot.products)
+            ):
+                return None
+            return np.ascontiguousarray(data["matrix"], dtype=np.float32)
+    except Exception as error:
+        logger.warning("Ignoring unreadable embeddings file %s: %s", path, error)
+        return None
+
+
+def _build_retriever(snapshot: CatalogSnapshot, ready: threading.Event) -> Optional[ProductRetriever]:
+    started = time.perf_counter()
+    retriever: Optional[ProductRetriever] = None
+    try:
+        embedder = get_embedder()
+        matrix = _load_embeddings(EMBEDDINGS_PATH, snapshot, embedder.name)
+        source = str(EMBEDDINGS_PATH)
+        if matrix is None:
+            matrix = embed_catalog(snapshot.products, embedder)
+            source = "in-process"
+        retriever = ProductRetriever(snapshot, matrix, embedder)
+    except Exception as error:
+        logger.exception("Failed to build product embeddings: %s", error)
+        return None
+    finally:
+        with _retrievers_lock:
+            if retriever is not None:
+                _retrievers[snapshot] = retriever
+                _failed_at.pop(snapshot, None)
+            else:
+                _failed_at[snapshot] = time.monotonic()
+            _building.pop(snapshot, None)
+        ready.set()
+    logger.info(
+        "Product embeddings ready: %d x %d from %s (%s) in %.1f ms",
+        matrix.shape[0],
+        matrix.shape[1],
+        source,
+        embedder.name,
+        (time.perf_counter() - started) * 1000.0,
+    )
+    return retriever
+
+
+def _features(text: str) -> Iterable[str]:
+    for token in _TOKEN_PATTERN.findall((text or "").lower()):
+        yield f"w:{token}"
+        padded = f" {token} "
+        for size in (2, 3):
+            for start in range(len(padded) - size + 1):
+                yield padded[start : start + size]
+
+
+def _normalize_rows(matrix: "np.ndarray") -> "np.ndarray":
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Precompute product embeddings for retrieval.")
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=str(EMBEDDINGS_PATH),
+        help=f"Destination .npz file (default: {EMBEDDINGS_PATH})",
+    )
+    args = parser.parse_args()
+    if np is None:
+        raise SystemExit("numpy is required to build embeddings.")
+
+    snapshot = get_catalog()
+    embedder = get_embedder()
+    started = time.perf_counter()
+    matrix = embed_catalog(snapshot.products, embedder)
+    save_embeddings(Path(args.output), snapshot.products, matrix, embedder.name)
+    print(
+        f"Embedded {matrix.shape[0]} products with {embedder.name} "
+        f"in {time.perf_counter() - started:.1f}s -> {args.output}"
+    )
+
+
+__all__ = [
+    "HashingEmbedder",
+    "LocalModelEmbedder",
+    "ProductRetriever",
+    "embed_catalog",
+    "get_embedder",
+    "get_retriever",
+]
+
+
+if __name__ == "__main__":
+    main()
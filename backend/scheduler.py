@@ -0,0 +1,260 @@
+"""Admission control for expensive model calls.
+
+Every model gets a lane with a concurrency limit, an optional token-bucket
+rate limit and a bounded priority queue. Callers wait in the queue (lower
+priority values first) until a slot and a token are free; when the queue is
+full, or the caller's deadline passes before it is admitted, :class:`Overloaded`
+is raised immediately instead of letting the request pile up behind the
+provider's rate limits. The API maps it to ``429 Too Many Requests``.
+
+Limits are configured by the modules that own the clients through
+:meth:`Scheduler.configure`; models that were never configured are unlimited.
+``SCHEDULER_GLOBAL_CONCURRENCY`` additionally caps calls across all models, and
+that shared queue is where planner calls overtake queued image edits. It is on
+by default and set below the sum of the per-model limits, so under load the
+planner (on every reply's critical path) is admitted before image edits.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from .metrics import Collected, registry
+
+logger = logging.getLogger(__name__)
+
+# Lower values are admitted first.
+PRIORITY_PLANNER = 0
+PRIORITY_IMAGE_EDIT = 10
+PRIORITY_SPECULATIVE = 20
+
+DEFAULT_QUEUE_SIZE = int(os.getenv("SCHEDULER_QUEUE_SIZE", "64"))
+DEFAULT_MAX_WAIT_SECONDS = float(os.getenv("SCHEDULER_MAX_WAIT_SECONDS", "10"))
+# Per-model lanes never compare priorities across models; only this shared lane does.
+# ``0`` disables it.
+GLOBAL_CONCURRENCY = int(os.getenv("SCHEDULER_GLOBAL_CONCURRENCY", "16"))
+
+
+class Overloaded(RuntimeError):
+    """Raised when a model call is shed instead of queued."""
+
+    def __init__(self, message: str, retry_after: float = 1.0) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Classic token bucket: ``rate`` tokens per second, at most ``burst`` stored."""
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    def delay(self) -> float:
+        """Seconds until a token is available (0 when one is available now)."""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        return 0.0 if self._tokens >= 1.0 else (1.0 - self._tokens) / self.rate
+
+    def take(self) -> None:
+        if self.rate > 0:
+            self._refill()
+            self._tokens -= 1.0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class _Lane:
+    """Concurrency slots, rate limit and priority wait queue for one model."""
+
+    def __init__(self, name: str, concurrency: int, rate: float, burst: float, queue_size: int) -> None:
+        self.name = name
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate, burst or concurrency or 1)
+        self.queue_size = queue_size
+        self.active = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._waiters: List[Tuple[int, int, float, "asyncio.Future[None]"]] = []
+        self._sequence = itertools.count()
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+
+    async def acquire(self, priority: int, deadline: float) -> None:
+        if not self._waiters and self._has_slot() and self.bucket.delay() == 0.0:
+            self._admit()
+            return
+        if len(self._waiters) >= self.queue_size:
+            self.rejected += 1
+            raise Overloaded(f"{self.name}: wait queue is full", self._retry_after())
+
+        loop = asyncio.get_running_loop()
+        future: "asyncio.Future[None]" = loop.create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), deadline, future))
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            if not future.done():
+                self._forget(future)
+                self.rejected += 1
+                raise Overloaded(f"{self.name}: timed out waiting for capacity", self._retry_after())
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                self._forget(future)
+            raise
+        future.result()
+
+    def release(self) -> None:
+        self.active -= 1
+        self._dispatch()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "active": self.active,
+            "queued": len(self._waiters),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+    def _forget(self, future: "asyncio.Future[None]") -> None:
+        future.cancel()
+        self._waiters = [waiter for waiter in self._waiters if waiter[3] is not future]
+        heapq.heapify(self._waiters)
+
+    def _has_slot(self) -> bool:
+        return self.concurrency <= 0 or self.active < self.concurrency
+
+    def _admit(self) -> None:
+        self.active += 1
+        self.admitted += 1
+        self.bucket.take()
+
+    def _dispatch(self) -> None:
+        """Hand free slots to the highest-priority waiters; shed those past their deadline."""
+        now = time.monotonic()
+        while self._waiters and self._has_slot():
+            _, _, deadline, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if deadline <= now:
+                heapq.heappop(self._waiters)
+                self.rejected += 1
+                future.set_exception(Overloaded(f"{self.name}: deadline passed in queue", self._retry_after()))
+                continue
+            delay = self.bucket.delay()
+            if delay > 0:
+                if self._wakeup is None:
+                    self._wakeup = asyncio.get_running_loop().call_later(delay, self._on_wakeup)
+                return
+            heapq.heappop(self._waiters)
+            self._admit()
+            future.set_result(None)
+
+    def _on_wakeup(self) -> None:
+        self._wakeup = None
+        self._dispatch()
+
+    def _retry_after(self) -> float:
+        if self.bucket.rate > 0:
+            return max(1.0, len(self._waiters) / self.bucket.rate)
+        return 1.0
+
+
+class Scheduler:
+    """Registry of per-model lanes plus an optional lane shared by all models."""
+
+    def __init__(self, global_concurrency: int = GLOBAL_CONCURRENCY) -> None:
+        self._lanes: Dict[str, _Lane] = {}
+        self._global: Optional[_Lane] = (
+            _Lane("*", global_concurrency, 0.0, 0.0, DEFAULT_QUEUE_SIZE) if global_concurrency > 0 else None
+        )
+
+    def configure(
+        self,
+        model: str,
+        concurrency: int = 0,
+        rate_per_second: float = 0.0,
+        burst: float = 0.0,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+    ) -> None:
+        """Set the limits for ``model``; ``0`` disables the respective limit."""
+        self._lanes[model] = _Lane(model, concurrency, rate_per_second, burst, queue_size)
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        model: str,
+        priority: int = PRIORITY_PLANNER,
+        max_wait: float = DEFAULT_MAX_WAIT_SECONDS,
+    ) -> AsyncIterator[None]:
+        """Hold one admitted call to ``model`` for the duration of the block."""
+        deadline = time.monotonic() + max_wait
+        lanes = [lane for lane in (self._lanes.get(model), self._global) if lane is not None]
+        acquired: List[_Lane] = []
+        try:
+            for lane in lanes:
+                await lane.acquire(priority, deadline)
+                acquired.append(lane)
+        except Overloaded as error:
+            logger.warning("Shedding %s call (priority %d): %s", model, priority, error)
+            for lane in reversed(acquired):
+                lane.release()
+            raise
+        except BaseException:
+            for lane in reversed(acquired):
+                lane.release()
+            raise
+        try:
+            yield
+        finally:
+            for lane in reversed(acquired):
+                lane.release()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        lanes = list(self._lanes.values()) + ([self._global] if self._global else [])
+        return {lane.name: lane.stats() for lane in lanes}
+
+
+scheduler = Scheduler()
+
+
+def _collect_scheduler() -> Iterator[Collected]:
+    stats = scheduler.stats()
+    for field, kind, documentation in (
+        ("active", "gauge", "Model calls currently admitted."),
+        ("queued", "gauge", "Model calls waiting for admission."),
+        ("admitted", "counter", "Model calls admitted."),
+        ("rejected", "counter", "Model calls shed with Overloaded."),
+    ):
+        samples = [({"model": model}, float(values[field])) for model, values in stats.items()]
+        yield f"backend_scheduler_{field}", kind, documentation, samples
+
+
+registry.register_collector(_collect_scheduler)
+
+
+__all__ = [
+    "Overloaded",
+    "PRIORITY_IMAGE_EDIT",
+    "PRIORITY_PLANNER",
+    "PRIORITY_SPECULATIVE",
+    "Scheduler",
+    "TokenBucket",
+    "scheduler",
+]
@@ -1,4 +1,13 @@
-"""Helpers for encrypting and decrypting the backend environment file."""
+"""Helpers for encrypting and decrypting the backend environment file.
+
+Deriving the key (scrypt) takes a noticeable fraction of a second and needs the
+password, so it should happen once per deployment rather than once per worker.
+``python -m backend.serve`` unlocks the file once and starts the workers with
+the decrypted environment inherited. Process managers that spawn workers on
+their own can set ``BACKEND_ENV_KEY_CACHE`` to a path on a tmpfs (e.g.
+``/dev/shm/backend-env.key``): the first process to unlock stores the derived
+key there (mode 0600) and later workers decrypt with it without a password.
+"""
 
 from __future__ import annotations
 
@@ -7,8 +16,10 @@ import base64
 import getpass
 import logging
 import os
+import sys
+import tempfile
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Optional, Tuple
 
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
@@ -20,6 +31,7 @@ _KEY_SIZE = 32
 
 logger = logging.getLogger(__name__)
 _ENV_LOADED = False
+KEY_CACHE_PATH = os.getenv("BACKEND_ENV_KEY_CACHE", "").strip()
 
 
 class EncryptedEnvError(RuntimeError):
@@ -39,15 +51,21 @@ def ensure_encrypted_env(encrypted_filename: str = ".env.enc") -> None:
             "Create it with backend/encrypt_env.py before starting the server."
         )
 
-    password = os.environ.get("BACKEND_ENV_PASSWORD")
-    if not password:
-        password = _prompt_for_password(encrypted_path)
-
-    try:
-        env_text = decrypt_env_file(encrypted_path, password)
-    except Exception as error:
-        print("비밀번호가 잘못되었습니다.")
-        raise Exception("비밀번호가 잘못되었습니다.")
+    raw = encrypted_path.read_text(encoding="utf-8").strip()
+    env_text = _decrypt_with_cached_key(raw)
+    if env_text is None:
+        password = os.environ.get("BACKEND_ENV_PASSWORD")
+        if not password:
+            password = _prompt_for_password(encrypted_path)
+
+        try:
+            salt, _, _ = _split_payload(raw)
+            derived_key = _derive_key(password, salt)
+            env_text = _decrypt_payload(raw, derived_key).decode("utf-8")
+        except Exception as error:
+            print("비밀번호가 잘못되었습니다.")
+            raise Exception("비밀번호가 잘못되었습니다.")
+        _store_cached_key(salt, derived_key)
 
     env_values = parse_env(env_text)
     for key, value in env_values.items():
@@ -82,19 +100,8 @@ def decrypt_env_file(path: Path, password: str) -> str:
 
 def decrypt_env_text(raw_text: str, password: str) -> bytes:
     """Decrypt raw text that was produced by encrypt_env_text."""
-    if not raw_text.startswith(_PREFIX):
-        raise ValueError("Unsupported encrypted env format.")
-    encoded = raw_text[len(_PREFIX) :].strip()
-    payload = base64.urlsafe_b64decode(encoded.encode("ascii"))
-    if len(payload) <= _SALT_SIZE + _NONCE_SIZE:
-        raise ValueError("Encrypted payload too short.")
-
-    salt = payload[:_SALT_SIZE]
-    nonce = payload[_SALT_SIZE : _SALT_SIZE + _NONCE_SIZE]
-    ciphertext = payload[_SALT_SIZE + _NONCE_SIZE :]
-    key = _derive_key(password, salt)
-    cipher = AESGCM(key)
-    return cipher.decrypt(nonce, ciphertext, None)
+    salt, _, _ = _split_payload(raw_text)
+    return _decrypt_payload(raw_text, _derive_key(password, salt))
 
 
 def parse_env(env_text: str) -> Dict[str, str]:
@@ -119,7 +126,71 @@ def parse_env(env_text: str) -> Dict[str, str]:
     return env
 
 
+def _split_payload(raw_text: str) -> Tuple[bytes, bytes, bytes]:
+    """Return ``(salt, nonce, ciphertext)`` from text produced by encrypt_env_text."""
+    if not raw_text.startswith(_PREFIX):
+        raise ValueError("Unsupported encrypted env format.")
+    encoded = raw_text[len(_PREFIX) :].strip()
+    payload = base64.urlsafe_b64decode(encoded.encode("ascii"))
+    if len(payload) <= _SALT_SIZE + _NONCE_SIZE:
+        raise ValueError("Encrypted payload too short.")
+
+    salt = payload[:_SALT_SIZE]
+    nonce = payload[_SALT_SIZE : _SALT_SIZE + _NONCE_SIZE]
+    ciphertext = payload[_SALT_SIZE + _NONCE_SIZE :]
+    return salt, nonce, ciphertext
+
+
+def _decrypt_payload(raw_text: str, key: bytes) -> bytes:
+    _, nonce, ciphertext = _split_payload(raw_text)
+    cipher = AESGCM(key)
+    return cipher.decrypt(nonce, ciphertext, None)
+
+
+def _decrypt_with_cached_key(raw_text: str) -> Optional[str]:
+    """Decrypt with the key left in ``BACKEND_ENV_KEY_CACHE`` by an earlier unlock, if it matches."""
+    if not KEY_CACHE_PATH:
+        return None
+    try:
+        cached_salt, cached_key = Path(KEY_CACHE_PATH).read_text(encoding="ascii").strip().split(":", 1)
+        salt, _, _ = _split_payload(raw_text)
+        if base64.urlsafe_b64decode(cached_salt) != salt:
+            return None
+        return _decrypt_payload(raw_text, base64.urlsafe_b64decode(cached_key)).decode("utf-8")
+    except FileNotFoundError:
+        return None
+    except Exception as error:
+        # A stale or corrupt cache just means deriving the key again.
+        logger.warning("Ignoring env key cache %s: %s", KEY_CACHE_PATH, error)
+        return None
+
+
+def _store_cached_key(salt: bytes, key: bytes) -> None:
+    if not KEY_CACHE_PATH:
+        return
+    path = Path(KEY_CACHE_PATH)
+    tmp_name = None
+    try:
+        # mkstemp creates a fresh, unguessable 0600 file, so nothing planted in a shared
+        # tmpfs directory (a symlink, a loosely permitted file) can receive the key.
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="ascii") as handle:
+            handle.write(f"{base64.urlsafe_b64encode(salt).decode()}:{base64.urlsafe_b64encode(key).decode()}")
+        os.replace(tmp_name, path)
+    except OSError as error:
+        if tmp_name:
+            Path(tmp_name).unlink(missing_ok=True)
+        logger.warning("Could not write env key cache %s: %s", KEY_CACHE_PATH, error)
+
+
 def _prompt_for_password(path: Path) -> str:
+    if not sys.stdin or not sys.stdin.isatty():
+        # A worker spawned by a process manager would otherwise block forever on getpass.
+        raise EncryptedEnvError(
+            f"Cannot prompt for the {path.name} password without a terminal. "
+            "Start the server with `python -m backend.serve`, or set BACKEND_ENV_PASSWORD "
+            "or BACKEND_ENV_KEY_CACHE."
+        )
     try:
         return getpass.getpass(f"Password to decrypt {path.name} (전달받은 비밀번호를 입력하세요): ").strip()
     except (EOFError, KeyboardInterrupt) as error:  # pragma: no cover - interactive only
@@ -0,0 +1,49 @@
+"""Start the API with the encrypted env unlocked once for all workers.
+
+``uvicorn backend.main:app --workers N`` imports the app in every worker, so
+each one prompts for the password and runs the key derivation. This entry point
+unlocks ``.env.enc`` in the supervisor and lets the workers inherit the
+decrypted environment::
+
+    python -m backend.serve --port 8001 --workers 4
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import time
+
+import uvicorn
+
+from .secure_env import ensure_encrypted_env
+
+logger = logging.getLogger(__name__)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the backend with a single env unlock.")
+    parser.add_argument("--host", default="127.0.0.1", help="Bind address (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8001, help="Bind port (default: 8001)")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes (default: 1)")
+    parser.add_argument("--log-level", default="info", help="uvicorn log level (default: info)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    started = time.perf_counter()
+    ensure_encrypted_env()
+    logger.info("Environment unlocked in %.0f ms", (time.perf_counter() - started) * 1000)
+
+    # Workers are spawned with this process's environment, which now carries the
+    # decrypted values and BACKEND_ENV_DECRYPTED=1, so they skip the unlock.
+    uvicorn.run(
+        "backend.main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        log_level=args.log_level,
+    )
+
+
+if __name__ == "__main__":
+    main()
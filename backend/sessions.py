@@ -0,0 +1,114 @@
+"""Server-side conversation sessions with compacted, budgeted history."""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import uuid
+from typing import Dict, Iterable, List, Optional, TypedDict
+
+from .llm_planner import estimate_tokens
+from .shared_state import shared_cache
+
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", str(6 * 3600)))
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "40"))
+SESSION_MAX_TEXT_CHARS = int(os.getenv("SESSION_MAX_TEXT_CHARS", "2000"))
+# Budget for the history that is actually forwarded to the planner prompt.
+HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", "400"))
+# Image references longer than this (i.e. inline data URLs) are replaced by their hash.
+_MAX_INLINE_IMAGE_REF = 512
+
+
+class StoredEntry(TypedDict, total=False):
+    role: str
+    text: str
+    imageRef: str
+
+
+class SessionStore:
+    """Keeps compacted history per session ID so clients only send new turns.
+
+    Histories live in the shared state (``BACKEND_STATE_URL``), so any worker
+    can continue a session. Appends are read-modify-write; concurrent appends
+    to one session from different workers may drop a turn.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = int(os.getenv("SESSION_MAX_SESSIONS", "10000")),
+        ttl_seconds: float = SESSION_TTL_SECONDS,
+        max_entries: int = SESSION_MAX_ENTRIES,
+    ) -> None:
+        self._sessions = shared_cache("sessions", max_sessions, ttl_seconds)
+        self.max_entries = max_entries
+
+    def resolve(self, session_id: Optional[str]) -> str:
+        """Return ``session_id`` if usable, otherwise a freshly generated one."""
+        if session_id and len(session_id) <= 64 and session_id.replace("-", "").isalnum():
+            return session_id
+        return uuid.uuid4().hex
+
+    async def history(self, session_id: str) -> List[StoredEntry]:
+        return list(await self._sessions.get(session_id) or [])
+
+    async def append(self, session_id: str, entries: Iterable[StoredEntry]) -> List[StoredEntry]:
+        history = await self.history(session_id)
+        new_entries = list(entries)
+        if not new_entries:
+            return history
+        history.extend(new_entries)
+        history = history[-self.max_entries :]
+        await self._sessions.set(session_id, history)
+        return history
+
+
+def compact_entry(role: str, text: Optional[str], image_url: Optional[str] = None) -> StoredEntry:
+    """Truncate the text and replace inline image data with a content hash."""
+    entry = StoredEntry(role=role, text=(text or "")[:SESSION_MAX_TEXT_CHARS])
+    image_ref = image_reference(image_url)
+    if image_ref:
+        entry["imageRef"] = image_ref
+    return entry
+
+
+def image_reference(image_url: Optional[str]) -> Optional[str]:
+    if not image_url:
+        return None
+    if len(image_url) <= _MAX_INLINE_IMAGE_REF and not image_url.startswith("data:"):
+        return image_url
+    return "sha256:" + hashlib.sha256(image_url.encode("utf-8")).hexdigest()
+
+
+def history_for_prompt(
+    history: List[StoredEntry],
+    max_tokens: int = HISTORY_MAX_TOKENS,
+) -> List[Dict[str, str]]:
+    """Return the most recent turns (oldest first) that fit in ``max_tokens``."""
+    selected: List[Dict[str, str]] = []
+    used = 0
+    for entry in reversed(history):
+        text = entry.get("text") or ""
+        if entry.get("imageRef"):
+            text = f"{text} [image]".strip()
+        if not text:
+            continue
+        cost = estimate_tokens(text) + 2
+        if used + cost > max_tokens:
+            break
+        selected.append({"role": str(entry.get("role", "user")), "text": text})
+        used += cost
+    selected.reverse()
+    return selected
+
+
+session_store = SessionStore()
+
+
+__all__ = [
+    "SessionStore",
+    "StoredEntry",
+    "compact_entry",
+    "history_for_prompt",
+    "image_reference",
+    "session_store",
+]
@@ -0,0 +1,374 @@
+"""Cache and session state that can be shared between workers and nodes.
+
+The backend is chosen with ``BACKEND_STATE_URL``:
+
+``memory://`` (default)
+    Per-process :class:`~backend.cache.TTLCache` instances, as before. Each
+    ``uvicorn`` worker has its own copy.
+``sqlite:///path/to/state.db``
+    One SQLite file (WAL mode) shared by all workers on a node. Put it on a
+    tmpfs such as ``/dev/shm`` to keep it in memory.
+``redis://host:port/db``
+    Any server speaking the Redis protocol, shared across nodes. Only ``GET``
+    and ``SET ... PX`` are used (plus ``AUTH``/``SELECT`` when the URL asks for
+    them), so ``bench/redis_stand_in.py`` can stand in for Redis locally.
+
+Values must be JSON-serializable; the in-process backend stores them as-is.
+Shared backends are caches: when the store is unreachable, reads miss and
+writes are dropped (and counted in ``backend_fallbacks``) instead of failing
+the request.
+"""
+
+from __future__ import annotations
+
+import abc
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+from .cache import DEFAULT_CACHE_DIR, TTLCache
+from .metrics import FALLBACKS
+
+logger = logging.getLogger(__name__)
+
+STATE_URL = os.getenv("BACKEND_STATE_URL", "memory://").strip() or "memory://"
+REDIS_POOL_SIZE = int(os.getenv("BACKEND_STATE_REDIS_POOL_SIZE", "8"))
+REDIS_TIMEOUT_SECONDS = float(os.getenv("BACKEND_STATE_TIMEOUT_SECONDS", "0.5"))
+# SQLite: expired rows and overflow beyond max_entries are purged every this many writes.
+_SQLITE_PURGE_EVERY = 256
+
+
+class StateBackend(abc.ABC):
+    """Key/value store with per-entry expiry, addressed by ``(namespace, key)``."""
+
+    #: True when values are kept as Python objects instead of being serialized.
+    in_process = False
+
+    @abc.abstractmethod
+    async def get(self, namespace: str, key: str) -> Optional[Any]:
+        """Return the stored value, or ``None`` when it is missing or expired."""
+
+    @abc.abstractmethod
+    async def set(self, namespace: str, key: str, value: Any, ttl_seconds: float) -> None:
+        """Store ``value`` for ``ttl_seconds``."""
+
+    def configure(self, namespace: str, max_entries: int, ttl_seconds: float) -> None:
+        """Called once per namespace before use."""
+
+    def entries(self, namespace: str) -> Optional[int]:
+        return None
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryBackend(StateBackend):
+    in_process = True
+
+    def __init__(self) -> None:
+        self._caches: Dict[str, "TTLCache[str, Any]"] = {}
+
+    def configure(self, namespace: str, max_entries: int, ttl_seconds: float) -> None:
+        self._caches[namespace] = TTLCache(max_entries, ttl_seconds)
+
+    async def get(self, namespace: str, key: str) -> Optional[Any]:
+        return self._caches[namespace].get(key)
+
+    async def set(self, namespace: str, key: str, value: Any, ttl_seconds: float) -> None:
+        self._caches[namespace].set(key, value)
+
+    def entries(self, namespace: str) -> Optional[int]:
+        return len(self._caches[namespace])
+
+
+class SQLiteBackend(StateBackend):
+    """Single-node store: one WAL-mode SQLite file opened by every worker."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: List[sqlite3.Connection] = []
+        self._max_entries: Dict[str, int] = {}
+        self._writes = 0
+        connection = self._connection()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            " namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, expires_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS state_expiry ON state (namespace, expires_at)")
+
+    def configure(self, namespace: str, max_entries: int, ttl_seconds: float) -> None:
+        self._max_entries[namespace] = max_entries
+
+    async def get(self, namespace: str, key: str) -> Optional[Any]:
+        return await asyncio.to_thread(self._get, namespace, key)
+
+    async def set(self, namespace: str, key: str, value: Any, ttl_seconds: float) -> None:
+        await asyncio.to_thread(self._set, namespace, key, value, ttl_seconds)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=1.0, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # WAL + NORMAL: commits do not fsync; a crash loses at most recent cache writes.
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def _get(self, namespace: str, key: str) -> Optional[bytes]:
+        row = self._connection().execute(
+            "SELECT value FROM state WHERE namespace = ? AND key = ? AND expires_at > ?",
+            (namespace, key, time.time()),
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set(self, namespace: str, key: str, value: bytes, ttl_seconds: float) -> None:
+        connection = self._connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO state (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, value, time.time() + ttl_seconds),
+        )
+        # Writes run in worker threads; count them under the lock.
+        with self._lock:
+            self._writes += 1
+            purge = self._writes % _SQLITE_PURGE_EVERY == 0
+        if purge:
+            self._purge(connection, namespace)
+
+    def _purge(self, connection: sqlite3.Connection, namespace: str) -> None:
+        connection.execute("DELETE FROM state WHERE namespace = ? AND expires_at <= ?", (namespace, time.time()))
+        max_entries = self._max_entries.get(namespace, 0)
+        if max_entries > 0:
+            # Entries expiring soonest were written longest ago (one TTL per namespace).
+            connection.execute(
+                "DELETE FROM state WHERE namespace = ? AND key IN ("
+                " SELECT key FROM state WHERE namespace = ? ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                (namespace, namespace, max_entries),
+            )
+
+    async def close(self) -> None:
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+        self._local = threading.local()
+
+
+class RedisError(RuntimeError):
+    """Error reply from the server or a malformed response."""
+
+
+class _RedisConnection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+
+    async def call(self, *args: object) -> Any:
+        self.writer.write(_encode_command(args))
+        await self.writer.drain()
+        return await self._read_reply()
+
+    async def _read_reply(self) -> Any:
+        line = await self.reader.readuntil(b"\r\n")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise RedisError(payload.decode(errors="replace"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = await self.reader.readexactly(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            count = int(payload)
+            return None if count < 0 else [await self._read_reply() for _ in range(count)]
+        raise RedisError(f"Unexpected reply type {kind!r}")
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class RedisBackend(StateBackend):
+    """Minimal asyncio client for the Redis protocol with a small connection pool."""
+
+    def __init__(self, host: str, port: int, db: int = 0, password: Optional[str] = None, prefix: str = "backend:") -> None:
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.prefix = prefix
+        self._idle: List[_RedisConnection] = []
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def get(self, namespace: str, key: str) -> Optional[Any]:
+        return await self._call("GET", self._key(namespace, key))
+
+    async def set(self, namespace: str, key: str, value: Any, ttl_seconds: float) -> None:
+        await self._call("SET", self._key(namespace, key), value, "PX", max(1, int(ttl_seconds * 1000)))
+
+    def _key(self, namespace: str, key: str) -> str:
+        return f"{self.prefix}{namespace}:{key}"
+
+    async def _call(self, *args: object) -> Any:
+        self._bind_loop()
+        assert self._slots is not None
+        async with self._slots:
+            connection = self._idle.pop() if self._idle else await self._connect()
+            try:
+                reply = await asyncio.wait_for(connection.call(*args), REDIS_TIMEOUT_SECONDS)
+            except BaseException:
+                # The connection may hold a half-read reply; never reuse it.
+                connection.close()
+                raise
+            self._idle.append(connection)
+            return reply
+
+    async def _connect(self) -> _RedisConnection:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), REDIS_TIMEOUT_SECONDS
+        )
+        connection = _RedisConnection(reader, writer)
+        try:
+            if self.password:
+                await asyncio.wait_for(connection.call("AUTH", self.password), REDIS_TIMEOUT_SECONDS)
+            if self.db:
+                await asyncio.wait_for(connection.call("SELECT", self.db), REDIS_TIMEOUT_SECONDS)
+        except BaseException:
+            connection.close()
+            raise
+        return connection
+
+    def _bind_loop(self) -> None:
+        # Connections belong to the event loop that opened them.
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            for connection in self._idle:
+                connection.close()
+            self._idle = []
+            self._slots = asyncio.Semaphore(REDIS_POOL_SIZE)
+            self._loop = loop
+
+    async def close(self) -> None:
+        for connection in self._idle:
+            connection.close()
+        self._idle = []
+
+
+class SharedCache:
+    """One namespace of the shared state, with hit/miss accounting."""
+
+    def __init__(self, backend: StateBackend, namespace: str, max_entries: int, ttl_seconds: float) -> None:
+        self.backend = backend
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        backend.configure(namespace, max_entries, ttl_seconds)
+
+    async def get(self, key: str) -> Optional[Any]:
+        try:
+            value = await self.backend.get(self.namespace, key)
+        except Exception as error:
+            self._degraded("get", error)
+            value = None
+        if value is not None and not self.backend.in_process:
+            try:
+                value = json.loads(value)
+            except ValueError as error:
+                # A truncated or foreign value is a miss; the next set overwrites it.
+                self._degraded("decode", error)
+                value = None
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    async def set(self, key: str, value: Any) -> None:
+        if not self.backend.in_process:
+            value = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        try:
+            await self.backend.set(self.namespace, key, value, self.ttl_seconds)
+        except Exception as error:
+            self._degraded("set", error)
+
+    def stats(self) -> Dict[str, int]:
+        stats = {"hits": self.hits, "misses": self.misses}
+        if self.backend.in_process:
+            stats["entries"] = self.backend.entries(self.namespace) or 0
+        return stats
+
+    def _degraded(self, operation: str, error: Exception) -> None:
+        FALLBACKS.inc(component="shared_state", reason=type(error).__name__)
+        logger.warning("Shared state %s %s failed: %s", operation, self.namespace, error)
+
+
+def open_backend(url: str) -> StateBackend:
+    """Create the backend described by ``url`` (see module docstring)."""
+    parsed = urlparse(url)
+    if parsed.scheme == "memory":
+        return MemoryBackend()
+    if parsed.scheme == "sqlite":
+        path = unquote(parsed.path) or str(DEFAULT_CACHE_DIR / "state.sqlite3")
+        return SQLiteBackend(Path(path))
+    if parsed.scheme == "redis":
+        db = parsed.path.strip("/")
+        return RedisBackend(
+            parsed.hostname or "127.0.0.1",
+            parsed.port or 6379,
+            int(db) if db else 0,
+            unquote(parsed.password) if parsed.password else None,
+        )
+    raise ValueError(f"Unsupported BACKEND_STATE_URL scheme: {url!r}")
+
+
+shared_state = open_backend(STATE_URL)
+
+
+def shared_cache(namespace: str, max_entries: int, ttl_seconds: float) -> SharedCache:
+    """Return a cache for ``namespace`` in the configured shared-state backend."""
+    return SharedCache(shared_state, namespace, max_entries, ttl_seconds)
+
+
+async def close_shared_state() -> None:
+    await shared_state.close()
+
+
+def _encode_command(args: Tuple[object, ...]) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+        parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(parts)
+
+
+__all__ = [
+    "MemoryBackend",
+    "RedisBackend",
+    "RedisError",
+    "SQLiteBackend",
+    "SharedCache",
+    "StateBackend",
+    "close_shared_state",
+    "open_backend",
+    "shared_cache",
+    "shared_state",
+]
@@ -0,0 +1,59 @@
+"""Coalesce identical concurrent calls into a single in-flight computation."""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Awaitable, Callable, Dict, Generic, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class _Flight(Generic[T]):
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Task[T]") -> None:
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight(Generic[T]):
+    """Run ``factory`` once per key while it is in flight; later callers share the result.
+
+    The computation runs as its own task, so a caller that goes away (e.g. a
+    cancelled streaming request) does not abort it for the others. It is only
+    cancelled once every caller waiting on it has been cancelled.
+    """
+
+    def __init__(self) -> None:
+        self._flights: Dict[str, _Flight[T]] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """Return ``(result, shared)``; ``shared`` is True when another caller ran ``factory``."""
+        self.calls += 1
+        flight = self._flights.get(key)
+        shared = flight is not None
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(factory()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _task, key=key, flight=flight: self._forget(key, flight))
+        else:
+            self.coalesced += 1
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task), shared
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+
+    def stats(self) -> Dict[str, int]:
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._flights)}
+
+    def _forget(self, key: str, flight: _Flight[T]) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+
+__all__ = ["SingleFlight"]
@@ -0,0 +1,208 @@
+"""On-disk cache of normalized product thumbnails for image-edit prompts.
+
+``python -m backend.thumbnails`` fetches every catalog image once, crops it to
+a centred square, resizes it to ``PRODUCT_THUMBNAIL_SIZE`` pixels and stores it
+as a JPEG named after the hash of its source URL. Prompts then embed the local
+thumbnail as a data URL, so the edit model never has to reach the product CDN
+and identical product selections always produce byte-identical prompts.
+Products without a cached thumbnail fall back to the CDN preview URL.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import logging
+import os
+import tempfile
+import time
+from io import BytesIO
+from pathlib import Path
+from typing import Iterable, Optional, Sequence
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - dependency might be missing locally
+    Image = None
+
+from .cache import DEFAULT_CACHE_DIR, TTLCache, hash_key
+from .catalog import get_catalog
+from .products_db import Product
+from .remote_fetch import fetcher
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_DIR = Path(os.getenv("PRODUCT_THUMBNAIL_DIR") or DEFAULT_CACHE_DIR / "thumbnails")
+THUMBNAIL_SIZE = int(os.getenv("PRODUCT_THUMBNAIL_SIZE", "200"))
+THUMBNAIL_QUALITY = 85
+# Products without a thumbnail are not looked up on disk again for this long.
+MISSING_TTL_SECONDS = float(os.getenv("PRODUCT_THUMBNAIL_MISSING_TTL_SECONDS", "300"))
+# CDN resize parameters understood by ohousecdn (w/h in pixels, c=c centre crop).
+_CDN_RESIZE_PARAMS = ("w", "h", "c")
+
+
+def preview_url(image_url: Optional[str], size: int = THUMBNAIL_SIZE) -> Optional[str]:
+    """Return ``image_url`` with its CDN resize parameters set to a ``size`` square crop.
+
+    Existing ``w``/``h``/``c`` parameters are replaced rather than appended, so
+    URLs that already carry ``?w=1280&h=1280&c=c`` stay valid.
+    """
+    if not image_url:
+        return None
+    parts = urlsplit(image_url)
+    query = [
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key not in _CDN_RESIZE_PARAMS
+    ]
+    query.extend((("w", str(size)), ("h", str(size)), ("c", "c")))
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def make_thumbnail(image_bytes: bytes, size: int = THUMBNAIL_SIZE) -> bytes:
+    """Orient, centre-crop and resize an image into a ``size`` x ``size`` JPEG."""
+    with Image.open(BytesIO(image_bytes)) as img:
+        if img.format == "JPEG":
+            img.draft("RGB", (size, size))
+        image = ImageOps.exif_transpose(img)
+        if image.mode in ("RGBA", "LA", "P"):
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            rgba = image.convert("RGBA")
+            background.paste(rgba, mask=rgba.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+        image = ImageOps.fit(image, (size, size), Image.LANCZOS)
+        buffer = BytesIO()
+        image.save(buffer, format="JPEG", quality=THUMBNAIL_QUALITY)
+        return buffer.getvalue()
+
+
+class ThumbnailStore:
+    """Thumbnails on disk keyed by source URL, with their data URLs memoized in memory.
+
+    Misses are memoized too, for ``MISSING_TTL_SECONDS``, so products without a
+    thumbnail cost one disk lookup per interval rather than one per prompt.
+    """
+
+    def __init__(self, directory: Path = THUMBNAIL_DIR, size: int = THUMBNAIL_SIZE) -> None:
+        self.directory = Path(directory)
+        self.size = size
+        self._data_urls: "TTLCache[str, str]" = TTLCache(max_entries=4096, ttl_seconds=24 * 3600)
+        self._missing: "TTLCache[str, bool]" = TTLCache(max_entries=4096, ttl_seconds=MISSING_TTL_SECONDS)
+
+    def path_for(self, image_url: str) -> Path:
+        # The CDN query only selects a rendition; the thumbnail depends on the base URL.
+        parts = urlsplit(image_url)
+        source = urlunsplit(parts._replace(query="", fragment=""))
+        return self.directory / f"{hash_key(source, self.size)}.jpg"
+
+    def data_url(self, image_url: Optional[str]) -> Optional[str]:
+        """Return the cached thumbnail as a data URL, or ``None`` if it was never fetched.
+
+        A first lookup reads the disk; call it off the event loop.
+        """
+        if not image_url:
+            return None
+        cached = self._data_urls.get(image_url)
+        if cached:
+            return cached
+        if self._missing.get(image_url):
+            return None
+        try:
+            data = self.path_for(image_url).read_bytes()
+        except OSError:
+            self._missing.set(image_url, True)
+            return None
+        encoded = f"data:image/jpeg;base64,{base64.b64encode(data).decode('ascii')}"
+        self._data_urls.set(image_url, encoded)
+        return encoded
+
+    def store(self, image_url: str, thumbnail: bytes) -> None:
+        path = self.path_for(image_url)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as handle:
+                handle.write(thumbnail)
+            os.replace(tmp_name, path)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+        self._missing.set(image_url, False)
+
+    async def prefetch(
+        self,
+        image_urls: Iterable[str],
+        concurrency: int = 8,
+        force: bool = False,
+    ) -> int:
+        """Fetch and store thumbnails for ``image_urls``; return how many were written."""
+        semaphore = asyncio.Semaphore(concurrency)
+        pending = sorted({url for url in image_urls if url and (force or not self.path_for(url).exists())})
+
+        async def fetch_one(image_url: str) -> bool:
+            async with semaphore:
+                try:
+                    # Ask the CDN for a modest rendition rather than the original upload.
+                    image_bytes, _ = await fetcher.fetch(preview_url(image_url, self.size * 2))
+                    thumbnail = await asyncio.to_thread(make_thumbnail, image_bytes, self.size)
+                    await asyncio.to_thread(self.store, image_url, thumbnail)
+                except Exception as error:
+                    logger.warning("Skipping thumbnail for %s: %s", image_url, error)
+                    return False
+                return True
+
+        results = await asyncio.gather(*(fetch_one(url) for url in pending))
+        return sum(results)
+
+
+thumbnail_store = ThumbnailStore()
+
+
+def product_preview(product: Product) -> Optional[str]:
+    """Image reference for ``product`` in edit prompts: local thumbnail first, CDN otherwise."""
+    image_url = str(product.get("img") or "")
+    return thumbnail_store.data_url(image_url) or preview_url(image_url)
+
+
+async def _prefetch_catalog(products: Sequence[Product], concurrency: int, force: bool) -> int:
+    try:
+        return await thumbnail_store.prefetch(
+            (str(product.get("img") or "") for product in products), concurrency, force
+        )
+    finally:
+        await fetcher.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Pre-fetch and resize catalog product thumbnails.")
+    parser.add_argument("-j", "--concurrency", type=int, default=8, help="Parallel downloads (default: 8)")
+    parser.add_argument("--force", action="store_true", help="Re-fetch thumbnails that already exist")
+    args = parser.parse_args()
+    if not Image:
+        raise SystemExit("Pillow is required to build thumbnails.")
+
+    logging.basicConfig(level=logging.INFO)
+    products = get_catalog().products
+    started = time.perf_counter()
+    written = asyncio.run(_prefetch_catalog(products, args.concurrency, args.force))
+    print(
+        f"Wrote {written} thumbnails for {len(products)} products "
+        f"in {time.perf_counter() - started:.1f}s -> {thumbnail_store.directory}"
+    )
+
+
+__all__ = [
+    "ThumbnailStore",
+    "make_thumbnail",
+    "preview_url",
+    "product_preview",
+    "thumbnail_store",
+]
+
+
+if __name__ == "__main__":
+    main()
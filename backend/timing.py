@@ -0,0 +1,50 @@
+"""Lightweight per-stage timing for the chat pipeline."""
+
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Dict, Iterator, TypeVar
+
+T = TypeVar("T")
+
+
+class StageTimer:
+    """Collect wall-clock durations (in milliseconds) for named pipeline stages."""
+
+    def __init__(self) -> None:
+        self._started = time.perf_counter()
+        self.durations: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - start) * 1000.0)
+
+    async def track(self, name: str, awaitable: Awaitable[T]) -> T:
+        """Await ``awaitable`` and record how long it took, even when run as a task."""
+        with self.stage(name):
+            return await awaitable
+
+    def record(self, name: str, duration_ms: float) -> None:
+        self.durations[name] = self.durations.get(name, 0.0) + duration_ms
+
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self._started) * 1000.0
+
+    def server_timing_header(self) -> str:
+        """Render durations in the ``Server-Timing`` header format."""
+        parts = [f"{name};dur={duration:.1f}" for name, duration in self.durations.items()]
+        parts.append(f"total;dur={self.total_ms():.1f}")
+        return ", ".join(parts)
+
+    def summary(self) -> Dict[str, float]:
+        summary = {name: round(duration, 1) for name, duration in self.durations.items()}
+        summary["total"] = round(self.total_ms(), 1)
+        return summary
+
+
+__all__ = ["StageTimer"]
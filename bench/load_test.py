@@ -0,0 +1,269 @@
+"""Closed-loop load generator for ``/chat`` and ``/chat/stream``.
+
+Drives a running backend with a mix of text-only, photo and long-history
+requests, then reports throughput, latency percentiles per request kind and the
+resident memory of every worker seen on ``/metrics``. Point the backend at
+``bench/mock_model_server.py`` to benchmark without network access::
+
+    python bench/load_test.py --url http://127.0.0.1:8000 --requests 200 --concurrency 16
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import io
+import json
+import random
+import re
+import statistics
+import time
+import uuid
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from PIL import Image
+
+MESSAGES = (
+    "거실을 모던한 분위기로 바꿔줘",
+    "침실에 따뜻한 원목 가구를 추천해줘",
+    "미니멀한 스타일로 책상이랑 의자 골라줘",
+    "북유럽 느낌 소파 보여줘",
+    "10만원 이하로 조명 추천해줘",
+    "아이 방에 어울리는 수납장 있을까?",
+    "고급스러운 다이닝 테이블 찾고 있어",
+    "원룸에 놓을 작은 소파 추천해줘",
+)
+FOLLOW_UPS = (
+    "조금 더 밝은 색으로 보여줘",
+    "가격대를 낮춰줘",
+    "다른 스타일도 보고 싶어",
+    "러그도 같이 추천해줘",
+)
+_RESIDENT = re.compile(r'^backend_process_resident_memory_bytes\{pid="(\d+)"\} (\S+)$', re.M)
+_PEAK = re.compile(r'^backend_process_peak_memory_bytes\{pid="(\d+)"\} (\S+)$', re.M)
+
+
+def make_photo(seed: int, size: Tuple[int, int] = (1600, 1200)) -> bytes:
+    """A noisy gradient JPEG roughly the size of a phone photo after compression."""
+    rng = random.Random(seed)
+    base = Image.linear_gradient("L").resize(size).convert("RGB")
+    noise = Image.effect_noise(size, 40).convert("RGB")
+    tint = Image.new("RGB", size, tuple(rng.randrange(256) for _ in range(3)))
+    photo = Image.blend(Image.blend(base, noise, 0.35), tint, 0.3)
+    buffer = io.BytesIO()
+    photo.save(buffer, format="JPEG", quality=88)
+    return buffer.getvalue()
+
+
+class LoadTest:
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.mix = _parse_mix(args.mix)
+        self.rng = random.Random(args.seed)
+        self.image_ids: List[str] = []
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.first_bytes: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Counter = Counter()
+        self.resident: Dict[str, float] = {}
+        self.peak: Dict[str, float] = {}
+
+    async def run(self) -> Dict[str, Any]:
+        timeout = httpx.Timeout(self.args.timeout, connect=10.0)
+        limits = httpx.Limits(max_connections=self.args.concurrency + 2)
+        async with httpx.AsyncClient(base_url=self.args.url, timeout=timeout, limits=limits) as client:
+            if self.mix.get("image"):
+                await self._upload_photos(client)
+            queue: "asyncio.Queue[str]" = asyncio.Queue()
+            kinds = list(self.mix)
+            weights = [self.mix[kind] for kind in kinds]
+            for _ in range(self.args.requests):
+                queue.put_nowait(self.rng.choices(kinds, weights)[0])
+
+            stop = asyncio.Event()
+            scraper = asyncio.create_task(self._scrape_memory(client, stop))
+            started = time.perf_counter()
+            await asyncio.gather(*(self._worker(client, queue) for _ in range(self.args.concurrency)))
+            elapsed = time.perf_counter() - started
+            stop.set()
+            await scraper
+        return self._report(elapsed)
+
+    async def _upload_photos(self, client: httpx.AsyncClient) -> None:
+        for seed in range(self.args.photos):
+            response = await client.post(
+                "/images", content=make_photo(seed), headers={"Content-Type": "image/jpeg"}
+            )
+            response.raise_for_status()
+            self.image_ids.append(response.json()["imageId"])
+
+    async def _worker(self, client: httpx.AsyncClient, queue: "asyncio.Queue[str]") -> None:
+        while True:
+            try:
+                kind = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            payload = self._payload(kind)
+            started = time.perf_counter()
+            try:
+                if self.args.stream:
+                    status, first_byte = await self._stream(client, payload, started)
+                    if first_byte is not None:
+                        self.first_bytes[kind].append(first_byte)
+                else:
+                    response = await client.post("/chat", json=payload)
+                    status = str(response.status_code)
+            except httpx.HTTPError as error:
+                status = type(error).__name__
+            elapsed = time.perf_counter() - started
+            self.statuses[status] += 1
+            if status == "200":
+                self.latencies[kind].append(elapsed)
+
+    async def _stream(
+        self, client: httpx.AsyncClient, payload: Dict[str, Any], started: float
+    ) -> Tuple[str, Optional[float]]:
+        first_byte: Optional[float] = None
+        status = "incomplete"
+        async with client.stream("POST", "/chat/stream", json=payload) as response:
+            if response.status_code != 200:
+                return str(response.status_code), None
+            event = ""
+            async for line in response.aiter_lines():
+                if line.startswith("event: "):
+                    event = line[len("event: ") :]
+                    if first_byte is None and event in ("delta", "message"):
+                        first_byte = time.perf_counter() - started
+                elif line.startswith("data: ") and event == "error":
+                    status = str(json.loads(line[len("data: ") :]).get("status", "error"))
+                elif line.startswith("data: ") and event == "done":
+                    status = "200"
+        return status, first_byte
+
+    def _payload(self, kind: str) -> Dict[str, Any]:
+        payload: Dict[str, Any] = {"message": self.rng.choice(MESSAGES)}
+        if kind == "image" and self.image_ids:
+            payload["imageId"] = self.rng.choice(self.image_ids)
+        elif kind == "history":
+            history = []
+            for turn in range(self.args.history_turns):
+                history.append({"role": "user", "text": self.rng.choice(MESSAGES + FOLLOW_UPS)})
+                history.append({"role": "assistant", "text": f"추천 결과 {turn + 1}번입니다. " * 8})
+            payload["history"] = history
+            payload["message"] = self.rng.choice(FOLLOW_UPS)
+        if self.rng.random() < self.args.unique_fraction:
+            # Defeat the planner/image caches and request coalescing for this request.
+            payload["message"] = f"{payload['message']} #{uuid.uuid4().hex[:8]}"
+        return payload
+
+    async def _scrape_memory(self, client: httpx.AsyncClient, stop: asyncio.Event) -> None:
+        # With several workers each scrape lands on one of them; keep the latest value per PID.
+        while True:
+            try:
+                response = await client.get("/metrics")
+                for pid, value in _RESIDENT.findall(response.text):
+                    self.resident[pid] = float(value)
+                for pid, value in _PEAK.findall(response.text):
+                    self.peak[pid] = max(self.peak.get(pid, 0.0), float(value))
+            except httpx.HTTPError:
+                pass
+            try:
+                await asyncio.wait_for(stop.wait(), self.args.scrape_interval)
+                return
+            except asyncio.TimeoutError:
+                continue
+
+    def _report(self, elapsed: float) -> Dict[str, Any]:
+        completed = sum(self.statuses.values())
+        succeeded = sum(len(values) for values in self.latencies.values())
+        kinds: Dict[str, Dict[str, float]] = {}
+        all_latencies = [value for values in self.latencies.values() for value in values]
+        for kind, values in sorted(self.latencies.items()) + [("all", all_latencies)]:
+            if not values:
+                continue
+            kinds[kind] = {"count": len(values), **_percentiles(values)}
+            if kind in self.first_bytes and self.first_bytes[kind]:
+                kinds[kind]["ttfb_p50_ms"] = _percentiles(self.first_bytes[kind])["p50_ms"]
+        return {
+            "endpoint": "/chat/stream" if self.args.stream else "/chat",
+            "requests": completed,
+            "succeeded": succeeded,
+            "elapsed_s": round(elapsed, 3),
+            "throughput_rps": round(completed / elapsed, 2) if elapsed else 0.0,
+            "statuses": dict(self.statuses),
+            "latency": kinds,
+            "memory_mb": {
+                pid: {
+                    "resident": round(self.resident[pid] / 2**20, 1),
+                    "peak": round(self.peak.get(pid, 0.0) / 2**20, 1),
+                }
+                for pid in sorted(self.resident)
+            },
+        }
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    ordered = sorted(values)
+    result = {"mean_ms": round(statistics.fmean(ordered) * 1000, 1)}
+    for percentile in (50, 95, 99):
+        index = min(len(ordered) - 1, max(0, round(percentile / 100 * len(ordered)) - 1))
+        result[f"p{percentile}_ms"] = round(ordered[index] * 1000, 1)
+    return result
+
+
+def _parse_mix(text: str) -> Dict[str, float]:
+    mix: Dict[str, float] = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in ("text", "image", "history"):
+            raise SystemExit(f"Unknown request kind in --mix: {kind!r}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def _print_report(report: Dict[str, Any]) -> None:
+    print(
+        f"{report['endpoint']}: {report['requests']} requests in {report['elapsed_s']}s "
+        f"({report['throughput_rps']} req/s), statuses {report['statuses']}"
+    )
+    print(f"{'kind':<10}{'count':>7}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'ttfb p50':>10}")
+    for kind, values in report["latency"].items():
+        ttfb = values.get("ttfb_p50_ms")
+        print(
+            f"{kind:<10}{values['count']:>7}{values['mean_ms']:>10}{values['p50_ms']:>10}"
+            f"{values['p95_ms']:>10}{values['p99_ms']:>10}{ttfb if ttfb is not None else '-':>10}"
+        )
+    for pid, memory in report["memory_mb"].items():
+        print(f"worker {pid}: resident {memory['resident']} MiB, peak {memory['peak']} MiB")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="Backend base URL")
+    parser.add_argument("--requests", type=int, default=200, help="Total requests to send (default: 200)")
+    parser.add_argument("--concurrency", type=int, default=16, help="Requests in flight (default: 16)")
+    parser.add_argument("--mix", default="text=5,image=3,history=2", help="Weighted request kinds")
+    parser.add_argument("--stream", action="store_true", help="Use /chat/stream and report time to first text")
+    parser.add_argument(
+        "--unique-fraction", type=float, default=0.5,
+        help="Fraction of requests made unique to bypass caches (default: 0.5)",
+    )
+    parser.add_argument("--photos", type=int, default=4, help="Distinct room photos to upload (default: 4)")
+    parser.add_argument("--history-turns", type=int, default=12, help="Turns in long-history requests")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds")
+    parser.add_argument("--scrape-interval", type=float, default=1.0, help="Seconds between /metrics scrapes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(LoadTest(args).run())
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        _print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""Local stand-in for the OpenAI / OpenRouter chat-completions API.
+
+Serves ``POST /v1/chat/completions`` the way the backend uses it:
+
+* planner calls (plain or ``stream=True``) get a JSON plan that picks the first
+  candidate IDs found in the prompt: bare JSON when the request carries a
+  ``response_format``, otherwise wrapped in a Markdown code fence the way
+  free-form replies often are;
+* image-edit calls (``modalities`` containing ``"image"``) get a message whose
+  ``images`` list holds a data URL of ``--image-bytes`` bytes.
+
+Latency, payload size and failure rates are configurable so the backend can be
+benchmarked without network access or API costs. ``--invalid-rate`` makes
+planner replies select no products, optionally only for ``--invalid-model``, to
+exercise the fast-tier escalation::
+
+    python bench/mock_model_server.py --port 9100 --latency-ms 800 --image-latency-ms 4000
+    python bench/mock_model_server.py --invalid-rate 0.3 --invalid-model gpt-5-mini
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import re
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, List
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+_CANDIDATE_ID = re.compile(r'"id"\s*:\s*"([^"]+)"')
+_STREAM_CHUNKS = 20
+
+
+class MockSettings:
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.latency = args.latency_ms / 1000.0
+        self.image_latency = args.image_latency_ms / 1000.0
+        self.jitter = args.jitter
+        self.failure_rate = args.failure_rate
+        self.throttle_rate = args.throttle_rate
+        self.picks = args.picks
+        self.invalid_rate = args.invalid_rate
+        self.invalid_model = args.invalid_model
+        # Random bytes behind a JPEG header: enough for the backend's magic-byte
+        # sniffing, and incompressible like a real photo.
+        payload = b"\xff\xd8\xff\xe0" + os.urandom(max(0, args.image_bytes - 6)) + b"\xff\xd9"
+        self.image_data_url = "data:image/jpeg;base64," + base64.b64encode(payload).decode("ascii")
+
+
+def create_app(settings: MockSettings) -> FastAPI:
+    app = FastAPI(title="Mock chat-completions server")
+    stats: Dict[str, Any] = {"requests": 0, "failures": 0, "throttled": 0, "invalid": 0, "models": {}}
+
+    @app.get("/stats")
+    async def get_stats() -> Dict[str, Any]:
+        return stats
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        is_image = "image" in (body.get("modalities") or [])
+        latency = _jittered(settings.image_latency if is_image else settings.latency, settings.jitter)
+
+        draw = random.random()
+        if draw < settings.throttle_rate:
+            stats["throttled"] += 1
+            await asyncio.sleep(min(latency, 0.05))
+            return JSONResponse(
+                {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                status_code=429,
+                headers={"retry-after": "1"},
+            )
+        if draw < settings.throttle_rate + settings.failure_rate:
+            stats["failures"] += 1
+            await asyncio.sleep(latency)
+            return JSONResponse({"error": {"message": "Mock failure", "type": "server_error"}}, status_code=500)
+
+        model = body.get("model", "mock")
+        stats["models"][model] = stats["models"].get(model, 0) + 1
+        if is_image:
+            await asyncio.sleep(latency)
+            message = {
+                "role": "assistant",
+                "content": "Here is the edited room.",
+                "images": [{"type": "image_url", "image_url": {"url": settings.image_data_url}}],
+            }
+            return _completion(model, message, body)
+
+        invalid = settings.invalid_model in ("", model) and random.random() < settings.invalid_rate
+        if invalid:
+            stats["invalid"] += 1
+        content = _plan_content(
+            body.get("messages") or [],
+            0 if invalid else settings.picks,
+            structured=bool(body.get("response_format")),
+        )
+        if body.get("stream"):
+            include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+            return StreamingResponse(
+                _stream(model, content, latency, include_usage, body),
+                media_type="text/event-stream",
+            )
+        await asyncio.sleep(latency)
+        return _completion(model, {"role": "assistant", "content": content}, body)
+
+    return app
+
+
+def _plan_content(messages: List[Dict[str, Any]], picks: int, structured: bool) -> str:
+    prompt = "\n".join(str(message.get("content", "")) for message in messages)
+    ids = list(dict.fromkeys(_CANDIDATE_ID.findall(prompt)))[:picks]
+    content = json.dumps(
+        {
+            "assistant_message": "테스트용 응답입니다. 요청하신 분위기에 맞춰 제품을 골라봤어요.",
+            "selected_products": ids,
+        },
+        ensure_ascii=False,
+    )
+    return content if structured else f"```json\n{content}\n```"
+
+
+def _completion(model: str, message: Dict[str, Any], body: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+        "usage": _usage(body, str(message.get("content") or "")),
+    }
+
+
+async def _stream(
+    model: str,
+    content: str,
+    latency: float,
+    include_usage: bool,
+    body: Dict[str, Any],
+) -> AsyncIterator[str]:
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+    # Spend a third of the latency before the first token, the rest spread over the chunks.
+    await asyncio.sleep(latency / 3)
+    size = max(1, len(content) // _STREAM_CHUNKS + 1)
+    pieces = [content[start : start + size] for start in range(0, len(content), size)]
+    for index, piece in enumerate(pieces):
+        delta: Dict[str, Any] = {"content": piece}
+        if index == 0:
+            delta["role"] = "assistant"
+        yield _sse(completion_id, created, model, [{"index": 0, "delta": delta, "finish_reason": None}])
+        await asyncio.sleep(latency * 2 / 3 / len(pieces))
+    yield _sse(completion_id, created, model, [{"index": 0, "delta": {}, "finish_reason": "stop"}])
+    if include_usage:
+        yield _sse(completion_id, created, model, [], usage=_usage(body, content))
+    yield "data: [DONE]\n\n"
+
+
+def _sse(completion_id: str, created: int, model: str, choices: List[Dict[str, Any]], **extra: Any) -> str:
+    chunk = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": choices,
+        **extra,
+    }
+    return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+
+
+def _usage(body: Dict[str, Any], completion: str) -> Dict[str, int]:
+    # Rough 4-characters-per-token estimate; good enough for token histograms.
+    prompt_tokens = len(json.dumps(body.get("messages") or [], ensure_ascii=False)) // 4
+    completion_tokens = max(1, len(completion) // 4)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def _jittered(seconds: float, jitter: float) -> float:
+    if jitter <= 0:
+        return seconds
+    return max(0.0, random.uniform(seconds * (1 - jitter), seconds * (1 + jitter)))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=800.0, help="Planner call latency (default: 800)")
+    parser.add_argument("--image-latency-ms", type=float, default=4000.0, help="Image edit latency (default: 4000)")
+    parser.add_argument("--jitter", type=float, default=0.25, help="Relative latency jitter (default: 0.25)")
+    parser.add_argument("--image-bytes", type=int, default=1_500_000, help="Edited image size (default: 1.5MB)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of calls answered with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of calls answered with 429")
+    parser.add_argument("--picks", type=int, default=3, help="Products selected per plan (default: 3)")
+    parser.add_argument("--invalid-rate", type=float, default=0.0, help="Fraction of plans selecting no products")
+    parser.add_argument("--invalid-model", default="", help="Only make plans of this model invalid")
+    args = parser.parse_args()
+    uvicorn.run(create_app(MockSettings(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""Tiny in-memory server speaking enough of the Redis protocol for the backend.
+
+Stands in for Redis when trying ``BACKEND_STATE_URL=redis://...`` locally or
+in benchmarks with several workers::
+
+    python bench/redis_stand_in.py --port 6390
+    BACKEND_STATE_URL=redis://127.0.0.1:6390/0 python -m backend.serve --workers 4
+
+Supports ``PING``, ``ECHO``, ``GET``, ``SET`` (with ``EX``/``PX``/``NX``/``XX``),
+``DEL``, ``EXISTS``, ``PEXPIRE``, ``PTTL``, ``DBSIZE``, ``FLUSHDB``/``FLUSHALL``,
+``SELECT``, ``AUTH`` and ``QUIT``. Everything lives in one dict; expired keys
+are dropped lazily on access and by a periodic sweep.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+
+Reply = object
+
+
+class Store:
+    def __init__(self) -> None:
+        # key -> (value, expires_at monotonic or None)
+        self.data: Dict[bytes, Tuple[bytes, Optional[float]]] = {}
+
+    def get(self, key: bytes) -> Optional[bytes]:
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.data[key]
+            return None
+        return value
+
+    def sweep(self) -> None:
+        now = time.monotonic()
+        for key in [key for key, (_, expires_at) in self.data.items() if expires_at is not None and expires_at <= now]:
+            del self.data[key]
+
+
+class CommandError(Exception):
+    pass
+
+
+def execute(store: Store, args: List[bytes]) -> Reply:
+    command = args[0].upper().decode()
+    params = args[1:]
+    if command == "PING":
+        return params[0] if params else "PONG"
+    if command == "ECHO":
+        return params[0]
+    if command in ("SELECT", "AUTH"):
+        return "OK"
+    if command == "GET":
+        return store.get(params[0])
+    if command == "SET":
+        return _set(store, params)
+    if command == "DEL":
+        return sum(store.data.pop(key, None) is not None for key in params)
+    if command == "EXISTS":
+        return sum(store.get(key) is not None for key in params)
+    if command == "PEXPIRE":
+        value = store.get(params[0])
+        if value is None:
+            return 0
+        store.data[params[0]] = (value, time.monotonic() + int(params[1]) / 1000)
+        return 1
+    if command == "PTTL":
+        if store.get(params[0]) is None:
+            return -2
+        expires_at = store.data[params[0]][1]
+        return -1 if expires_at is None else int((expires_at - time.monotonic()) * 1000)
+    if command == "DBSIZE":
+        store.sweep()
+        return len(store.data)
+    if command in ("FLUSHDB", "FLUSHALL"):
+        store.data.clear()
+        return "OK"
+    raise CommandError(f"ERR unknown command '{command.lower()}'")
+
+
+def _set(store: Store, params: List[bytes]) -> Reply:
+    key, value = params[0], params[1]
+    expires_at: Optional[float] = None
+    only_new = only_existing = False
+    options = iter(params[2:])
+    for option in options:
+        name = option.upper()
+        if name == b"EX":
+            expires_at = time.monotonic() + int(next(options))
+        elif name == b"PX":
+            expires_at = time.monotonic() + int(next(options)) / 1000
+        elif name == b"NX":
+            only_new = True
+        elif name == b"XX":
+            only_existing = True
+        else:
+            raise CommandError("ERR syntax error")
+    exists = store.get(key) is not None
+    if (only_new and exists) or (only_existing and not exists):
+        return None
+    store.data[key] = (value, expires_at)
+    return "OK"
+
+
+def encode(reply: Reply) -> bytes:
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, str):
+        return f"+{reply}\r\n".encode()
+    if isinstance(reply, int):
+        return f":{reply}\r\n".encode()
+    if isinstance(reply, bytes):
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+    if isinstance(reply, CommandError):
+        return f"-{reply}\r\n".encode()
+    raise TypeError(f"Cannot encode {reply!r}")
+
+
+async def read_command(reader: asyncio.StreamReader) -> Optional[List[bytes]]:
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        # Inline command, e.g. typed into telnet.
+        return line.split()
+    args = []
+    for _ in range(int(line[1:])):
+        header = await reader.readline()
+        length = int(header[1:])
+        args.append((await reader.readexactly(length + 2))[:-2])
+    return args
+
+
+async def serve(host: str, port: int) -> None:
+    store = Store()
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                args = await read_command(reader)
+                if not args:
+                    break
+                if args[0].upper() == b"QUIT":
+                    writer.write(encode("OK"))
+                    break
+                try:
+                    reply = execute(store, args)
+                except CommandError as error:
+                    reply = error
+                except (IndexError, ValueError, StopIteration):
+                    reply = CommandError("ERR wrong number of arguments or invalid value")
+                writer.write(encode(reply))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def sweep() -> None:
+        while True:
+            await asyncio.sleep(1.0)
+            store.sweep()
+
+    server = await asyncio.start_server(handle, host, port)
+    sweeper = asyncio.create_task(sweep())
+    print(f"Redis stand-in listening on {host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        sweeper.cancel()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="In-memory Redis-protocol stand-in.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
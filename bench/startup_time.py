@@ -0,0 +1,125 @@
+"""Measure how long a backend worker takes to become ready.
+
+Reports, each as the median of several fresh interpreters:
+
+* importing ``backend.main`` (what every worker pays before serving);
+* creating the model clients on first use (deferred off the startup path);
+* one scrypt key derivation (what every worker would pay without
+  ``python -m backend.serve`` or ``BACKEND_ENV_KEY_CACHE``);
+
+and the wall time from launching ``python -m backend.serve --workers N`` until
+all N workers answer ``/metrics``::
+
+    python bench/startup_time.py --runs 5 --workers 4
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+_PID = re.compile(r'^backend_process_resident_memory_bytes\{pid="(\d+)"\}', re.M)
+
+_PROBE = """
+import json, os, time
+started = time.perf_counter()
+import backend.main
+imported = time.perf_counter()
+from backend import image_editor, llm_planner
+image_editor.get_client()
+llm_planner.get_client()
+clients = time.perf_counter()
+from backend.secure_env import _derive_key
+_derive_key("benchmark", os.urandom(16))
+derived = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "first_clients_ms": (clients - imported) * 1000,
+    "key_derivation_ms": (derived - clients) * 1000,
+}))
+"""
+
+
+def bench_env() -> Dict[str, str]:
+    env = dict(os.environ)
+    env.setdefault("BACKEND_ENV_DECRYPTED", "1")
+    env.setdefault("OPENAI_API_KEY", "bench")
+    env.setdefault("OPENROUTER_API_KEY", "bench")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(ROOT), env.get("PYTHONPATH")]))
+    return env
+
+
+def probe(runs: int) -> Dict[str, float]:
+    samples: Dict[str, List[float]] = {}
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", _PROBE], env=bench_env(), cwd=ROOT, check=True, capture_output=True, text=True
+        ).stdout
+        for name, value in json.loads(output.strip().splitlines()[-1]).items():
+            samples.setdefault(name, []).append(value)
+    return {name: round(statistics.median(values), 1) for name, values in samples.items()}
+
+
+def boot(workers: int, port: int, runs: int, timeout: float) -> float:
+    durations = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "backend.serve", "--port", str(port), "--workers", str(workers),
+             "--log-level", "warning"],
+            env=bench_env(),
+            cwd=ROOT,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            durations.append(_wait_for_workers(port, workers, started, timeout))
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+    return round(statistics.median(durations) * 1000, 1)
+
+
+def _wait_for_workers(port: int, workers: int, started: float, timeout: float) -> float:
+    # Each scrape is answered by one worker; ready once every worker has answered.
+    seen = set()
+    with httpx.Client(timeout=1.0) as client:
+        while time.perf_counter() - started < timeout:
+            try:
+                response = client.get(f"http://127.0.0.1:{port}/metrics", headers={"Connection": "close"})
+                seen.update(_PID.findall(response.text))
+                if len(seen) >= workers:
+                    return time.perf_counter() - started
+            except httpx.HTTPError:
+                time.sleep(0.02)
+    raise SystemExit(f"Server did not become ready within {timeout}s ({len(seen)}/{workers} workers)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure backend import and boot-to-ready time.")
+    parser.add_argument("--runs", type=int, default=5, help="Repetitions per measurement (default: 5)")
+    parser.add_argument("--workers", type=int, default=2, help="Workers for the boot measurement (default: 2)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--skip-boot", action="store_true", help="Only measure import and client creation")
+    args = parser.parse_args()
+
+    report: Dict[str, float] = probe(args.runs)
+    if not args.skip_boot:
+        report[f"boot_to_ready_ms_{args.workers}_workers"] = boot(args.workers, args.port, args.runs, args.timeout)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
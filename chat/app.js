@@ -8,8 +8,13 @@ const previewImage = document.getElementById('previewImage');
 const previewName = document.getElementById('previewName');
 const removeImageBtn = document.getElementById('removeImage');
 
-let selectedImageDataUrl = null;
+// The photo is uploaded as soon as it is attached; chat requests only carry its ID.
+let selectedImagePreviewUrl = null;
+let selectedImageUpload = null;
 let selectedImageName = '';
+// Assigned by the backend after the first reply; it then keeps the conversation
+// history, so later requests only carry the new message.
+let sessionId = null;
 
 const messages = [];
 updateImagePreview();
@@ -56,7 +61,7 @@ removeImageBtn.addEventListener('click', () => {
 chatForm.addEventListener('submit', async (event) => {
   event.preventDefault();
   const text = messageInput.value.trim();
-  if (!text && !selectedImageDataUrl) {
+  if (!text && !selectedImagePreviewUrl) {
     messageInput.focus();
     return;
   }
@@ -64,13 +69,14 @@ chatForm.addEventListener('submit', async (event) => {
   const userMessage = createMessage({
     role: 'user',
     text,
-    imageUrl: selectedImageDataUrl,
+    imageUrl: selectedImagePreviewUrl,
   });
+  const imageUpload = selectedImageUpload;
 
   appendMessage(userMessage);
   resetComposer();
 
-  const historyPayload = serializeHistory();
+  const historyPayload = sessionId ? [] : serializeHistory();
   const placeholder = createMessage(
     {
       role: 'assistant',
@@ -80,28 +86,46 @@ chatForm.addEventListener('submit', async (event) => {
   );
   appendMessage(placeholder);
 
+  let streamed = {
+    role: 'assistant',
+    text: '',
+    imageUrl: null,
+    products: [],
+  };
+  const updateStreamed = (patch) => {
+    streamed = { ...streamed, ...patch };
+    replaceMessage(placeholder.id, createMessage(streamed, placeholder.id));
+  };
+
   try {
-    const response = await sendChatRequest({
+    const payload = {
       message: userMessage.text,
-      imageUrl: userMessage.imageUrl,
+      imageId: imageUpload ? await imageUpload : null,
+      sessionId,
       history: historyPayload,
-    });
-    const assistantMessage = createMessage(
-      {
-        role: 'assistant',
-        text: response.text,
-        imageUrl: response.imageUrl || null,
-        products: response.products || [],
+    };
+    await streamChatRequest(payload, {
+      onDelta: (text) => updateStreamed({ text: streamed.text + text }),
+      onMessage: (text) => updateStreamed({ text }),
+      onProducts: (products) => updateStreamed({ products }),
+      onImage: (imageUrl) => updateStreamed({ imageUrl: imageUrl || null }),
+      onDone: (data) => {
+        sessionId = data.sessionId || sessionId;
       },
-      placeholder.id,
-    );
-    replaceMessage(placeholder.id, assistantMessage);
+    });
+    if (!streamed.text) {
+      updateStreamed({ text: '추천 제품을 확인해보세요.' });
+    }
   } catch (error) {
     console.error(error);
     const failMessage = createMessage(
       {
         role: 'assistant',
-        text: '잠시 후 다시 시도해주세요. 네트워크 상태를 확인한 뒤 다시 요청 바랍니다.',
+        // 429 means the server is shedding load; its message already says to retry later.
+        text:
+          error.status === 429
+            ? error.message
+            : '잠시 후 다시 시도해주세요. 네트워크 상태를 확인한 뒤 다시 요청 바랍니다.',
       },
       placeholder.id,
     );
@@ -150,7 +174,7 @@ function createMessageElement(message) {
     figure.className = 'message-image';
 
     const img = document.createElement('img');
-    img.src = message.imageUrl;
+    img.src = resolveBackendUrl(message.imageUrl);
     img.alt = message.role === 'assistant' ? 'AI가 생성한 인테리어 이미지' : '사용자 첨부 이미지';
     figure.appendChild(img);
 
@@ -235,16 +259,18 @@ function replaceMessage(id, nextMessage) {
 
 function resetComposer() {
   chatForm.reset();
-  selectedImageDataUrl = null;
+  // The preview object URL now belongs to the sent message, so it is not revoked.
+  selectedImagePreviewUrl = null;
+  selectedImageUpload = null;
   selectedImageName = '';
   updateImagePreview();
   autoResizeTextarea();
 }
 
 function updateImagePreview() {
-  const hasImage = Boolean(selectedImageDataUrl);
+  const hasImage = Boolean(selectedImagePreviewUrl);
   if (hasImage) {
-    previewImage.src = selectedImageDataUrl;
+    previewImage.src = selectedImagePreviewUrl;
     previewName.textContent = selectedImageName || '첨부된 이미지';
     imagePreviewBar.hidden = false;
     imagePreviewBar.style.display = 'flex';
@@ -259,7 +285,11 @@ function updateImagePreview() {
 }
 
 function clearImageSelection() {
-  selectedImageDataUrl = null;
+  if (selectedImagePreviewUrl) {
+    URL.revokeObjectURL(selectedImagePreviewUrl);
+  }
+  selectedImagePreviewUrl = null;
+  selectedImageUpload = null;
   selectedImageName = '';
   imageInput.value = '';
   updateImagePreview();
@@ -285,17 +315,25 @@ function serializeHistory() {
     .map(({ role, text, imageUrl }) => ({
       role,
       text,
-      imageUrl: imageUrl || undefined,
+      // Local object URLs mean nothing to the server.
+      imageUrl: imageUrl && !imageUrl.startsWith('blob:') ? imageUrl : undefined,
     }));
 }
 
-function readFileAsDataUrl(file) {
-  return new Promise((resolve, reject) => {
-    const reader = new FileReader();
-    reader.onload = () => resolve(reader.result);
-    reader.onerror = (error) => reject(error);
-    reader.readAsDataURL(file);
+async function uploadImage(file) {
+  const response = await fetch(backendEndpoint('/images'), {
+    method: 'POST',
+    headers: {
+      'Content-Type': file.type,
+    },
+    body: file,
   });
+  if (!response.ok) {
+    const errorText = await response.text().catch(() => '');
+    throw new Error(errorText || 'Failed to upload image');
+  }
+  const data = await response.json();
+  return data.imageId;
 }
 
 async function attachImageFile(file, fallbackName = '') {
@@ -309,8 +347,14 @@ async function attachImageFile(file, fallbackName = '') {
     return false;
   }
   try {
-    selectedImageDataUrl = await readFileAsDataUrl(file);
+    if (selectedImagePreviewUrl) {
+      URL.revokeObjectURL(selectedImagePreviewUrl);
+    }
+    selectedImagePreviewUrl = URL.createObjectURL(file);
     selectedImageName = file.name || fallbackName || '첨부된 이미지';
+    selectedImageUpload = uploadImage(file);
+    // Failures surface when the message is sent; avoid unhandled rejection noise.
+    selectedImageUpload.catch((error) => console.error(error));
     updateImagePreview();
     return true;
   } catch (error) {
@@ -339,14 +383,21 @@ function extractImageFromClipboard(clipboardData) {
 
 const BACKEND_BASE_URL = window.__BACKEND_URL__ || 'http://localhost:8001';
 
-async function sendChatRequest(payload) {
-  const endpoint = BACKEND_BASE_URL
-    ? `${BACKEND_BASE_URL.replace(/\/$/, '')}/chat`
-    : '/chat';
-  const response = await fetch(endpoint, {
+function backendEndpoint(path) {
+  return BACKEND_BASE_URL ? `${BACKEND_BASE_URL.replace(/\/$/, '')}${path}` : path;
+}
+
+// Images stored by the backend come back as short "/images/<id>" paths.
+function resolveBackendUrl(url) {
+  return url && url.startsWith('/images/') ? backendEndpoint(url) : url;
+}
+
+async function streamChatRequest(payload, handlers) {
+  const response = await fetch(backendEndpoint('/chat/stream'), {
     method: 'POST',
     headers: {
       'Content-Type': 'application/json',
+      Accept: 'text/event-stream',
     },
     body: JSON.stringify(payload),
   });
@@ -356,12 +407,66 @@ async function sendChatRequest(payload) {
     throw new Error(errorText || 'Failed to fetch from backend');
   }
 
-  const data = await response.json();
-  return {
-    text: data.text || '',
-    imageUrl: data.imageUrl || null,
-    products: Array.isArray(data.products) ? data.products : [],
-  };
+  if (!response.body || !window.TextDecoderStream) {
+    // Without readable streams the events arrive all at once; parse them from the
+    // buffered body rather than asking the server to run the request again.
+    const text = await response.text();
+    text.split('\n\n').forEach((rawEvent) => dispatchServerEvent(rawEvent, handlers));
+    return;
+  }
+
+  const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+  let buffer = '';
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += value;
+    let boundary = buffer.indexOf('\n\n');
+    while (boundary !== -1) {
+      dispatchServerEvent(buffer.slice(0, boundary), handlers);
+      buffer = buffer.slice(boundary + 2);
+      boundary = buffer.indexOf('\n\n');
+    }
+  }
+}
+
+function dispatchServerEvent(rawEvent, handlers) {
+  let eventName = 'message';
+  const dataLines = [];
+  rawEvent.split('\n').forEach((line) => {
+    if (line.startsWith('event:')) {
+      eventName = line.slice(6).trim();
+    } else if (line.startsWith('data:')) {
+      dataLines.push(line.slice(5).trim());
+    }
+  });
+  if (!dataLines.length) return;
+  const data = JSON.parse(dataLines.join('\n'));
+
+  switch (eventName) {
+    case 'delta':
+      handlers.onDelta(data.text || '');
+      break;
+    case 'message':
+      handlers.onMessage(data.text || '');
+      break;
+    case 'products':
+      handlers.onProducts(Array.isArray(data.products) ? data.products : []);
+      break;
+    case 'image':
+      handlers.onImage(data.imageUrl || null);
+      break;
+    case 'done':
+      handlers.onDone(data);
+      break;
+    case 'error': {
+      const error = new Error(data.detail || 'Failed to fetch from backend');
+      error.status = data.status;
+      throw error;
+    }
+    default:
+      break;
+  }
 }
 
 function createProductImageFallback(titleText) {
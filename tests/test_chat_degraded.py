@@ -0,0 +1,83 @@
+"""A shed image edit must not discard the reply the planner already produced."""
+
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+
+os.environ.setdefault("BACKEND_ENV_DECRYPTED", "1")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("OPENROUTER_API_KEY", "test")
+os.environ.setdefault("BACKEND_IMAGE_WORKERS", "0")
+os.environ.setdefault("BLOB_STORE_DIR", tempfile.mkdtemp(prefix="blobs-"))
+os.environ.setdefault("BACKEND_CACHE_DIR", tempfile.mkdtemp(prefix="cache-"))
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import main
+from backend.llm_planner import PlanningResult
+from backend.metrics import FALLBACKS
+from backend.scheduler import Overloaded
+
+ROOM_IMAGE_URL = "https://example.com/room.jpg"
+REPLY = "거실에 어울리는 제품을 골랐어요."
+
+
+@pytest.fixture
+def shed_image_edits(monkeypatch):
+    async def plan(user_message, intent, candidate_products, on_message_delta=None, **_):
+        if on_message_delta is not None:
+            await on_message_delta(REPLY)
+        return PlanningResult(
+            selected_product_ids=[str(product["id"]) for product in candidate_products[:2]],
+            assistant_message=REPLY,
+        )
+
+    async def prepare(image_url):
+        return "data:image/jpeg;base64,/9j/"
+
+    async def edit(*args, **kwargs):
+        raise Overloaded("image lane is full", retry_after=3.0)
+
+    monkeypatch.setattr(main, "plan_products_with_llm", plan)
+    monkeypatch.setattr(main, "prepare_room_image", prepare)
+    monkeypatch.setattr(main, "edit_room_image", edit)
+    with TestClient(main.app) as client:
+        yield client
+
+
+def _shed_count() -> float:
+    return FALLBACKS.value(component="image_edit", reason="Overloaded")
+
+
+def test_chat_replies_without_image_when_edit_is_shed(shed_image_edits):
+    before = _shed_count()
+    response = shed_image_edits.post(
+        "/chat", json={"message": "거실 소파 추천해줘", "imageUrl": ROOM_IMAGE_URL, "skipCache": True}
+    )
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["text"] == REPLY
+    assert len(body["products"]) == 2
+    assert body["imageUrl"] is None
+    assert _shed_count() == before + 1
+
+
+def test_stream_ends_with_done_when_edit_is_shed(shed_image_edits):
+    response = shed_image_edits.post(
+        "/chat/stream", json={"message": "침실 조명 추천해줘", "imageUrl": ROOM_IMAGE_URL, "skipCache": True}
+    )
+
+    assert response.status_code == 200
+    events = {}
+    for raw_event in response.text.strip().split("\n\n"):
+        name_line, data_line = raw_event.split("\n", 1)
+        events[name_line[len("event: ") :]] = json.loads(data_line[len("data: ") :])
+    assert "error" not in events
+    assert events["message"]["text"] == REPLY
+    assert len(events["products"]["products"]) == 2
+    assert events["image"]["imageUrl"] is None
+    assert "done" in events